@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Framing benchmark
+-----------------
+
+Round trips payloads of increasing size through ``net.pass_through`` between
+two peers running in this process.
+
+.. code-block:: bash
+
+    PYTHONPATH=. python benchmarks/framing.py
+"""
+from __future__ import print_function
+
+# std imports
+import time
+
+# package
+import net
+
+
+SIZES = [
+    ('1 KB', 1024),
+    ('1 MB', 1024 * 1024),
+    ('100 MB', 100 * 1024 * 1024),
+]
+
+
+def bench(peer, size, rounds):
+    """
+    Time a number of round trips of a payload to the peer.
+
+    :param peer: (host, port)
+    :param size: payload size in bytes
+    :param rounds: number of round trips
+    :return: seconds per round trip
+    """
+    payload = 'x' * size
+
+    start = time.time()
+    for _ in range(rounds):
+        response = net.pass_through(payload, peer=peer)
+        assert len(response) == size
+    return (time.time() - start) / rounds
+
+
+def main():
+    net.Peer()
+    remote = net.Peer(test=True)
+    peer = (remote.host, remote.port)
+
+    for label, size in SIZES:
+        rounds = max(1, min(1000, (10 * 1024 * 1024) // size))
+        seconds = bench(peer, size, rounds)
+        print(
+            "{0:>8}: {1:10.3f} ms/round trip {2:10.1f} MB/s".format(
+                label, seconds * 1000, (2 * size / seconds) / (1024 * 1024)
+            )
+        )
+
+
+if __name__ == '__main__':
+    main()
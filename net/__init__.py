@@ -1,6 +1,5 @@
 # -*- coding: utf-8 -*-
 """Top-level package for net."""
-from __future__ import print_function
 
 __all__ = [
     'connect',
@@ -19,7 +18,20 @@ __all__ = [
     'subscribe',
     'HOST_IP',
     'event',
-    'connections'
+    'connections',
+    'busy',
+    'unavailable',
+    'refused',
+    'PeerBusy',
+    'PeerUnavailable',
+    'process_pool',
+    'batch',
+    'route',
+    'flush',
+    'ResponseCache',
+    'DeadlineExceeded',
+    'context',
+    'RequestContext',
 ]
 
 __author__ = 'Alex Hatfield'
@@ -27,7 +39,11 @@ __email__ = 'alex@hatfieldfx.com'
 __version__ = '0.6.2'
 
 from .environment import *
+from .errors import *
 from .peer import *
 from .api import *
 from .connections import *
 from .defaults import *
+
+# net.map is left out of __all__ so star imports don't shadow the builtin
+from .api import map
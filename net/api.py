@@ -9,18 +9,26 @@ Contains the general network interactions for net.
 # std imports
 import re
 import math
+import time
+import socket
 import threading
 import subprocess
+from concurrent import futures
 
 # package imports
 import net
 
 # local imports
-from net.imports import ConnectionRefusedError, PermissionError
+from net.peer import breakers, replicas, rings, streams
+from net.peer.context import budget
 
 __all__ = [
     'peers',
-    'peer_group'
+    'peer_group',
+    'route',
+    'flush',
+    'batch',
+    'Batch',
 ]
 
 
@@ -32,6 +40,15 @@ IP_REGEX = re.compile(r'\d+\.\d+\.\d\.\d+')
 # cache
 PEERS = None
 
+# threads making remote calls in the background
+EXECUTOR = None
+
+# threads sending the requests of hedged group calls
+HEDGE_EXECUTOR = None
+
+# connection running batches on the remote peer
+BATCH_CONNECTION = 'net.defaults.handlers.batch_handler'
+
 
 def peer_group(name=None, hubs_only=False, on_host=False):
     """
@@ -71,6 +88,40 @@ def peer_group(name=None, hubs_only=False, on_host=False):
     return group_peers
 
 
+def route(group=None, key=None):
+    """
+    Get the peer of a group to send a call to. Of two peers drawn at random the
+    least busy one is picked, going by the requests this peer is still waiting
+    on, the load the peers reported with their last responses and how fast
+    they answered. Peers whose circuit breaker is open are only picked if
+    there is nothing else.
+
+    With a ``key`` the peer owning the key on the consistent hash ring of the
+    group is picked instead, every call for the key goes to the same peer.
+
+    .. code-block:: python
+
+        # instead of always hammering net.peer_group()[0]
+        your_function(some_value, peer=net.route())
+
+        # a peer in group1
+        your_function(some_value, peer=net.route("group1"))
+
+        # the peer holding the state of an entity
+        your_function(entity_id, peer=net.route("shards", key=entity_id))
+
+    :param group: name of the group or list of ``net.Peer`` or (host, port),
+     defaults to the group of this peer
+    :param key: Anything, routes by the hash ring of the group if given
+    :return: ``net.Peer`` or (host, port), None if the group has no peers
+    """
+    if key is not None:
+        return rings.ring(group).lookup(key)
+
+    peers = replicas.replicas(group)
+    return peers[0] if peers else None
+
+
 def peers(refresh=False, groups=None, on_host=False, hubs_only=False):
     """
     Get a list of all peers on your network. This is a cached values since the
@@ -135,6 +186,244 @@ def peers(refresh=False, groups=None, on_host=False, hubs_only=False):
     return PEERS
 
 
+def flush(time_out=None):
+    """
+    Wait until every triggered event has been delivered to the subscribed
+    peers. Events are delivered in the background, call this before shutting
+    down so none of them are lost.
+
+    .. code-block:: python
+
+        atexit.register(net.flush, 5)
+
+    :param time_out: seconds to wait, None waits until they are delivered
+    :return: bool, False if there were events left when the time ran out
+    """
+    return net.Peer().events.flush(time_out)
+
+
+def client_executor():
+    """
+    Get the shared thread pool that makes remote calls in the background.
+
+    :return: ``concurrent.futures.ThreadPoolExecutor``
+    """
+    global EXECUTOR
+
+    with LOCK:
+        if EXECUTOR is None:
+            EXECUTOR = futures.ThreadPoolExecutor(max_workers=max(net.CLIENT_LIMIT, 1))
+
+    return EXECUTOR
+
+
+def hedge_executor():
+    """
+    Get the thread pool that sends the requests of group calls and
+    ``net.map``. It is kept apart from the client threads, a group call or
+    ``net.map`` made in the background waits on its requests and would
+    otherwise hold the thread they need to run.
+
+    :return: ``concurrent.futures.ThreadPoolExecutor``
+    """
+    global HEDGE_EXECUTOR
+
+    with LOCK:
+        if HEDGE_EXECUTOR is None:
+            HEDGE_EXECUTOR = futures.ThreadPoolExecutor(max_workers=max(net.CLIENT_LIMIT, 1))
+
+    return HEDGE_EXECUTOR
+
+
+# noinspection PyShadowingBuiltins
+def map(func, peers, *args, **kwargs):
+    """
+    Call a connection on many peers at the same time. The calls are started
+    straight away and the responses are handed back as (peer, response) pairs
+    in the order they arrive. A peer that fails or can't be reached hands back
+    the exception in place of the response instead of raising it, so one bad
+    peer never hides the rest. Peers that haven't answered when the deadline
+    passes hand back a ``socket.timeout``.
+
+    .. code-block:: python
+
+        # health check the whole group, giving up on slow peers after a second
+        for peer, info in net.map(net.info, net.peer_group(), deadline=1):
+            if isinstance(info, Exception):
+                print("{0} is down".format(peer))
+
+        # or collect everything keyed by peer
+        results = dict(net.map(your_function, net.peer_group(), some_value))
+
+    :param func: connected function
+    :param peers: list of ``net.Peer`` or (host, port)
+    :param args: positional arguments to pass to the connection
+    :param kwargs: keyword arguments to pass to the connection, ``deadline`` is
+     the number of seconds to wait for all of the peers
+    :return: generator of (peer, response or exception)
+    """
+    # calls made while answering a request only get what is left of its deadline
+    deadline = budget(kwargs.pop('deadline', None))
+    end = time.time() + deadline if deadline else None
+
+    def call(peer):
+        call_kwargs = dict(kwargs, peer=peer)
+
+        # never leave a socket waiting past the deadline
+        if end is not None and not call_kwargs.get('time_out'):
+            call_kwargs['time_out'] = max(end - time.time(), 0.001)
+
+        return func(*args, **call_kwargs)
+
+    executor = hedge_executor()
+    pending = {}
+    for peer in peers:
+        pending[executor.submit(call, peer)] = peer
+
+    def results():
+        try:
+            time_out = max(end - time.time(), 0) if end is not None else None
+            for future in futures.as_completed(list(pending), timeout=time_out):
+                peer = pending.pop(future)
+                try:
+                    yield peer, future.result()
+                except Exception as err:
+                    yield peer, err
+
+        except futures.TimeoutError:
+            for future, peer in list(pending.items()):
+                future.cancel()
+                yield peer, socket.timeout(
+                    "Peer {0} did not answer within {1} seconds.".format(peer, deadline)
+                )
+
+    return results()
+
+
+class Batch(object):
+    """
+    Collects calls to a single peer and sends them in one request when the
+    batch is closed. Use ``net.batch`` to create one.
+    """
+
+    def __init__(self, peer, parallel=False, time_out=None):
+        self._peer = peer
+        self._parallel = parallel
+        self._time_out = time_out
+        self._calls = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # nothing is sent if the block raised
+        if exc_type is not None:
+            for future, _, _, _ in self._calls:
+                future.cancel()
+            return
+
+        self.send()
+
+    def call(self, func, *args, **kwargs):
+        """
+        Add a call to the batch.
+
+        :param func: connected function or connection name
+        :param args: positional arguments to pass to the connection
+        :param kwargs: keyword arguments to pass to the connection
+        :return: ``concurrent.futures.Future`` resolved when the batch is sent
+        """
+        connection = getattr(func, 'connection', func)
+
+        # batched calls are sent in one message, nothing can be streamed
+        args, kwargs = streams.materialize(args, kwargs)
+
+        future = futures.Future()
+        self._calls.append((future, connection, args, kwargs))
+        return future
+
+    def send(self):
+        """
+        Send every call added so far in a single request and resolve their
+        futures. Remote errors and flags are handled per call, a call that
+        failed raises on its own ``result``.
+
+        :return: None
+        """
+        calls, self._calls = self._calls, []
+        if not calls:
+            return
+
+        local_peer = net.Peer()
+        host, port = local_peer.address(self._peer)
+
+        kwargs = {'parallel': self._parallel}
+        if self._time_out:
+            kwargs['time_out'] = self._time_out
+
+        try:
+            responses = local_peer.server.request(
+                host,
+                port,
+                BATCH_CONNECTION,
+                ([
+                    {'connection': connection, 'args': args, 'kwargs': call_kwargs}
+                    for _, connection, args, call_kwargs in calls
+                ],),
+                kwargs
+            )
+            local_peer.process_error(responses)
+
+            # the peer was too busy or is down, nothing was run
+            if responses in (local_peer.get_flag('BUSY'), local_peer.get_flag('UNAVAILABLE')):
+                local_peer.process_response(responses, BATCH_CONNECTION, self._peer)
+
+        except Exception as err:
+            for future, _, _, _ in calls:
+                future.set_exception(err)
+            return
+
+        # peers running an older version of net don't know about batches
+        if responses == local_peer.get_flag('INVALID_CONNECTION'):
+            responses = None
+
+        for index, (future, connection, args, call_kwargs) in enumerate(calls):
+            try:
+                if responses is None:
+                    response = local_peer.execute(self._peer, connection, args, call_kwargs)
+                else:
+                    response = responses[index]
+
+                local_peer.process_error(response)
+                future.set_result(local_peer.process_response(response, connection, self._peer))
+
+            except Exception as err:
+                future.set_exception(err)
+
+
+def batch(peer, parallel=False, time_out=None):
+    """
+    Send many calls to the same peer in a single round trip. Calls are
+    collected inside the block and sent when it exits, each call returns a
+    ``concurrent.futures.Future`` holding its own response. The peer runs the
+    calls in order, or all at the same time with ``parallel=True``.
+
+    .. code-block:: python
+
+        with net.batch(peer) as calls:
+            info = calls.call(net.info)
+            value = calls.call(your_function, some_value)
+
+        print(info.result(), value.result())
+
+    :param peer: ``net.Peer`` or (host, port)
+    :param parallel: run the calls at the same time on the peer
+    :param time_out: seconds to wait for the whole batch
+    :return: ``Batch``
+    """
+    return Batch(peer, parallel, time_out)
+
+
 def local_network():
     """
     Runs ``arp -a`` to get all hosts.
@@ -173,12 +462,19 @@ def find_peers_in_block(ips, groups=None, hubs_only=False):
             if port == server.port and address == server.host:
                 continue
 
+            # skip known peers that failed too many requests in a row until
+            # their circuit breaker lets a probe through
+            if not breakers.available(address, port):
+                continue
+
             try:
                 # ping the peer and if it responds with the proper info,
                 # register it. Shut off the logger for this so we dont spam
-                # the console.
+                # the console. Pings skip the circuit breakers, an empty port
+                # isn't a peer that went down.
                 net.LOGGER.disabled = True
-                info = net.info(peer=(address, port), time_out=0.1)
+                with breakers.scanning():
+                    info = net.info(peer=(address, port), time_out=0.1)
                 net.LOGGER.disabled = False
 
                 # skip registering this if the info is already in the
@@ -203,6 +499,8 @@ def find_peers_in_block(ips, groups=None, hubs_only=False):
                     subscriptions=info['subscriptions'],
                     connections=info['connections'],
                     flags=info['flags'],
+                    codecs=info.get('codecs'),
+                    socket=info.get('socket'),
                 )
 
                 # acquire the lock and register
@@ -11,62 +11,28 @@ __all__ = [
 ]
 
 # std imports
-from functools import wraps
+import time
+from functools import wraps, partial
+from collections.abc import Iterator
 
 # package imports
 from net import LOGGER
 
 # package imports
 from net import Peer
+from net.api import client_executor, hedge_executor
+from net.peer import balancer, caches, flights, replicas, rings
+from net.peer.context import budget
+from net.peer.executors import process_connection
 
 
 # noinspection PyShadowingNames
-def connect(tag=None):
+def connect(tag=None, executor=None, cache=None, memoize=None, single_flight=False):
     """
     Registers a function as a connection. This will be tagged and registered
-    with the Peer server. The tag is a base64 encoded path to the function or
-    can be manually tagged with the tag parameter. Tagging a named function
-    allows you to interconnect functions between code bases.
-
-    For example, a connected function with no tag is tied to the
-    ``func.__module__`` + ``func.__name__``. This means the peers will only know
-    which functions are compatible based on the namespace staying the same.
-
-    .. code-block:: python
-
-        # app version 1 running on PeerA
-        app/
-          module/
-            function
-
-        # app version 2 running on PeerB
-        app/
-          module/
-            function2 <- # renamed from function
-
-    In the above example, PeerA could make a request to PeerB to execute
-    "app.module.function". But that function no longer exists as far as PeerB is
-    concerned. The source code and functionality could be exactly the same, but
-    the logical location is different and therefore will fail.
-
-    .. code-block:: python
-
-        # app version 1 running on PeerA
-        app/
-          module/
-            function (tagged: "MyTaggedFunction")
-
-        # app version 2 running on PeerB
-        app/
-          module/
-            function2 (tagged: "MyTaggedFunction")
-
-    In the above example, we have tagged function and function2 with the same
-    tag, "MyTaggedFunction". Now when PeerA requests to execute, it will request
-    that PeerB executes "MyTaggedFunction" which is attached to the new renamed
-    function.
-
-    Standard no tagging
+    with the Peer server. The tag is the path to the function, or the tag
+    parameter to tie together functions that live in different places in
+    different versions of an application.
 
     .. code-block:: python
 
@@ -74,28 +40,63 @@ def connect(tag=None):
         def your_function(some_value):
             return some_value
 
-    Custom tagging
-
-    .. code-block:: python
-
-        @net.connect("MyTaggedFunction")
-        def your_function(some_value):
-            return some_value
+        your_function(some_value, peer=peer)
+
+    Calls take ``peer`` or ``group`` to pick where they run, and ``time_out``,
+    ``wait``, ``hedge_after``, ``retries`` and ``route_key`` to steer them.
+    Every connection has ``async_call``, ``invalidate`` and ``forget``. See
+    the usage documentation for streaming, process pools, caching, deadlines
+    and groups.
+
+    :param tag: str
+    :param executor: None to run requests on the server threads, 'process' or
+        the name of a process pool to run them in worker processes
+    :param cache: None, True for the default cache, seconds to keep responses
+        for or a ``net.ResponseCache``
+    :param memoize: None, True for the default cache, seconds to keep encoded
+        responses for or a ``net.ResponseCache``
+    :param single_flight: bool, run identical requests that overlap only once
     """
+    response_cache = caches.response_cache(cache)
+    client_flight = flights.SingleFlight() if single_flight else None
 
     def wrapper(func):
         # grab the local peer
         peer = Peer()
 
+        # requests to the connection are run by the process pool
+        handler = func
+        if executor and executor != 'thread':
+            handler = process_connection(func, executor)
+
         # register the function with the peer handler
-        connection_name = peer.register_connection(func, tag if tag else None)
+        connection_name = peer.register_connection(handler, tag if tag else None)
+
+        # requests from other peers are answered from the memo
+        memo = caches.memoize(handler, memoize)
+
+        # identical requests from other peers share a single run
+        if single_flight:
+            flights.register(handler)
 
         @wraps(func)
         def interface(*args, **kwargs):
 
+            # hand the call to the client threads and return straight away,
+            # they don't see the request being answered so it gets its deadline.
+            if not kwargs.pop('wait', True):
+                kwargs['time_out'] = budget(kwargs.get('time_out'))
+                return client_executor().submit(interface, *args, **kwargs)
+
+            # calls to a group are answered by whichever of its peers is first
+            if 'group' in kwargs:
+                return group_call(args, kwargs)
+
             # execute the function as is if this is being run by the local peer
             if not kwargs.get('peer'):
                 LOGGER.debug("LOCAL request {0}".format(peer))
+                kwargs.pop('peer', None)
+                kwargs.pop('time_out', None)
 
                 # run the target connection locally
                 response = func(*args, **kwargs)
@@ -109,20 +110,174 @@ def connect(tag=None):
                 return response
 
             target = kwargs.get('peer')
+            key = call_key(target, args, kwargs)
+
+            # repeated calls are answered from the cache
+            if key is not None and response_cache is not None:
+                hit, response = response_cache.get(key)
+                if hit:
+                    LOGGER.debug("CACHED request {0}".format(target))
+                    return response
+
+            # identical calls from other threads share a single round trip,
+            # streamed responses can only be read once so those can't.
+            if key is not None and client_flight is not None:
+                response = client_flight.do(
+                    key, partial(remote, target, args, kwargs),
+                    lambda shared: not isinstance(shared, Iterator),
+                    budget(kwargs.get('time_out')),
+                )
+            else:
+                response = remote(target, args, kwargs)
+
+            if key is not None and response_cache is not None and not isinstance(response, Iterator):
+                response_cache.put(key, response)
+
+            # return the response
+            return response
+
+        def remote(target, args, kwargs):
+            """
+            Run the connection on a remote peer.
+
+            :return: response
+            """
             LOGGER.debug("REMOTE request {0}".format(target))
 
             # clean out the peer argument from the kwargs and make request
             response = peer.execute(target, connection_name, args, kwargs)
 
             # handle error catching
-            if isinstance(response, dict):
-                if response.get('payload') and response.get('payload') == 'error':
-                    # unpack the traceback and raise an exception
-                    full_error = "RemoteError\n" + response['traceback']
-                    LOGGER.error(full_error)
-                    raise Exception(full_error)
+            peer.process_error(response)
 
-            # return the response
             return response
+
+        def group_call(args, kwargs):
+            """
+            Run the connection on one of the peers of a group, hedging slow
+            requests and retrying failed ones on another peer. Calls with a
+            ``route_key`` go to the peer owning the key on the hash ring of
+            the group, and are only retried on the peers after it if asked to.
+
+            :return: response
+            """
+            group = kwargs.pop('group')
+            routed = 'route_key' in kwargs
+            route_key = kwargs.pop('route_key', None)
+            hedge_after = kwargs.pop('hedge_after', None)
+            retries = kwargs.pop('retries', 0 if routed else 1)
+            time_out = budget(kwargs.pop('time_out', None))
+            end = time.time() + time_out if time_out else None
+
+            def call(target):
+                call_kwargs = dict(kwargs, peer=target)
+
+                # never leave a socket waiting past the deadline of the call
+                if end is not None:
+                    call_kwargs['time_out'] = max(end - time.time(), 0.001)
+
+                # peers picked by their load report it with the response
+                if routed:
+                    return interface(*args, **call_kwargs)
+
+                with balancer.routing():
+                    return interface(*args, **call_kwargs)
+
+            LOGGER.debug("GROUP request {0}".format(group))
+
+            if routed:
+                targets = rings.ring(group).preference(route_key, retries + 1)
+            else:
+                targets = replicas.replicas(group)
+
+            return replicas.hedge(
+                hedge_executor(),
+                call,
+                targets,
+                hedge_after=hedge_after,
+                retries=retries,
+                time_out=time_out,
+                budget=replicas.retry_budget(group),
+            )
+
+        def call_key(target, args, kwargs):
+            """
+            Key of a remote call in the response cache and single flight.
+
+            :return: hashable or None if the call can't be shared
+            """
+            if response_cache is None and client_flight is None:
+                return None
+
+            call = caches.call_key(args, kwargs)
+            if call is None:
+                return None
+
+            return peer.address(target), call
+
+        def invalidate(*args, **kwargs):
+            """
+            Drop cached responses of the connection. Without arguments every
+            response is dropped, or only those from ``peer`` if it is given.
+
+            .. code-block:: python
+
+                your_function.invalidate(some_value, peer=peer)
+
+            :return: number of responses dropped
+            """
+            if response_cache is None:
+                return 0
+
+            target = kwargs.pop('peer', None)
+            address = peer.address(target) if target else None
+            call = caches.call_key(args, kwargs) if args or kwargs else None
+
+            def match(key):
+                return (
+                    (address is None or key[0] == address) and
+                    (call is None or key[1] == call)
+                )
+
+            return response_cache.invalidate(match)
+
+        def forget(*args, **kwargs):
+            """
+            Drop memoized responses of the connection on this peer. Without
+            arguments every response is dropped.
+
+            .. code-block:: python
+
+                your_function.forget(some_value)
+
+            :return: number of responses dropped
+            """
+            if memo is None:
+                return 0
+
+            call = caches.call_key(args, kwargs) if args or kwargs else None
+            return memo.invalidate(None if call is None else lambda key: key[1] == call)
+
+        def async_call(*args, **kwargs):
+            """
+            Awaitable version of the connection.
+
+            .. code-block:: python
+
+                response = await your_function.async_call(some_value, peer=peer)
+
+            :return: coroutine
+            """
+            from net.peer.aio import call_async
+            return call_async(peer, func, connection_name, args, kwargs)
+
+        interface.async_call = async_call
+        interface.connection = connection_name
+        interface.cache = response_cache
+        interface.invalidate = invalidate
+        interface.memo = memo
+        interface.forget = forget
+        interface.flight = client_flight
+
         return interface
     return wrapper
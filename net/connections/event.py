@@ -101,6 +101,14 @@ def event(name):
 
     i.e. event -> remote peer errors -> event peer will log and ignore
 
+    Triggering an event only queues it, background dispatcher threads deliver
+    it to the subscribed peers so the application is never held up by them.
+    The arguments are sent as they are when the event is delivered, so don't
+    change them after triggering the event. Call ``net.flush`` before shutting
+    down to wait for the queued events to be delivered. See
+    ``net.EVENT_QUEUE_LIMIT`` and ``net.EVENT_POLICY`` for what happens when
+    events are triggered faster than they can be delivered.
+
     Stale peer subscriptions will be added to the stale list and pruned. Since
     the subscriptions are created per client request, the event peer will not
     know until a request is made that the subscribed peer went offline.
@@ -110,7 +118,7 @@ def event(name):
         def interface(*args, **kwargs):
 
             new_args, new_kwargs = func(*args, **kwargs)
-            net.Peer().trigger_event(name, *new_args, **new_kwargs)
+            net.Peer().queue_event(name, *new_args, **new_kwargs)
 
             return new_args, new_kwargs
         return interface
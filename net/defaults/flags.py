@@ -11,10 +11,14 @@ import base64
 
 # package imports
 import net
+from net.peer.protocol import ProtocolError
 
 __all__ = [
     'null_response',
-    'invalid_connection'
+    'invalid_connection',
+    'busy',
+    'unavailable',
+    'refused',
 ]
 
 
@@ -61,3 +65,73 @@ def invalid_connection(connection, peer):
             '\n\t\t'.join(connections)
         )
     )
+
+
+# Flags
+@net.flag('BUSY')
+def busy(connection, peer):
+    """
+    Execute this if the peer has returned the BUSY flag. The peer had too many
+    requests queued to accept this one, nothing was run.
+
+    :param connection: name of the connection requested
+    :param peer: ``net.Peer`` or tuple
+    :return:
+    """
+    if isinstance(peer, tuple):
+        host, port = peer
+    else:
+        host, port = peer.host, peer.port
+
+    raise net.PeerBusy(
+        "Peer is too busy to accept the request, back off and try again.\n\t"
+        "Peer: {0}@{1}\n\t"
+        "Connection Requested: {2}".format(host, port, connection)
+    )
+
+
+# Flags
+@net.flag('UNAVAILABLE')
+def unavailable(connection, peer):
+    """
+    Execute this if the request was answered with the UNAVAILABLE flag. The
+    peer failed too many requests in a row, so its circuit breaker is open and
+    nothing was sent.
+
+    :param connection: name of the connection requested
+    :param peer: ``net.Peer`` or tuple
+    :return:
+    """
+    if isinstance(peer, tuple):
+        host, port = peer
+    else:
+        host, port = peer.host, peer.port
+
+    raise net.PeerUnavailable(
+        "Peer failed too many requests in a row and is skipped for now.\n\t"
+        "Peer: {0}@{1}\n\t"
+        "Connection Requested: {2}".format(host, port, connection)
+    )
+
+
+# Flags
+@net.flag('REFUSED')
+def refused(connection, peer):
+    """
+    Execute this if the peer has returned the REFUSED flag. The peer does not
+    trust this peer with the codec the request was sent in, nothing was run.
+
+    :param connection: name of the connection requested
+    :param peer: ``net.Peer`` or tuple
+    :return:
+    """
+    if isinstance(peer, tuple):
+        host, port = peer
+    else:
+        host, port = peer.host, peer.port
+
+    raise ProtocolError(
+        "Peer refused the codec of the request, it does not trust this peer.\n\t"
+        "Peer: {0}@{1}\n\t"
+        "Connection Requested: {2}".format(host, port, connection)
+    )
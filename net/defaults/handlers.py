@@ -11,12 +11,15 @@ import getpass
 
 # package imports
 import net
+from net.peer import buffers, codecs
+from net.peer.handler import PeerHandler
 
 __all__ = [
     'info',
     'pass_through',
     'null',
     'subscription_handler',
+    'batch_handler',
     'connections'
 ]
 
@@ -41,6 +44,7 @@ def info(*args, **kwargs):
         # host
         'host': information.host,
         'port': information.port,
+        'socket': information.server.socket_path,
 
         # user
         'user': getpass.getuser(),
@@ -54,6 +58,9 @@ def info(*args, **kwargs):
         'connections': sorted(list(information.registered_connections.keys())),
         'subscriptions': sorted(list(information.registered_subscriptions.keys())),
         'flags': sorted(list(information.registered_flags.keys())),
+
+        # serialization codecs, fastest first
+        'codecs': codecs.available_codecs(),
     }
 
 
@@ -125,3 +132,56 @@ def subscription_handler(event, host, port, connection, *args, **kwargs):
     :param connection: connection id
     """
     net.Peer().register_subscriber(event, host, port, connection)
+
+
+@net.connect()
+def batch_handler(calls, parallel=False, *args, **kwargs):
+    """
+    Run a batch of calls sent in a single request and answer with all of the
+    responses. Each call goes through the same dispatch as a single request,
+    so memoized and single flight connections and the deadline of the batch
+    apply to every call. Errors are caught per call so one failing call doesn't
+    take the rest of the batch down with it. This is for internal use only,
+    use ``net.batch`` instead.
+
+    :param calls: list of {'connection': str, 'args': list, 'kwargs': dict}
+    :param parallel: run the calls at the same time on the worker pool of the
+     server instead of in order, calls the pool has no room for are answered
+     with the ``BUSY`` flag
+    :return: list of responses, in the order of the calls
+    """
+    local_peer = net.Peer()
+    deadline = net.context().deadline
+    codec = codecs.get_codec(codecs.JsonCodec.id)
+
+    def run(call):
+        connection = local_peer.registered_connections.get(call['connection'])
+        if not connection:
+            return local_peer.get_flag('INVALID_CONNECTION')
+
+        # batched responses can't be streamed
+        _, encoded, out_of_band = PeerHandler.execute(
+            codec, connection, call['args'], call['kwargs'], deadline=deadline
+        )
+        return buffers.restore(codec.decode(encoded), out_of_band)
+
+    workers = local_peer.server.workers
+    if not parallel or len(calls) < 2 or workers is None:
+        return [run(call) for call in calls]
+
+    queued = [workers.submit(run, call) for call in calls]
+
+    responses = []
+    for call, future in zip(calls, queued):
+        if future is None:
+            responses.append(local_peer.get_flag('BUSY'))
+
+        # The batch holds a worker itself, calls still waiting for one are
+        # run here so the batch never waits on a pool it is blocking.
+        elif future.cancel():
+            responses.append(run(call))
+
+        else:
+            responses.append(future.result())
+
+    return responses
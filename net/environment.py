@@ -15,11 +15,35 @@ __all__ = [
     'GROUP',
     'IS_HUB',
     'HOST_IP',
+    'POOL_SIZE',
+    'POOL_IDLE',
+    'TRUSTED_GROUPS',
+    'ENGINE',
+    'WORKER_LIMIT',
+    'QUEUE_LIMIT',
+    'CONNECTION_LIMIT',
+    'PROCESS_LIMIT',
+    'PROCESS_WORKER',
+    'SOCKET_DIR',
+    'SHARED_MEMORY',
+    'CLIENT_LIMIT',
+    'STREAM_WINDOW',
+    'CONNECT_TIME_OUT',
+    'BREAKER_THRESHOLD',
+    'BREAKER_RESET',
+    'RETRY_RATIO',
+    'RETRY_MINIMUM',
+    'RING_NODES',
+    'EVENT_QUEUE_LIMIT',
+    'EVENT_POLICY',
+    'EVENT_WORKERS',
 ]
 
 # std imports
 import os
 import socket
+import tempfile
+import multiprocessing
 from logging import getLogger, StreamHandler, Formatter, DEBUG
 
 # thread limit
@@ -30,10 +54,68 @@ HOST_IP = socket.gethostbyname(socket.gethostname())
 PORT_START = int(os.environ.setdefault("NET_PORT", "3010"))
 PORT_RANGE = int(os.environ.setdefault("NET_PORT_RANGE", "5"))
 
+# unix domain sockets for peers on the same host, empty turns them off
+SOCKET_DIR = os.environ.setdefault("NET_SOCKET_DIR", tempfile.gettempdir())
+
+# shared memory ring size in megabytes for peers on the same host, 0 is off
+SHARED_MEMORY = int(os.environ.setdefault("NET_SHARED_MEMORY", "0"))
+
+# server engine, 'threading' or 'asyncio'
+ENGINE = os.environ.setdefault("NET_ENGINE", "threading")
+
+# incoming request workers
+WORKER_LIMIT = int(os.environ.setdefault("NET_WORKER_LIMIT", "32"))
+QUEUE_LIMIT = int(os.environ.setdefault("NET_QUEUE_LIMIT", "256"))
+
+# incoming connections the threading engine serves at the same time
+CONNECTION_LIMIT = int(os.environ.setdefault("NET_CONNECTION_LIMIT", "256"))
+
+# threads making remote calls in the background
+CLIENT_LIMIT = int(os.environ.setdefault("NET_CLIENT_LIMIT", "32"))
+
+# items a streaming connection can send ahead of the requesting peer
+STREAM_WINDOW = int(os.environ.setdefault("NET_STREAM_WINDOW", "16"))
+
+# process pools, 0 starts a worker per cpu
+PROCESS_LIMIT = int(os.environ.setdefault("NET_PROCESS_LIMIT", "0"))
+
+# set in the worker processes of a process pool, they don't run a server
+PROCESS_WORKER = (
+    os.environ.get("NET_PROCESS_WORKER") == "1" and
+    multiprocessing.current_process().name != 'MainProcess'
+)
+
+# connection pooling
+POOL_SIZE = int(os.environ.setdefault("NET_POOL_SIZE", "4"))
+POOL_IDLE = float(os.environ.setdefault("NET_POOL_IDLE", "30"))
+CONNECT_TIME_OUT = float(os.environ.setdefault("NET_CONNECT_TIME_OUT", "5"))
+
+# circuit breakers, peers that fail this many requests in a row are skipped
+BREAKER_THRESHOLD = int(os.environ.setdefault("NET_BREAKER_THRESHOLD", "5"))
+BREAKER_RESET = float(os.environ.setdefault("NET_BREAKER_RESET", "10"))
+
+# retry budgets, hedges and retries sent to a group per call and per 10 seconds
+RETRY_RATIO = float(os.environ.setdefault("NET_RETRY_RATIO", "0.1"))
+RETRY_MINIMUM = int(os.environ.setdefault("NET_RETRY_MINIMUM", "10"))
+
+# virtual nodes every peer gets on a consistent hash ring
+RING_NODES = int(os.environ.setdefault("NET_RING_NODES", "100"))
+
+# events are delivered in the background, 0 workers triggers them in place
+EVENT_QUEUE_LIMIT = int(os.environ.setdefault("NET_EVENT_QUEUE_LIMIT", "1024"))
+EVENT_POLICY = os.environ.setdefault("NET_EVENT_POLICY", "block")
+EVENT_WORKERS = int(os.environ.setdefault("NET_EVENT_WORKERS", "1"))
+
 # peer configuration
 GROUP = str(os.environ.get("NET_GROUP"))
 IS_HUB = os.environ.get("NET_IS_HUB") is not None
 
+# groups that are allowed to exchange pickled data
+TRUSTED_GROUPS = [
+    group.strip() for group in os.environ.get("NET_TRUSTED_GROUPS", "").split(",")
+    if group.strip()
+]
+
 # handle development environment
 DEV = os.environ.get("NET_DEV")
 
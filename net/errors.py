@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+Errors Module
+-------------
+
+Contains the exceptions raised by net.
+"""
+
+__all__ = [
+    'PeerBusy',
+    'DeadlineExceeded',
+    'PeerUnavailable',
+]
+
+# std imports
+import socket
+
+
+class PeerBusy(Exception):
+    """
+    Raised when a peer was too busy to run a request. Nothing was run on the
+    peer, so the request can be safely sent again after backing off.
+    """
+
+
+class DeadlineExceeded(socket.timeout):
+    """
+    Raised when a request ran out of time before it could be sent or run. A
+    call made while answering a request only gets what is left of the deadline
+    of that request.
+    """
+
+
+class PeerUnavailable(socket.error):
+    """
+    Raised when a peer failed too many requests in a row to be worth waiting
+    on. Nothing was sent, the peer is tried again once its circuit breaker
+    lets a probe through.
+    """
@@ -1,33 +1,14 @@
 # -*- coding: utf-8 -*-
 """
-python 2/3 imports handled here
+Optional dependencies handled here
 """
 
 __all__ = [
-    'socketserver',
-    'ConnectionRefusedError'
+    'msgpack',
 ]
 
-# python version handling
+# optional dependencies
 try:
-    # python 2
-
-    # noinspection SpellCheckingInspection
-    import SocketServer as socketserver
-
-    # noinspection PyShadowingBuiltins
-    from socket import error as ConnectionRefusedError
-
-    # noinspection PyShadowingBuiltins
-    PermissionError = OSError
-
+    import msgpack
 except ImportError:
-
-    # python 3
-    import socketserver
-
-    # noinspection PyShadowingBuiltins
-    ConnectionRefusedError = ConnectionRefusedError
-
-    # noinspection PyShadowingBuiltins
-    PermissionError = PermissionError
+    msgpack = None
@@ -4,3 +4,6 @@
 from .handler import PeerHandler
 from .server import PeerServer
 from .peer import Peer
+from .executors import process_pool
+from .caches import ResponseCache
+from .context import context, RequestContext
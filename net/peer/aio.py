@@ -0,0 +1,884 @@
+# -*- coding: utf-8 -*-
+"""
+Asyncio Engine Module
+---------------------
+
+Contains the asyncio server engine and the asyncio client for the peer.
+
+Select the engine by setting ``NET_ENGINE=asyncio`` or passing
+``engine='asyncio'`` to the ``PeerServer``. All connections are served from a
+single event loop thread instead of a thread per connection. Connections
+defined with ``async def`` run natively on the loop, all other connections run
+on the servers bounded worker pool.
+
+The client side backs ``Peer.execute_async`` and ``connect(...).async_call``.
+Each event loop keeps one multiplexed channel per remote peer.
+"""
+
+__all__ = [
+    'AsyncEngine',
+    'AsyncChannel',
+    'request',
+    'execute_async',
+    'call_async',
+]
+
+# std imports
+import time
+import struct
+import socket
+import asyncio
+import itertools
+import threading
+import functools
+import weakref
+
+# package imports
+import net
+from net.peer import balancer, breakers, buffers, caches, codecs, flights, local, protocol, streams
+from net.peer.handler import PeerHandler
+from net.peer.channel import ChannelClosed, ConnectTimeout, LegacyPeerError, RequestNotSent
+from net.peer.context import CALL_OPTIONS, budget, outgoing, scope
+
+# event loop -> {(host, port): AsyncChannel}
+CHANNELS = weakref.WeakKeyDictionary()
+
+# marks the end of a generator being streamed
+EXHAUSTED = object()
+
+
+async def read_message(reader, time_out=None):
+    """
+    Read a single framed message and its out-of-band buffers.
+
+    :param reader: ``asyncio.StreamReader``
+    :param time_out: seconds to wait for the message to start
+    :return: ``Frame`` or None if the connection was closed
+    """
+    # only the wait for the first byte can time out, timing out half way
+    # through a message would leave the stream unusable.
+    header = b''
+    try:
+        header = await asyncio.wait_for(reader.readexactly(1), time_out)
+        header += await reader.readexactly(protocol.HEADER.size - 1)
+    except asyncio.IncompleteReadError as err:
+        if not header and not err.partial:
+            return None
+        header += err.partial
+
+    if not protocol.is_framed(header):
+        return protocol.Frame(
+            protocol.LEGACY, protocol.LEGACY_CODEC, 0, bytearray(header), []
+        )
+
+    message_type, codec, request_id, parts, length = protocol.unpack_header(header)
+    body = await reader.readexactly(length)
+
+    out_of_band = []
+    for _ in range(parts):
+        header = protocol.unpack_header(await reader.readexactly(protocol.HEADER.size))
+        if header[0] != protocol.BUFFER or header[2] != request_id:
+            raise protocol.ProtocolError(
+                "Expected a buffer for request {0}.".format(request_id)
+            )
+        out_of_band.append(memoryview(await reader.readexactly(header[4])))
+
+    return protocol.Frame(message_type, codec, request_id, body, out_of_band)
+
+
+class AsyncEngine(object):
+    """
+    Serves the listening socket of a ``PeerServer`` with
+    ``asyncio.start_server``. Do not interact with directly.
+    """
+
+    def __init__(self, sock, workers, unix_sock=None):
+        self._sock = sock
+        self._unix_sock = unix_sock
+        self._workers = workers
+        self._loop = asyncio.new_event_loop()
+        self._server = None
+        self._unix_server = None
+        self._stopped = threading.Event()
+
+        # (connection, request key) -> future of the identical request running
+        self._flights = {}
+
+    @property
+    def loop(self):
+        """
+        Event loop the engine runs on.
+
+        :return: ``asyncio.AbstractEventLoop``
+        """
+        return self._loop
+
+    def serve_forever(self):
+        """
+        Run the event loop, blocking until ``shutdown`` is called.
+        """
+        asyncio.set_event_loop(self._loop)
+
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self.handle, sock=self._sock)
+        )
+
+        # peers on the same host connect over the unix domain socket
+        if self._unix_sock is not None:
+            self._unix_server = self._loop.run_until_complete(
+                asyncio.start_unix_server(self.handle, sock=self._unix_sock)
+            )
+
+        try:
+            self._loop.run_forever()
+        finally:
+            if self._unix_server is not None:
+                self._unix_server.close()
+                self._loop.run_until_complete(self._unix_server.wait_closed())
+            self._server.close()
+            self._loop.run_until_complete(self._server.wait_closed())
+            self._loop.close()
+            self._stopped.set()
+
+    def shutdown(self):
+        """
+        Stop the event loop and wait for it to close.
+        """
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._stopped.wait()
+
+    async def handle(self, reader, writer):
+        """
+        Handles all requests on an incoming connection. Each request is run in
+        its own task and answered with its request id as soon as it finishes.
+
+        :param reader: ``asyncio.StreamReader``
+        :param writer: ``asyncio.StreamWriter``
+        """
+        lock = asyncio.Lock()
+        tasks = set()
+
+        # request id -> credit of the streamed responses being sent
+        credits = {}
+
+        # streamed arguments of the requests in flight
+        arguments = streams.ArgumentStreams(functools.partial(self.control, writer, lock))
+
+        # restricted codecs are only accepted from trusted peers
+        sender = PeerHandler.sender(writer.get_extra_info('peername'))
+
+        try:
+            while True:
+                try:
+                    frame = await read_message(reader, net.POOL_IDLE * 2)
+                except asyncio.TimeoutError:
+                    # only close the connection if there is nothing in flight
+                    if tasks:
+                        continue
+                    return
+                except (asyncio.IncompleteReadError, OSError):
+                    return
+
+                # the requesting peer closed the connection
+                if frame is None:
+                    return
+
+                # flow control of the responses being streamed
+                if frame.type in (protocol.CREDIT, protocol.CANCEL):
+                    credit = credits.get(frame.id)
+                    if credit is not None and frame.type == protocol.CANCEL:
+                        credit.cancel()
+                    elif credit is not None:
+                        credit.grant(struct.unpack('!I', bytes(frame.body))[0])
+                    continue
+
+                # the next part of a streamed argument
+                if frame.type == protocol.STREAM:
+                    argument = arguments.get(frame.id)
+                    if argument is not None:
+                        argument.put(PeerHandler.accept(frame, sender))
+                    continue
+
+                # shared memory needs a blocking socket, the connection carries
+                # on over the stream.
+                if frame.type == protocol.SHARED_MEMORY:
+                    async with lock:
+                        for part in protocol.pack_message(
+                                protocol.SHARED_MEMORY, b'', request_id=frame.id):
+                            writer.write(part)
+                        await writer.drain()
+                    continue
+
+                # peers running an older version of net send a single unframed
+                # request and expect a single unframed response.
+                if frame.type == protocol.LEGACY:
+                    try:
+                        frame.body.extend(
+                            await asyncio.wait_for(reader.read(1024), net.POOL_IDLE * 2)
+                        )
+                    except (asyncio.TimeoutError, OSError):
+                        return
+
+                    # run on the workers like every other request
+                    future = self._workers.submit(PeerHandler.respond, frame.body, codecs.LEGACY)
+                    if future is None:
+                        response = codecs.LEGACY.encode(net.Peer().get_flag('BUSY'))
+                    else:
+                        response = (await asyncio.wrap_future(future))[1]
+
+                    writer.write(response)
+                    await writer.drain()
+                    return
+
+                arguments.start(frame.id)
+                task = self._loop.create_task(
+                    self.dispatch(frame, writer, lock, credits, arguments, sender)
+                )
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+        finally:
+            # stop the generators streaming to the requesting peer
+            for credit in credits.values():
+                credit.cancel()
+
+            arguments.close(socket.error("Connection to the requesting peer closed."))
+            writer.close()
+
+    async def dispatch(self, frame, writer, lock, credits, arguments, sender=None):
+        """
+        Execute a request and send the response back tagged with the request id.
+
+        :param frame: ``Frame``
+        :param writer: ``asyncio.StreamWriter``
+        :param lock: ``asyncio.Lock`` guarding the writer
+        :param credits: dict of request id to ``AsyncStreamCredit``
+        :param arguments: ``ArgumentStreams`` of the connection
+        :param sender: host the request came from, None for unix domain sockets
+        """
+        try:
+            await self.run(frame, writer, lock, credits, arguments, sender)
+        finally:
+            arguments.finish(frame.id)
+
+    async def run(self, frame, writer, lock, credits, arguments, sender=None):
+        """
+        Run a request on the loop or the worker pool and send the response.
+
+        :param frame: ``Frame``
+        :param writer: ``asyncio.StreamWriter``
+        :param lock: ``asyncio.Lock`` guarding the writer
+        :param credits: dict of request id to ``AsyncStreamCredit``
+        :param arguments: ``ArgumentStreams`` of the connection
+        :param sender: host the request came from, None for unix domain sockets
+        """
+        arrived = time.time()
+        options = {}
+
+        try:
+            codec = PeerHandler.get_codec(frame.codec, sender)
+        except protocol.ProtocolError:
+            codec, response, out_of_band = PeerHandler.refuse()
+            await self.send(frame, writer, lock, codec, response, out_of_band)
+            return
+
+        try:
+            connection, args, kwargs, options = PeerHandler.resolve(
+                frame.body, codec, frame.buffers, functools.partial(arguments.get, frame.id)
+            )
+            deadline = PeerHandler.deadline(options, arrived)
+        except Exception:
+            codec, response, out_of_band = PeerHandler.error(frame.codec)
+        else:
+            # reading a streamed argument blocks, so those always go to the workers
+            if asyncio.iscoroutinefunction(connection) and frame.id not in arguments:
+                codec, response, out_of_band = await self.execute(
+                    codec, connection, args, kwargs, deadline
+                )
+            else:
+                future = self._workers.submit(
+                    PeerHandler.execute, codec, connection, args, kwargs, options['stream'],
+                    deadline
+                )
+
+                # answer with the BUSY flag if the workers have too much queued
+                if future is None:
+                    codec, response, out_of_band = (
+                        codec, codec.encode(net.Peer().get_flag('BUSY')), []
+                    )
+                else:
+                    codec, response, out_of_band = await asyncio.wrap_future(future)
+
+        # the requesting peer routes its calls by the load of this peer
+        if options.get('load'):
+            await self.send_control(
+                writer, lock, frame.id, protocol.LOAD, balancer.report(self._workers)
+            )
+
+        # generators are streamed item by item
+        if out_of_band is None:
+            await self.stream(frame, writer, lock, credits, codec, response)
+            return
+
+        await self.send(frame, writer, lock, codec, response, out_of_band)
+
+    async def execute(self, codec, connection, args, kwargs, deadline=None):
+        """
+        Run a connection defined with ``async def`` on the loop and encode its
+        response. The awaitable counterpart to ``PeerHandler.execute``.
+
+        :param codec: ``Codec`` the request is encoded with
+        :param connection: coroutine function
+        :param args: positional arguments
+        :param kwargs: keyword arguments
+        :param deadline: ``time.time()`` the requesting peer stops waiting at
+        :return: (``Codec``, bytes, list of out-of-band buffers)
+        """
+        try:
+            # nobody is waiting on the response anymore
+            if deadline is not None and deadline <= time.time():
+                raise net.DeadlineExceeded("Request expired before it ran.")
+
+            key = PeerHandler.request_key(codec, connection, args, kwargs)
+            memo = caches.memo(connection) if key is not None else None
+            if memo is not None:
+                hit, encoded = memo.get(key)
+                if hit:
+                    return encoded
+
+            # identical requests running at the same time share a single run
+            if key is not None and flights.flight(connection) is not None:
+                running = self._flights.get((connection, key))
+                if running is not None:
+                    remaining = deadline - time.time() if deadline is not None else None
+                    try:
+                        return await asyncio.wait_for(asyncio.shield(running), remaining)
+                    except asyncio.TimeoutError:
+                        raise net.DeadlineExceeded("The identical request did not finish in time.")
+                running = self._flights[(connection, key)] = self._loop.create_future()
+            else:
+                running = None
+
+            try:
+                try:
+                    # the connection sees the deadline through net.context()
+                    with scope(deadline):
+                        response = await connection(*args, **kwargs)
+                    encoded = PeerHandler.encode(codec, response)
+                    if memo is not None:
+                        PeerHandler.remember(memo, key, encoded)
+                except Exception:
+                    encoded = PeerHandler.error(codec)
+
+                if running is not None:
+                    running.set_result(encoded)
+            finally:
+                if running is not None:
+                    del self._flights[(connection, key)]
+                    if not running.done():
+                        running.cancel()
+
+            return encoded
+        except Exception:
+            return PeerHandler.error(codec)
+
+    async def stream(self, frame, writer, lock, credits, codec, generator):
+        """
+        Send every item a generator yields as a ``STREAM`` message, waiting for
+        credit from the requesting peer. The generator is stepped on the default
+        executor so it never blocks the loop.
+
+        :param frame: ``Frame`` of the request
+        :param writer: ``asyncio.StreamWriter``
+        :param lock: ``asyncio.Lock`` guarding the writer
+        :param credits: dict of request id to ``AsyncStreamCredit``
+        :param codec: ``Codec`` the request is encoded with
+        :param generator: generator returned by the connection
+        """
+        credit = AsyncStreamCredit()
+        credits[frame.id] = credit
+
+        try:
+            while True:
+                item = await self._loop.run_in_executor(None, next, generator, EXHAUSTED)
+                if item is EXHAUSTED:
+                    break
+
+                if not await credit.acquire():
+                    net.LOGGER.debug("Stream {0} cancelled by {1}".format(
+                        frame.id, writer.get_extra_info('peername')
+                    ))
+                    return
+
+                item, out_of_band = buffers.extract(item)
+                if not await self.send(
+                        frame, writer, lock, codec, codec.encode(item), out_of_band,
+                        protocol.STREAM):
+                    return
+
+            await self.send(frame, writer, lock, codec, codec.encode(None), [])
+
+        except Exception:
+            await self.send(frame, writer, lock, *PeerHandler.error(codec))
+
+        finally:
+            credits.pop(frame.id, None)
+            await self._loop.run_in_executor(None, generator.close)
+
+    def control(self, writer, lock, request_id, message_type, body):
+        """
+        Send a flow control message from any thread.
+
+        :param writer: ``asyncio.StreamWriter``
+        :param lock: ``asyncio.Lock`` guarding the writer
+        :param request_id: id of the request
+        :param message_type: ``CREDIT`` or ``CANCEL``
+        :param body: bytes
+        """
+        self._loop.call_soon_threadsafe(
+            self._loop.create_task, self.send_control(writer, lock, request_id, message_type, body)
+        )
+
+    async def send_control(self, writer, lock, request_id, message_type, body):
+        """
+        Send a flow control message, or the load of this peer.
+
+        :param writer: ``asyncio.StreamWriter``
+        :param lock: ``asyncio.Lock`` guarding the writer
+        :param request_id: id of the request
+        :param message_type: ``CREDIT``, ``CANCEL`` or ``LOAD``
+        :param body: bytes
+        """
+        try:
+            async with lock:
+                writer.writelines(protocol.pack_message(message_type, body, request_id=request_id))
+                await writer.drain()
+        except OSError:
+            pass
+
+    async def send(self, frame, writer, lock, codec, response, out_of_band,
+                   message_type=protocol.RESPONSE):
+        """
+        Send a response tagged with the request id.
+
+        :param frame: ``Frame`` of the request
+        :param writer: ``asyncio.StreamWriter``
+        :param lock: ``asyncio.Lock`` guarding the writer
+        :param codec: ``Codec`` the response is encoded with
+        :param response: encoded response
+        :param out_of_band: out-of-band buffers
+        :param message_type: ``RESPONSE`` or ``STREAM``
+        :return: bool, False if the requesting peer is gone
+        """
+        try:
+            async with lock:
+                writer.writelines(protocol.pack_message(
+                    message_type, response, codec.id, frame.id, out_of_band
+                ))
+                await writer.drain()
+        except OSError as err:
+            net.LOGGER.debug("Could not send the response to {0}: {1}".format(
+                writer.get_extra_info('peername'), err
+            ))
+            return False
+
+        return True
+
+
+class AsyncStreamCredit(object):
+    """
+    Asyncio counterpart to ``net.peer.streams.StreamCredit``. Do not interact
+    with directly.
+    """
+
+    def __init__(self, window=None):
+        self._credit = window if window else net.STREAM_WINDOW
+        self._cancelled = False
+        self._event = asyncio.Event()
+
+    async def acquire(self):
+        """
+        Wait until another item can be sent.
+
+        :return: bool, False if the stream was cancelled
+        """
+        while not self._credit and not self._cancelled:
+            self._event.clear()
+            await self._event.wait()
+
+        if self._cancelled:
+            return False
+
+        self._credit -= 1
+        return True
+
+    def grant(self, count):
+        """
+        Allow more items to be sent.
+
+        :param count: int
+        """
+        self._credit += count
+        self._event.set()
+
+    def cancel(self):
+        """
+        Stop the stream.
+        """
+        self._cancelled = True
+        self._event.set()
+
+
+class AsyncChannel(object):
+    """
+    A single connection to a peer shared by every task on an event loop. The
+    asyncio counterpart to ``net.peer.channel.Channel``. Do not interact with
+    directly.
+    """
+
+    def __init__(self, host, port):
+        self._host = host
+        self._port = port
+        self._loop = asyncio.get_event_loop()
+        self._reader = None
+        self._writer = None
+        self._reading = None
+        self._closed = False
+
+        # BUSY answer of a peer that had too many connections open to serve this one
+        self._refusal = None
+
+        # request id -> future
+        self._pending = {}
+        self._ids = itertools.count(1)
+        self._lock = asyncio.Lock()
+
+        # every request waits on the connection being opened
+        self.ready = self._loop.create_task(self.connect())
+
+    @property
+    def closed(self):
+        """
+        Whether the connection has been closed.
+
+        :return: bool
+        """
+        return self._closed
+
+    async def connect(self):
+        """
+        Open the connection and start reading responses.
+        """
+        # peers on the local host are reached over their unix domain socket
+        path = local.peer_socket(self._host, self._port)
+        if path:
+            try:
+                self._reader, self._writer = await asyncio.open_unix_connection(path)
+            except OSError:
+                path = None
+
+        # Never wait forever on a peer that went down. A channel that couldn't
+        # connect is closed so the next request opens a fresh one.
+        if not path:
+            try:
+                self._reader, self._writer = await asyncio.wait_for(
+                    asyncio.open_connection(self._host, self._port), net.CONNECT_TIME_OUT or None
+                )
+            except asyncio.TimeoutError:
+                self.close()
+                raise ConnectTimeout("Timed out connecting to {0}".format((self._host, self._port)))
+            except OSError as err:
+                self.close(err)
+                raise
+
+        sock = self._writer.get_extra_info('socket')
+        if sock is not None and sock.family == socket.AF_INET:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        self._reading = self._loop.create_task(self._read())
+
+    async def request(self, payload, codec, time_out=None, out_of_band=()):
+        """
+        Send a request and wait for the matching response.
+
+        :param payload: encoded request
+        :param codec: id of the codec the request is encoded with
+        :param time_out: seconds to wait for the response
+        :param out_of_band: out-of-band buffers sent with the request
+        :return: ``Frame``
+        """
+        await self.ready
+
+        if self._closed:
+            if self._refusal is not None:
+                return self._refusal
+            raise RequestNotSent("Channel to {0} is closed.".format((self._host, self._port)))
+
+        request_id = next(self._ids) % protocol.MAX_ID or next(self._ids)
+        future = self._loop.create_future()
+        self._pending[request_id] = future
+
+        try:
+            # the request never made it across in full so it can't have run
+            try:
+                async with self._lock:
+                    self._writer.writelines(protocol.pack_message(
+                        protocol.REQUEST, payload, codec, request_id, out_of_band
+                    ))
+                    await self._writer.drain()
+            except OSError as err:
+                # a peer turning the connection away answers before closing it
+                try:
+                    await asyncio.wait_for(
+                        asyncio.shield(self._reading), net.CONNECT_TIME_OUT or None
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                if self._refusal is not None:
+                    return self._refusal
+                raise RequestNotSent("Could not send the request to {0}: {1}".format(
+                    (self._host, self._port), err
+                ))
+
+            try:
+                return await asyncio.wait_for(future, time_out)
+            except asyncio.TimeoutError:
+                raise socket.timeout("timed out")
+
+        except socket.timeout:
+            raise
+
+        except OSError as err:
+            self.close(err)
+            raise
+
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def _read(self):
+        """
+        Reader task, hands every response to the waiting request.
+        """
+        try:
+            while True:
+                frame = await read_message(self._reader)
+
+                if frame is None:
+                    raise ChannelClosed(
+                        "Connection to {0} closed.".format((self._host, self._port))
+                    )
+
+                if frame.type == protocol.LEGACY:
+                    raise LegacyPeerError(
+                        "Peer {0} does not support framed messages.".format(
+                            (self._host, self._port)
+                        )
+                    )
+
+                # the load of the peer, sent right before the response
+                if frame.type == protocol.LOAD:
+                    balancer.update(self._host, self._port, frame.body)
+                    continue
+
+                # the peer had too many connections open to serve this one
+                if frame.id == 0:
+                    self._refusal = frame
+                    raise ChannelClosed("Peer {0} is serving too many connections.".format(
+                        (self._host, self._port)
+                    ))
+
+                future = self._pending.get(frame.id)
+                if future is not None and not future.done():
+                    future.set_result(frame)
+
+        except Exception as err:
+            self.close(err)
+
+    def close(self, err=None):
+        """
+        Close the connection and fail every request that is still in flight.
+
+        :param err: the exception that caused the close
+        :return: None
+        """
+        self._closed = True
+
+        if self._writer is not None:
+            self._writer.close()
+
+        if not isinstance(err, OSError):
+            err = ChannelClosed(
+                "Connection to {0} closed.".format((self._host, self._port))
+            )
+
+        for future in self._pending.values():
+            if future.done():
+                continue
+            if self._refusal is not None:
+                future.set_result(self._refusal)
+            else:
+                future.set_exception(err)
+
+
+def get_channel(host, port):
+    """
+    Get the channel to a peer for the running event loop.
+
+    :param host: target host ipv4 format
+    :param port: target port int
+    :return: (``AsyncChannel``, bool reused)
+    """
+    channels = CHANNELS.setdefault(asyncio.get_event_loop(), {})
+
+    channel = channels.get((host, port))
+    if channel is not None and not channel.closed:
+        return channel, True
+
+    channel = AsyncChannel(host, port)
+    channels[(host, port)] = channel
+    return channel, False
+
+
+async def request(host, port, connection, args, kwargs):
+    """
+    Awaitable counterpart to ``PeerServer.request``.
+
+    :param host: target host ipv4 format
+    :param port: target port int
+    :param connection: the target connection id to run
+    :param args: positional arguments to pass to the target connection
+    :param kwargs: keyword arguments to pass to the target connection
+    :return: response from peer
+    """
+    # streamed arguments are sent in full
+    args, kwargs = streams.materialize(args, kwargs)
+
+    time_out = budget(kwargs.get('time_out'))
+    kwargs = outgoing(kwargs)
+
+    # peers that failed too many requests in a row are skipped
+    with breakers.guard(host, port) as allowed:
+        if not allowed:
+            return net.Peer().get_flag('UNAVAILABLE')
+
+        with balancer.track(host, port):
+            return await send(host, port, connection, args, kwargs, time_out)
+
+
+async def send(host, port, connection, args, kwargs, time_out=None):
+    """
+    Awaitable counterpart to ``PeerServer.send``.
+
+    :param host: target host ipv4 format
+    :param port: target port int
+    :param connection: the target connection id to run
+    :param args: positional arguments to pass to the target connection
+    :param kwargs: keyword arguments to pass to the target connection
+    :param time_out: seconds to wait for the response
+    :return: response from peer
+    """
+    from net.peer.server import PeerServer, LEGACY_PEERS
+
+    data = {
+        'connection': connection, 'args': args, 'kwargs': kwargs,
+        'load': balancer.wanted(host, port),
+    }
+    if time_out:
+        data['deadline'] = time_out
+    loop = asyncio.get_event_loop()
+
+    # peers running an older version of net don't understand framing
+    if (host, port) in LEGACY_PEERS:
+        return await loop.run_in_executor(
+            None, PeerServer.legacy_request, host, port, connection, args, kwargs, time_out
+        )
+
+    codec = codecs.negotiate(host, port)
+    encoded, out_of_band = buffers.extract(data)
+    payload = codec.encode(encoded)
+
+    while True:
+        channel, reused = get_channel(host, port)
+
+        try:
+            frame = await channel.request(payload, codec.id, time_out, out_of_band)
+
+        except LegacyPeerError:
+            net.LOGGER.debug("Legacy peer detected {0}".format((host, port)))
+            LEGACY_PEERS.add((host, port))
+            return await loop.run_in_executor(
+                None, PeerServer.legacy_request, host, port, connection, args, kwargs, time_out
+            )
+
+        except RequestNotSent:
+            # the peer closed the channel before the request was sent, try
+            # again on a fresh one. Requests that were sent are never sent twice.
+            if reused:
+                continue
+            raise
+
+        break
+
+    response = codecs.accept(frame.codec, host).decode(frame.body)
+
+    # the peer doesn't trust this peer with the codec, nothing was run
+    if codecs.refused(codec, frame, response):
+        codecs.downgrade(host, port)
+        return await send(host, port, connection, args, kwargs, time_out)
+
+    return buffers.restore(response, frame.buffers)
+
+
+async def execute_async(local_peer, peer, connection, args, kwargs):
+    """
+    Execute a request on a remote peer and run the response through the
+    registered flags. Backs ``Peer.execute_async``.
+
+    :param local_peer: ``net.Peer``
+    :param peer: ``net.Peer`` or (host, port)
+    :param connection: the target connection id to run
+    :param args: positional arguments to pass to the target connection
+    :param kwargs: keyword arguments to pass to the target connection
+    :return: response from peer
+    """
+    host, port = local_peer.address(peer)
+    response = await request(host, port, connection, args, kwargs)
+    return local_peer.process_response(response, connection, peer)
+
+
+async def call_async(local_peer, func, connection, args, kwargs):
+    """
+    Call a connection locally or on the peer passed in the kwargs, raising
+    remote errors locally. Backs ``connect(...).async_call``.
+
+    :param local_peer: ``net.Peer``
+    :param func: the connected function
+    :param connection: the connection id
+    :param args: positional arguments
+    :param kwargs: keyword arguments
+    :return: response
+    """
+    target = kwargs.get('peer')
+
+    # run locally, sync connections run in the executor to keep the loop free
+    if not target:
+        kwargs = dict(
+            (key, value) for key, value in kwargs.items()
+            if key != 'peer' and key not in CALL_OPTIONS
+        )
+
+        if asyncio.iscoroutinefunction(func):
+            response = await func(*args, **kwargs)
+        else:
+            response = await asyncio.get_event_loop().run_in_executor(
+                None, functools.partial(func, *args, **kwargs)
+            )
+
+        processor = local_peer.process_flags(response, connection, local_peer)
+        if processor:
+            return processor
+        return response
+
+    response = await execute_async(local_peer, target, connection, args, kwargs)
+    local_peer.process_error(response)
+    return response
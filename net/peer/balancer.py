@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+Balancer Module
+---------------
+
+Contains the load figures used to route calls to the least busy peer of a
+group.
+
+Calls routed by the balancer ask the remote peer to report its load, any other
+call asks while the last report of the peer is missing or stale, so peers
+picked with ``net.route`` are ranked by their load too. It answers with a
+``LOAD`` message right before the response, carrying the number of requests its
+workers are running, the number waiting for a worker and the recent time they
+waited. This peer adds what it sees itself, the number of its own requests
+still waiting on each peer and their recent round trip time.
+
+Peers are picked by the power of two choices. Two peers of the group are
+drawn at random and the one with the lower cost gets the call, which spreads
+the work evenly without every peer piling onto the single least busy one.
+"""
+
+__all__ = [
+    'PeerLoad',
+    'load',
+    'report',
+    'update',
+    'track',
+    'routing',
+    'routed',
+    'wanted',
+    'pick',
+    'rank',
+]
+
+# std imports
+import time
+import random
+import struct
+import threading
+from contextlib import contextmanager
+
+# package imports
+import net
+
+# body of a LOAD message, running, queued and the recent wait in seconds
+LOAD_BODY = struct.Struct('!IIf')
+
+# seconds a reported load is trusted for
+STALE = 5.0
+
+# weight of the latest sample in the recent round trip time
+SMOOTHING = 0.2
+
+# (host, port) -> PeerLoad
+LOADS = {}
+
+# threading
+LOCK = threading.Lock()
+
+# threads sending calls routed by the balancer
+LOCAL = threading.local()
+
+
+class PeerLoad(object):
+    """
+    Load of a single remote peer as seen from this peer. Do not interact with
+    directly, it is managed by the ``PeerServer``.
+    """
+
+    def __init__(self):
+        self._outstanding = 0
+        self._latency = None
+        self._running = 0
+        self._queued = 0
+        self._wait_time = 0.0
+        self._reported = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<net.PeerLoad cost:{0}>'.format(self.cost())
+
+    def start(self):
+        """
+        A request to the peer was sent.
+        """
+        with self._lock:
+            self._outstanding += 1
+
+    def finish(self, latency=None):
+        """
+        A request to the peer is done.
+
+        :param latency: seconds it took to answer, None if it failed
+        """
+        with self._lock:
+            self._outstanding -= 1
+
+            if latency is None:
+                return
+
+            if self._latency is None:
+                self._latency = latency
+            else:
+                self._latency += (latency - self._latency) * SMOOTHING
+
+    def update(self, running, queued, wait_time):
+        """
+        Take the load the peer reported.
+
+        :param running: int requests its workers are running
+        :param queued: int requests waiting for a worker
+        :param wait_time: float recent seconds spent waiting for a worker
+        """
+        with self._lock:
+            self._running = running
+            self._queued = queued
+            self._wait_time = wait_time
+            self._reported = time.time()
+
+    def cost(self):
+        """
+        Cost of sending another request to the peer, the requests it has to
+        get through first times the time it takes to answer one. Peers that
+        weren't called yet cost nothing so they are tried.
+
+        :return: float
+        """
+        with self._lock:
+            pending = self._outstanding + 1
+            if not self._stale():
+                pending += self._running + self._queued
+
+            return pending * (self._latency or 0.0)
+
+    def stale(self):
+        """
+        Whether the peer hasn't reported its load recently.
+
+        :return: bool
+        """
+        with self._lock:
+            return self._stale()
+
+    def _stale(self):
+        """
+        Whether the peer hasn't reported its load recently, the lock has to be
+        held.
+
+        :return: bool
+        """
+        return self._reported is None or time.time() - self._reported >= STALE
+
+    def stats(self):
+        """
+        Get the load figures.
+
+        :return: {
+            'outstanding': int requests from this peer waiting on it,
+            'latency': float recent round trip seconds or None,
+            'running': int requests it reported running,
+            'queued': int requests it reported waiting for a worker,
+            'wait_time': float recent seconds it reported waiting for a worker,
+            'reported': float ``time.time()`` of the last report or None,
+        }
+        """
+        with self._lock:
+            return {
+                'outstanding': self._outstanding,
+                'latency': self._latency,
+                'running': self._running,
+                'queued': self._queued,
+                'wait_time': self._wait_time,
+                'reported': self._reported,
+            }
+
+
+def load(host, port):
+    """
+    Get the load of a peer.
+
+    :param host: target host ipv4 format
+    :param port: target port int
+    :return: ``PeerLoad``
+    """
+    with LOCK:
+        current = LOADS.get((host, port))
+        if current is None:
+            current = LOADS[(host, port)] = PeerLoad()
+        return current
+
+
+def report(workers):
+    """
+    Build the body of the ``LOAD`` message this peer answers with.
+
+    :param workers: ``WorkerPool`` of the server
+    :return: bytes
+    """
+    stats = workers.stats()
+    return LOAD_BODY.pack(stats['busy'], stats['queued'], stats['wait_time'])
+
+
+def update(host, port, body):
+    """
+    Take the load a peer reported in a ``LOAD`` message.
+
+    :param host: target host ipv4 format
+    :param port: target port int
+    :param body: bytes like
+    """
+    load(host, port).update(*LOAD_BODY.unpack(bytes(body)))
+
+
+@contextmanager
+def track(host, port):
+    """
+    Count a request to a peer as outstanding while the block runs, and time it
+    if it succeeds.
+
+    :param host: target host ipv4 format
+    :param port: target port int
+    """
+    current = load(host, port)
+    current.start()
+    start = time.time()
+
+    try:
+        yield current
+    except Exception:
+        current.finish()
+        raise
+
+    current.finish(time.time() - start)
+
+
+@contextmanager
+def routing():
+    """
+    Ask the peers requested from the block to report their load, only calls
+    routed by the balancer need it.
+    """
+    previous = routed()
+    LOCAL.routing = True
+
+    try:
+        yield
+    finally:
+        LOCAL.routing = previous
+
+
+def routed():
+    """
+    Whether the requests sent from this thread are routed by the balancer.
+
+    :return: bool
+    """
+    return getattr(LOCAL, 'routing', False)
+
+
+def wanted(host, port):
+    """
+    Whether to ask a peer for its load with the next request. Calls routed by
+    the balancer always do, any other call does while the last report of the
+    peer is missing or stale.
+
+    :param host: target host ipv4 format
+    :param port: target port int
+    :return: bool
+    """
+    if routed():
+        return True
+
+    current = LOADS.get((host, port))
+    return current is not None and current.stale()
+
+
+def _cost(peer):
+    """
+    Cost of sending a request to a peer.
+
+    :param peer: ``net.Peer`` or (host, port)
+    :return: float
+    """
+    return load(*net.Peer().address(peer)).cost()
+
+
+def pick(peers):
+    """
+    Pick the peer to send a request to by the power of two choices.
+
+    :param peers: list of ``net.Peer`` or (host, port)
+    :return: ``net.Peer`` or (host, port), None if there are no peers
+    """
+    peers = list(peers)
+    if len(peers) < 2:
+        return peers[0] if peers else None
+
+    return min(random.sample(peers, 2), key=_cost)
+
+
+def rank(peers):
+    """
+    Order peers to try them one after another, the picked peer first and the
+    rest from the least to the most busy.
+
+    :param peers: list of ``net.Peer`` or (host, port)
+    :return: list of ``net.Peer`` or (host, port)
+    """
+    peers = list(peers)
+    first = pick(peers)
+    if first is None:
+        return []
+
+    peers.remove(first)
+    random.shuffle(peers)
+    return [first] + sorted(peers, key=_cost)
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""
+Breakers Module
+---------------
+
+Contains the circuit breakers that stop this peer from waiting on peers that
+went down.
+
+Every remote peer gets a breaker. It is closed while the peer answers and opens
+after ``net.BREAKER_THRESHOLD`` requests in a row fail to reach it. Only
+connection level errors count, the peer refusing or resetting the connection,
+a connect time out or a garbled message. Running out of time waiting on an
+answer doesn't, the peer is slow but alive. Requests to
+a peer with an open breaker are answered straight away with the
+``UNAVAILABLE`` flag instead of waiting on connect time outs. Once
+``net.BREAKER_RESET`` seconds have passed the breaker is half open and lets a
+single request through to probe the peer, it closes again if the probe gets an
+answer and opens for another ``net.BREAKER_RESET`` seconds if it doesn't.
+
+Discovery pings every port of every host it sweeps. Those pings are sent from
+a ``scanning`` block and skip the breakers, so ports nobody listens on don't
+get a breaker that keeps the next peer started on them from being found.
+"""
+
+__all__ = [
+    'CLOSED',
+    'OPEN',
+    'HALF_OPEN',
+    'CircuitBreaker',
+    'breaker',
+    'available',
+    'unreachable',
+    'guard',
+    'scanning',
+    'scanned',
+    'reset',
+    'stats',
+]
+
+# std imports
+import time
+import socket
+import threading
+from contextlib import contextmanager
+
+# package imports
+import net
+from net.peer.channel import ConnectTimeout
+
+# states
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# (host, port) -> CircuitBreaker
+BREAKERS = {}
+
+# threading
+LOCK = threading.Lock()
+
+# threads sweeping the network for peers
+LOCAL = threading.local()
+
+
+class CircuitBreaker(object):
+    """
+    Health of a single remote peer. Do not interact with directly, it is
+    managed by the ``PeerServer``.
+
+    :param threshold: failed requests in a row that open the breaker, 0 never
+     opens it
+    :param reset: seconds the breaker stays open before a probe is let through
+    """
+
+    def __init__(self, threshold=None, reset=None):
+        self._threshold = net.BREAKER_THRESHOLD if threshold is None else threshold
+        self._reset = net.BREAKER_RESET if reset is None else reset
+        self._failures = 0
+        self._opened = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+        # metrics
+        self._trips = 0
+        self._rejected = 0
+
+    def __repr__(self):
+        return '<net.CircuitBreaker {0} failures:{1}>'.format(self.state, self._failures)
+
+    @property
+    def state(self):
+        """
+        State of the breaker.
+
+        :return: ``CLOSED``, ``OPEN`` or ``HALF_OPEN``
+        """
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        """
+        State of the breaker, the lock has to be held.
+
+        :return: str
+        """
+        if self._opened is None:
+            return CLOSED
+
+        if self._probing or time.time() - self._opened >= self._reset:
+            return HALF_OPEN
+
+        return OPEN
+
+    def ready(self):
+        """
+        Whether a request would be let through, without taking the probe of a
+        half open breaker.
+
+        :return: bool
+        """
+        with self._lock:
+            state = self._state()
+            return state == CLOSED or (state == HALF_OPEN and not self._probing)
+
+    def allow(self):
+        """
+        Ask to send a request. A half open breaker lets a single request
+        through until it is answered.
+
+        :return: bool
+        """
+        with self._lock:
+            state = self._state()
+            if state == CLOSED:
+                return True
+
+            if state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+
+            self._rejected += 1
+            return False
+
+    def success(self):
+        """
+        The peer answered, close the breaker.
+        """
+        with self._lock:
+            self._failures = 0
+            self._opened = None
+            self._probing = False
+
+    def failure(self):
+        """
+        The peer couldn't be reached. Opens the breaker once the threshold is
+        hit, or straight away if it was probing.
+        """
+        with self._lock:
+            self._failures += 1
+
+            if self._probing or (self._threshold and self._failures >= self._threshold):
+                if self._opened is None or self._probing:
+                    self._trips += 1
+                self._opened = time.time()
+                self._probing = False
+
+    def release(self):
+        """
+        The request is done without telling whether the peer is healthy, a
+        half open breaker lets the next request probe it instead.
+        """
+        with self._lock:
+            self._probing = False
+
+    def stats(self):
+        """
+        Get the breaker metrics.
+
+        :return: {
+            'state': str,
+            'failures': int failed requests in a row,
+            'trips': int times the breaker opened,
+            'rejected': int requests failed without being sent,
+        }
+        """
+        with self._lock:
+            return {
+                'state': self._state(),
+                'failures': self._failures,
+                'trips': self._trips,
+                'rejected': self._rejected,
+            }
+
+
+def breaker(host, port):
+    """
+    Get the breaker of a peer.
+
+    :param host: target host ipv4 format
+    :param port: target port int
+    :return: ``CircuitBreaker``
+    """
+    with LOCK:
+        current = BREAKERS.get((host, port))
+        if current is None:
+            current = BREAKERS[(host, port)] = CircuitBreaker()
+        return current
+
+
+def available(host, port):
+    """
+    Whether a request to a peer would be sent. Used to skip peers that are
+    down before any work is spent on them.
+
+    :param host: target host ipv4 format
+    :param port: target port int
+    :return: bool
+    """
+    current = BREAKERS.get((host, port))
+    return current is None or current.ready()
+
+
+def unreachable(err):
+    """
+    Whether an error means the peer couldn't be reached. Time outs waiting on
+    the response, and errors that have nothing to do with the connection,
+    don't count.
+
+    :param err: exception
+    :return: bool
+    """
+    if isinstance(err, ConnectTimeout):
+        return True
+    return isinstance(err, socket.error) and not isinstance(err, socket.timeout)
+
+
+@contextmanager
+def guard(host, port):
+    """
+    Run a request to a peer through its breaker. Connection level errors
+    raised in the block count as failures to reach the peer, a block that
+    finishes closes the breaker.
+
+    :param host: target host ipv4 format
+    :param port: target port int
+    :return: bool, False if the breaker is open and nothing should be sent
+    """
+    current = breaker(host, port)
+    if not current.allow():
+        yield False
+        return
+
+    try:
+        yield True
+    except Exception as err:
+        if unreachable(err):
+            current.failure()
+        raise
+    else:
+        current.success()
+    finally:
+        # a probe that ended any other way lets the next request probe
+        current.release()
+
+
+@contextmanager
+def scanning():
+    """
+    Send the requests made from the block without a breaker, used by discovery
+    to ping addresses nothing is known about.
+    """
+    previous = scanned()
+    LOCAL.scanning = True
+
+    try:
+        yield
+    finally:
+        LOCAL.scanning = previous
+
+
+def scanned():
+    """
+    Whether the requests sent from this thread are discovery pings.
+
+    :return: bool
+    """
+    return getattr(LOCAL, 'scanning', False)
+
+
+def reset(host=None, port=None):
+    """
+    Forget the health of a peer, or of every peer.
+
+    :param host: target host ipv4 format
+    :param port: target port int
+    :return: None
+    """
+    with LOCK:
+        if host is None:
+            BREAKERS.clear()
+        else:
+            BREAKERS.pop((host, port), None)
+
+
+def stats():
+    """
+    Get the metrics of the breaker of every peer this peer made requests to.
+
+    :return: {(host, port): ``CircuitBreaker.stats``}
+    """
+    with LOCK:
+        current = dict(BREAKERS)
+
+    return dict((address, item.stats()) for address, item in current.items())
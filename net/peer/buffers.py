@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Buffers Module
+--------------
+
+Contains the out-of-band handling of binary data sent between peers.
+
+Objects supporting the buffer protocol (``bytes``, ``bytearray``,
+``memoryview``, ``array.array``, ``mmap.mmap`` and NumPy arrays) are pulled
+out of a message before it is encoded and replaced by a small placeholder. The
+raw memory is then sent as separate frames straight from the object, and read
+on the other end into a preallocated buffer. The receiving side gets a
+``memoryview`` over that buffer, or a NumPy array built on top of it without
+copying.
+"""
+
+__all__ = [
+    'BUFFER_TYPES',
+    'extract',
+    'restore',
+]
+
+# std imports
+import sys
+import mmap
+import array
+
+
+# placeholder key, dicts with this key are treated as buffers
+PLACEHOLDER = '__net_buffer__'
+
+# types sent out-of-band
+BUFFER_TYPES = [bytes, bytearray, memoryview, array.array, mmap.mmap]
+
+
+def _numpy():
+    """
+    Get numpy if it is installed. This never imports numpy just to check for
+    arrays, if numpy isn't imported there can't be any arrays to send.
+
+    :return: module or None
+    """
+    return sys.modules.get('numpy')
+
+
+def _describe(obj, index):
+    """
+    Build the placeholder for a buffer and the memory to send for it.
+
+    :param obj: buffer protocol object
+    :param index: position of the buffer in the message
+    :return: (placeholder dict, memoryview)
+    """
+    placeholder = {PLACEHOLDER: index}
+
+    numpy = _numpy()
+    if numpy is not None and isinstance(obj, numpy.ndarray):
+        # non contiguous arrays have to be packed before they can be sent
+        if not obj.flags['C_CONTIGUOUS']:
+            obj = numpy.ascontiguousarray(obj)
+        placeholder['dtype'] = obj.dtype.str
+        placeholder['shape'] = list(obj.shape)
+        return placeholder, memoryview(obj.reshape(-1).view('u1'))
+
+    view = memoryview(obj)
+
+    # typed buffers, like array.array, keep their item format and shape
+    if view.format not in ('B', 'b', 'c') or view.ndim > 1:
+        if not view.c_contiguous:
+            view = memoryview(view.tobytes()).cast(view.format, view.shape)
+        placeholder['format'] = view.format
+        placeholder['shape'] = list(view.shape)
+        return placeholder, view.cast('B')
+
+    return placeholder, view
+
+
+def extract(data):
+    """
+    Pull every buffer out of the data and replace it with a placeholder.
+
+    :param data: Anything
+    :return: (data, list of memoryview)
+    """
+    buffers = []
+    numpy = _numpy()
+    buffer_types = tuple(BUFFER_TYPES) + ((numpy.ndarray,) if numpy is not None else ())
+
+    def walk(item):
+        if isinstance(item, buffer_types):
+            placeholder, view = _describe(item, len(buffers))
+            buffers.append(view)
+            return placeholder
+
+        if isinstance(item, dict):
+            return dict((key, walk(value)) for key, value in item.items())
+
+        if isinstance(item, list):
+            return [walk(value) for value in item]
+
+        if isinstance(item, tuple):
+            return tuple(walk(value) for value in item)
+
+        return item
+
+    return walk(data), buffers
+
+
+def _rebuild(placeholder, buffers):
+    """
+    Rebuild a buffer from its placeholder without copying.
+
+    :param placeholder: dict
+    :param buffers: received buffers
+    :return: memoryview or numpy.ndarray
+    """
+    view = buffers[placeholder[PLACEHOLDER]]
+
+    if 'dtype' in placeholder:
+        try:
+            import numpy
+        except ImportError:
+            return view
+        return numpy.frombuffer(view, dtype=placeholder['dtype']).reshape(placeholder['shape'])
+
+    if 'format' in placeholder:
+        return view.cast(placeholder['format'], placeholder['shape'])
+
+    return view
+
+
+def restore(data, buffers):
+    """
+    Put the received buffers back in place of their placeholders.
+
+    :param data: decoded data
+    :param buffers: list of memoryview
+    :return: data
+    """
+    if not buffers:
+        return data
+
+    def walk(item):
+        if isinstance(item, dict):
+            if PLACEHOLDER in item:
+                return _rebuild(item, buffers)
+            return dict((key, walk(value)) for key, value in item.items())
+
+        if isinstance(item, list):
+            return [walk(value) for value in item]
+
+        if isinstance(item, tuple):
+            return tuple(walk(value) for value in item)
+
+        return item
+
+    return walk(data)
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+"""
+Caches Module
+-------------
+
+Contains the response caches used to skip repeated calls to connections that
+return the same data for a while. The calling peer can cache the decoded
+responses of its remote calls, and the peer running a connection can memoize
+its encoded responses so identical requests skip both the work and encoding.
+
+Every entry lives for the time to live of the cache. The least recently used
+entries are evicted once the cache holds more entries or more memory than it
+is allowed to. Cached responses are shared by every caller, treat them as read
+only.
+"""
+
+__all__ = [
+    'ResponseCache',
+    'response_cache',
+    'memoize',
+    'memo',
+    'call_key',
+    'canonical',
+    'sizeof',
+]
+
+# std imports
+import sys
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+# compatibility
+import six
+
+# package imports
+from net.peer import buffers, streams
+from net.peer.context import CALL_OPTIONS
+
+# connection -> ResponseCache of its memoized responses
+MEMOS = {}
+
+
+class ResponseCache(object):
+    """
+    Least recently used cache with a time to live, bounded by the number of
+    entries and the memory they hold.
+
+    .. code-block:: python
+
+        @net.connect(cache=net.ResponseCache(ttl=300, size=64, memory=1024 * 1024))
+        def settings(name):
+            return load_settings(name)
+
+    :param ttl: seconds an entry is kept, None keeps them until evicted
+    :param size: most entries kept
+    :param memory: most bytes held by the entries, None for no limit
+    """
+
+    def __init__(self, ttl=60, size=256, memory=16 * 1024 * 1024):
+        self._ttl = ttl
+        self._size = size
+        self._memory = memory
+        self._entries = OrderedDict()
+        self._used = 0
+        self._lock = threading.Lock()
+
+        # metrics
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Look up an entry.
+
+        :param key: hashable
+        :return: (bool hit, value)
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+
+            if entry is not None and entry[0] is not None and entry[0] < time.time():
+                self._used -= entry[1]
+                self._expirations += 1
+                entry = None
+
+            if entry is None:
+                self._misses += 1
+                return False, None
+
+            # most recently used entries are at the end
+            self._entries[key] = entry
+            self._hits += 1
+            return True, entry[2]
+
+    def put(self, key, value, size=None):
+        """
+        Add an entry, evicting the least recently used ones to make room.
+        Values larger than the memory limit are not cached.
+
+        :param key: hashable
+        :param value: Anything
+        :param size: bytes held by the value, estimated if not given
+        :return: None
+        """
+        size = size if size is not None else sizeof(value)
+        if self._memory is not None and size > self._memory:
+            return
+
+        expires = time.time() + self._ttl if self._ttl is not None else None
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._used -= previous[1]
+
+            self._entries[key] = (expires, size, value)
+            self._used += size
+
+            while self._entries and (
+                    len(self._entries) > self._size or
+                    (self._memory is not None and self._used > self._memory)):
+                _, evicted = self._entries.popitem(last=False)
+                self._used -= evicted[1]
+                self._evictions += 1
+
+    def invalidate(self, match=None):
+        """
+        Drop entries.
+
+        :param match: function taking a key and returning whether to drop it,
+         None drops every entry
+        :return: number of entries dropped
+        """
+        with self._lock:
+            if match is None:
+                dropped = len(self._entries)
+                self._entries.clear()
+                self._used = 0
+                return dropped
+
+            keys = [key for key in self._entries if match(key)]
+            for key in keys:
+                self._used -= self._entries.pop(key)[1]
+            return len(keys)
+
+    def clear(self):
+        """
+        Drop every entry and reset the metrics.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._used = 0
+            self._hits = 0
+            self._misses = 0
+            self._evictions = 0
+            self._expirations = 0
+
+    def stats(self):
+        """
+        Get the cache metrics.
+
+        :return: {
+            'hits': int,
+            'misses': int,
+            'evictions': int entries dropped to make room,
+            'expirations': int entries dropped for being too old,
+            'entries': int,
+            'memory': int estimated bytes held,
+        }
+        """
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+                'entries': len(self._entries),
+                'memory': self._used,
+            }
+
+
+def response_cache(option):
+    """
+    Build the cache for a connection from its ``cache`` option.
+
+    :param option: None or False for no cache, True for the defaults, seconds
+     to keep the responses or a ``ResponseCache``
+    :return: ``ResponseCache`` or None
+    """
+    if option is None or option is False:
+        return None
+
+    if isinstance(option, ResponseCache):
+        return option
+
+    if option is True:
+        return ResponseCache()
+
+    return ResponseCache(ttl=option)
+
+
+def memoize(connection, option):
+    """
+    Memoize the encoded responses of a connection on this peer.
+
+    :param connection: registered function
+    :param option: same as ``response_cache``
+    :return: ``ResponseCache`` or None
+    """
+    cache = response_cache(option)
+    if cache is not None:
+        MEMOS[connection] = cache
+    return cache
+
+
+def memo(connection):
+    """
+    Get the cache of the memoized responses of a connection.
+
+    :param connection: registered function
+    :return: ``ResponseCache`` or None if it isn't memoized
+    """
+    return MEMOS.get(connection)
+
+
+def call_key(args, kwargs):
+    """
+    Key of a call in a response cache.
+
+    :param args: positional arguments
+    :param kwargs: keyword arguments
+    :return: str or None if the call can't be cached
+    """
+    # the peer is part of the key of a cached response already
+    kwargs = dict(
+        (key, value) for key, value in kwargs.items()
+        if key != 'peer' and key not in CALL_OPTIONS
+    )
+
+    # streamed arguments can only be read once
+    if any(streams.streamable(value) for value in list(args) + list(kwargs.values())):
+        return None
+
+    # arguments without a canonical form could share a key with other arguments
+    try:
+        return canonical(args, kwargs)
+    except TypeError:
+        return None
+
+
+def _sort_key(item):
+    """
+    Order canonical values, which can't be compared to each other directly.
+
+    :param item: canonical value
+    :return: str
+    """
+    return json.dumps(item, sort_keys=True)
+
+
+def _canonical(item):
+    """
+    Canonical form of a value that json can encode. Numbers, strings, booleans
+    and None stand for themselves, everything else is tagged with its type so
+    values that encode the same, like ``{1: x}`` and ``{'1': x}``, get
+    different keys. Binary data is reduced to a digest so large arguments don't
+    make large keys.
+
+    :param item: Anything
+    :return: json encodable
+    :raises: TypeError if the value has no canonical form
+    """
+    if item is None or isinstance(item, (bool, float, six.text_type) + six.integer_types):
+        return item
+
+    numpy = buffers._numpy()
+    if numpy is not None and isinstance(item, numpy.ndarray):
+        item = numpy.ascontiguousarray(item)
+        return ['array', item.dtype.str, list(item.shape),
+                hashlib.sha1(item.reshape(-1).view('u1')).hexdigest()]
+
+    if isinstance(item, tuple(buffers.BUFFER_TYPES) + (six.binary_type,)):
+        view = memoryview(item)
+        if not view.c_contiguous:
+            view = memoryview(view.tobytes())
+        return ['buffer', view.nbytes, hashlib.sha1(view.tobytes()).hexdigest()]
+
+    if isinstance(item, dict):
+        pairs = [[_canonical(key), _canonical(value)] for key, value in item.items()]
+        return ['dict', sorted(pairs, key=lambda pair: _sort_key(pair[0]))]
+
+    if isinstance(item, (set, frozenset)):
+        return ['set', sorted((_canonical(value) for value in item), key=_sort_key)]
+
+    if isinstance(item, (list, tuple)):
+        return ['list' if isinstance(item, list) else 'tuple', [_canonical(value) for value in item]]
+
+    raise TypeError("{0} has no canonical form.".format(type(item).__name__))
+
+
+def canonical(args, kwargs):
+    """
+    Canonical form of the arguments of a call, calls with equal arguments get
+    equal keys no matter the order of the keyword arguments.
+
+    :param args: positional arguments
+    :param kwargs: keyword arguments
+    :return: str
+    :raises: TypeError if an argument has no canonical form
+    """
+    return _sort_key([_canonical(list(args)), _canonical(dict(kwargs))])
+
+
+def sizeof(value):
+    """
+    Estimate the memory held by a value.
+
+    :param value: Anything
+    :return: int bytes
+    """
+    if isinstance(value, tuple(buffers.BUFFER_TYPES)):
+        return memoryview(value).nbytes + sys.getsizeof(b'')
+
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            sizeof(key) + sizeof(item) for key, item in value.items()
+        )
+
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(sizeof(item) for item in value)
+
+    return sys.getsizeof(value)
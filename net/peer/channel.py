@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+"""
+Channel Module
+--------------
+
+Contains the multiplexed connection used for outgoing requests.
+"""
+
+__all__ = [
+    'Channel',
+    'ChannelClosed',
+    'RequestNotSent',
+    'ConnectTimeout',
+    'LegacyPeerError',
+]
+
+# std imports
+import time
+import socket
+import struct
+import itertools
+import threading
+import traceback
+from concurrent import futures
+
+# package imports
+import net
+from net.peer import balancer, buffers, codecs, protocol
+from net.peer.streams import ResponseStream, StreamCredit
+
+
+class ChannelClosed(protocol.ProtocolError):
+    """
+    Raised for requests that were in flight when the connection closed.
+    """
+
+
+class RequestNotSent(ChannelClosed):
+    """
+    Raised when the connection failed before the request was sent. Nothing
+    reached the peer, so the request can be sent again on another connection.
+    """
+
+
+class ConnectTimeout(socket.timeout):
+    """
+    Raised when the peer didn't accept the connection in time. Unlike a time
+    out waiting on a response, this means the peer can't be reached.
+    """
+
+
+class LegacyPeerError(protocol.ProtocolError):
+    """
+    Raised when the remote peer answers with an unframed message. These peers
+    run an older version of net and can only handle one request per connection.
+    """
+
+
+class Channel(object):
+    """
+    A single connection to a peer that many threads can send requests over at
+    the same time. Every request is tagged with an id and a reader thread hands
+    each response to the request with the matching id, so responses can arrive
+    in any order and a slow request never holds up the ones behind it. Do not
+    interact with directly, it is managed by the ``ConnectionPool``.
+    """
+
+    def __init__(self, host, port, sock):
+        self._host = host
+        self._port = port
+        self._sock = sock
+        self._closed = False
+        self._last_used = time.time()
+
+        # BUSY answer of a peer that had too many connections open to serve this one
+        self._refusal = None
+
+        # request id -> future
+        self._pending = {}
+
+        # request id -> streamed response
+        self._streams = {}
+
+        # request id -> credit of the streamed argument being sent
+        self._uploads = {}
+        self._ids = itertools.count(1)
+
+        # threading
+        self._send_lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+
+        # the reader blocks on the socket, time outs are handled per request
+        self._sock.settimeout(None)
+
+        self._thread = threading.Thread(target=self._read)
+        self._thread.name = "Network_Channel_{0}_{1}".format(host, port)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __repr__(self):
+        return '<net.Channel {0}:{1} in flight:{2}>'.format(
+            self._host, self._port, self.in_flight
+        )
+
+    @property
+    def closed(self):
+        """
+        Whether the connection has been closed.
+
+        :return: bool
+        """
+        return self._closed
+
+    @property
+    def in_flight(self):
+        """
+        Number of requests waiting on a response, or still streaming one.
+
+        :return: int
+        """
+        return len(self._pending) + len(self._streams)
+
+    @property
+    def last_used(self):
+        """
+        Time the last request on this channel finished.
+
+        :return: float
+        """
+        return self._last_used
+
+    def next_id(self):
+        """
+        Get the next free request id.
+
+        :return: int
+        """
+        while True:
+            request_id = next(self._ids) % protocol.MAX_ID
+            if request_id and request_id not in self._pending and request_id not in self._streams:
+                return request_id
+
+    def request(self, payload, codec, time_out=None, out_of_band=(), upload=None):
+        """
+        Send a request and wait for the matching response.
+
+        :param payload: encoded request
+        :param codec: id of the codec the request is encoded with
+        :param time_out: seconds to wait for the response
+        :param out_of_band: out-of-band buffers sent with the request
+        :param upload: ``Upload`` streamed after the request
+        :return: ``Frame``, or ``ResponseStream`` if the response is streamed
+        """
+        if self._closed:
+            if self._refusal is not None:
+                return self._refusal
+            raise RequestNotSent("Channel to {0} is closed.".format((self._host, self._port)))
+
+        future = futures.Future()
+
+        with self._pending_lock:
+            request_id = self.next_id()
+            self._pending[request_id] = future
+            if upload is not None:
+                self._uploads[request_id] = StreamCredit()
+
+        try:
+            # a peer that closed the connection fails the send, the request
+            # never made it across in full so it can't have run.
+            try:
+                with self._send_lock:
+                    protocol.send_message(
+                        self._sock, protocol.REQUEST, payload, codec, request_id, out_of_band
+                    )
+            except socket.error as err:
+                # a peer turning the connection away answers before closing it
+                self._thread.join(net.CONNECT_TIME_OUT or None)
+                if self._refusal is not None:
+                    return self._refusal
+                raise RequestNotSent("Could not send the request to {0}: {1}".format(
+                    (self._host, self._port), err
+                ))
+
+            if upload is not None:
+                self._upload(request_id, codecs.get_codec(codec), upload)
+
+            try:
+                return future.result(time_out)
+            except futures.TimeoutError:
+                raise socket.timeout("timed out")
+
+        except socket.timeout:
+            raise
+
+        except socket.error as err:
+            self.close(err)
+            raise
+
+        finally:
+            # a response that arrives after a time out is dropped
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+                self._uploads.pop(request_id, None)
+            self._last_used = time.time()
+
+    def _upload(self, request_id, codec, upload):
+        """
+        Send a streamed argument, as fast as the peer hands out credit. Stops
+        when the peer cancels it, which it does once the request finished.
+
+        :param request_id: id of the request
+        :param codec: ``Codec`` the request is encoded with
+        :param upload: ``Upload``
+        :return: None
+        """
+        credit = self._uploads[request_id]
+
+        try:
+            for item in upload.chunks():
+                if not credit.acquire():
+                    return
+                self._send_stream(request_id, codec, {'item': item})
+
+        except socket.error:
+            raise
+
+        except Exception:
+            # the remote connection gets the error in place of the argument
+            if not credit.cancelled:
+                self._send_stream(request_id, codec, {'error': traceback.format_exc()})
+            raise
+
+        if not credit.cancelled:
+            self._send_stream(request_id, codec, {'end': True})
+
+    def _send_stream(self, request_id, codec, message):
+        """
+        Send a message of a streamed argument.
+
+        :param request_id: id of the request
+        :param codec: ``Codec`` the request is encoded with
+        :param message: dict
+        :return: None
+        """
+        message, out_of_band = buffers.extract(message)
+        body = codec.encode(message)
+
+        with self._send_lock:
+            protocol.send_message(
+                self._sock, protocol.STREAM, body, codec.id, request_id, out_of_band
+            )
+
+    def _read(self):
+        """
+        Reader thread, hands every response to the waiting request.
+        """
+        try:
+            while True:
+                frame = protocol.recv_message(self._sock)
+
+                if frame is None:
+                    raise ChannelClosed(
+                        "Connection to {0} closed.".format((self._host, self._port))
+                    )
+
+                if frame.type == protocol.LEGACY:
+                    raise LegacyPeerError(
+                        "Peer {0} does not support framed messages.".format(
+                            (self._host, self._port)
+                        )
+                    )
+
+                # the load of the peer, sent right before the response
+                if frame.type == protocol.LOAD:
+                    balancer.update(self._host, self._port, frame.body)
+                    continue
+
+                # The peer had too many connections open to serve this one, every
+                # request sent over it gets the BUSY answer without having run.
+                if frame.id == 0:
+                    self._refusal = frame
+                    raise ChannelClosed("Peer {0} is serving too many connections.".format(
+                        (self._host, self._port)
+                    ))
+
+                with self._pending_lock:
+                    # flow control of the streamed argument being sent
+                    if frame.type in (protocol.CREDIT, protocol.CANCEL):
+                        credit = self._uploads.get(frame.id)
+                        if credit is not None and frame.type == protocol.CANCEL:
+                            credit.cancel()
+                        elif credit is not None:
+                            credit.grant(struct.unpack('!I', bytes(frame.body))[0])
+                        continue
+
+                    # the rest of a streamed response
+                    stream = self._streams.get(frame.id)
+                    if stream is not None:
+                        stream.put(frame)
+                        if frame.type != protocol.STREAM:
+                            del self._streams[frame.id]
+                        continue
+
+                    future = self._pending.get(frame.id)
+                    if future is None or future.done():
+                        continue
+
+                    # the first item of a streamed response
+                    if frame.type == protocol.STREAM:
+                        stream = ResponseStream(self, frame.id)
+                        self._streams[frame.id] = stream
+                        stream.put(frame)
+                        future.set_result(stream)
+                    else:
+                        future.set_result(frame)
+
+                        # the request is done, stop sending its argument
+                        credit = self._uploads.get(frame.id)
+                        if credit is not None:
+                            credit.cancel()
+
+        except Exception as err:
+            if not self._closed:
+                net.LOGGER.debug("Channel {0} closed: {1}".format(self, err))
+            self.close(err)
+
+    def close(self, err=None):
+        """
+        Close the connection and fail every request that is still in flight.
+
+        :param err: the exception that caused the close
+        :return: None
+        """
+        self._closed = True
+
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+        try:
+            self._sock.close()
+        except socket.error:
+            pass
+
+        if not isinstance(err, socket.error):
+            err = ChannelClosed(
+                "Connection to {0} closed.".format((self._host, self._port))
+            )
+
+        with self._pending_lock:
+            for future in self._pending.values():
+                if future.done():
+                    continue
+                if self._refusal is not None:
+                    future.set_result(self._refusal)
+                else:
+                    future.set_exception(err)
+
+            for stream in self._streams.values():
+                stream.put(err)
+            self._streams = {}
+
+            for credit in self._uploads.values():
+                credit.cancel()
+
+    def credit(self, request_id, count):
+        """
+        Allow the peer to send more items of a streamed response.
+
+        :param request_id: id of the streamed request
+        :param count: number of items
+        :return: None
+        """
+        self._send_control(protocol.CREDIT, request_id, struct.pack('!I', count))
+
+    def cancel(self, request_id):
+        """
+        Stop a streamed response, the peer closes the generator.
+
+        :param request_id: id of the streamed request
+        :return: None
+        """
+        with self._pending_lock:
+            self._streams.pop(request_id, None)
+
+        self._send_control(protocol.CANCEL, request_id, b'')
+
+    def _send_control(self, message_type, request_id, body):
+        """
+        Send a flow control message, a closed channel has nothing to control.
+
+        :param message_type: int
+        :param request_id: id of the streamed request
+        :param body: bytes
+        :return: None
+        """
+        if self._closed:
+            return
+
+        try:
+            with self._send_lock:
+                protocol.send_message(self._sock, message_type, body, request_id=request_id)
+        except socket.error as err:
+            self.close(err)
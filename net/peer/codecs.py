@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+"""
+Codecs Module
+-------------
+
+Contains the serialization codecs used to encode messages between peers.
+
+Each peer advertises the codecs it supports through ``net.info``. When a
+request is made, the fastest codec both peers share is used and the remote peer
+responds with the same codec. JSON is always available and is used when nothing
+is known about the remote peer.
+
+Restricted codecs, like pickle, can run code while decoding. Messages in a
+restricted codec are only accepted from a host running a known peer that
+advertised the codec and belongs to one of the ``net.TRUSTED_GROUPS``, anyone
+else gets a ``ProtocolError`` without the message being decoded.
+
+Trust is only known on the side that found the other peer. A request the remote
+peer refuses to decode is answered with the ``REFUSED`` flag in JSON without
+being run, it is sent again in JSON and restricted codecs are no longer picked
+for that peer until it is found again.
+"""
+
+__all__ = [
+    'Codec',
+    'JsonCodec',
+    'LegacyJsonCodec',
+    'MsgpackCodec',
+    'PickleCodec',
+    'register_codec',
+    'get_codec',
+    'available_codecs',
+    'register_peer_codecs',
+    'negotiate',
+    'trusted',
+    'accept',
+    'downgrade',
+    'refused',
+]
+
+# std imports
+import json
+import pickle
+import threading
+
+# package imports
+import net
+from net.peer.protocol import ProtocolError
+
+# optional dependencies
+from net.imports import msgpack
+
+
+# registry
+CODECS = {}
+
+# (host, port) -> codec names advertised by the remote peer
+PEER_CODECS = {}
+
+# (host, port) -> group of the remote peer
+PEER_GROUPS = {}
+
+# (host, port) of the remote peers that refused a restricted codec
+DOWNGRADED = set()
+
+# threading
+LOCK = threading.Lock()
+
+
+class Codec(object):
+    """
+    Base codec. Subclass and register with ``register_codec`` to add a new
+    serialization format.
+    """
+
+    # name advertised to other peers
+    name = None
+
+    # id sent in the frame header, must be unique
+    id = None
+
+    # higher priority codecs are preferred when negotiating
+    priority = 0
+
+    # only accepted from trusted peers, decoding can run code
+    restricted = False
+
+    def available(self):
+        """
+        Check if this codec can be used by the local peer.
+
+        :return: bool
+        """
+        return True
+
+    def encode(self, data):
+        """
+        Encode data to bytes.
+
+        :param data: Anything
+        :return: bytes
+        """
+        raise NotImplementedError
+
+    def decode(self, raw):
+        """
+        Decode bytes back to data.
+
+        :param raw: bytes like
+        :return: Anything
+        """
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    """
+    UTF-8 JSON. Always available.
+    """
+    name = 'json'
+    id = 1
+    priority = 0
+
+    def encode(self, data):
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def decode(self, raw):
+        return json.loads(raw.decode('utf-8'))
+
+
+class LegacyJsonCodec(JsonCodec):
+    """
+    ASCII JSON spoken by peers running an older version of net. This is never
+    negotiated, it is only used for unframed messages.
+    """
+
+    def encode(self, data):
+        return json.dumps(data).encode('ascii')
+
+    def decode(self, raw):
+        return json.loads(raw.decode('ascii'))
+
+
+class MsgpackCodec(Codec):
+    """
+    Compact binary encoding. Only available if msgpack is installed.
+    """
+    name = 'msgpack'
+    id = 2
+    priority = 10
+
+    def available(self):
+        return msgpack is not None
+
+    def encode(self, data):
+        return msgpack.packb(data, use_bin_type=True)
+
+    def decode(self, raw):
+        return msgpack.unpackb(raw, raw=False, strict_map_key=False)
+
+
+class PickleCodec(Codec):
+    """
+    Pickle protocol 5. Unpickling can execute arbitrary code so this is only
+    available to peers in one of the ``net.TRUSTED_GROUPS``.
+    """
+    name = 'pickle'
+    id = 3
+    priority = 20
+    restricted = True
+
+    def available(self):
+        return pickle.HIGHEST_PROTOCOL >= 5 and net.Peer().group in net.TRUSTED_GROUPS
+
+    def encode(self, data):
+        return pickle.dumps(data, protocol=5)
+
+    def decode(self, raw):
+        return pickle.loads(raw)
+
+
+def register_codec(codec):
+    """
+    Register a codec with net.
+
+    :param codec: ``Codec`` instance
+    :return: ``Codec``
+    """
+    if codec.id in CODECS:
+        net.LOGGER.warning(
+            "Redefining a codec. Be aware, this could cause "
+            "unexpected results."
+        )
+
+    CODECS[codec.id] = codec
+    return codec
+
+
+def get_codec(codec_id):
+    """
+    Get an available codec by its id or name.
+
+    :param codec_id: int or str
+    :return: ``Codec``
+    """
+    for codec in CODECS.values():
+        if codec_id in (codec.id, codec.name) and codec.available():
+            return codec
+
+    raise ValueError("Codec {0} is not available on this peer.".format(codec_id))
+
+
+def available_codecs():
+    """
+    Get the names of the codecs available on this peer, fastest first.
+
+    :return: list of str
+    """
+    codecs = sorted(CODECS.values(), key=lambda codec: -codec.priority)
+    return [codec.name for codec in codecs if codec.available()]
+
+
+def register_peer_codecs(host, port, names, group=None):
+    """
+    Remember the codecs a remote peer advertised.
+
+    :param host: str
+    :param port: int
+    :param names: list of str
+    :param group: group of the remote peer
+    :return: None
+    """
+    with LOCK:
+        PEER_CODECS[(host, port)] = list(names or [])
+        PEER_GROUPS[(host, port)] = group
+        DOWNGRADED.discard((host, port))
+
+
+def negotiate(host, port):
+    """
+    Pick the fastest codec both this peer and the remote peer support.
+
+    :param host: str
+    :param port: int
+    :return: ``Codec``
+    """
+    remote = PEER_CODECS.get((host, port))
+    downgraded = (host, port) in DOWNGRADED
+
+    if remote:
+        for name in available_codecs():
+            if name in remote:
+                codec = get_codec(name)
+                if not (codec.restricted and downgraded):
+                    return codec
+
+    return get_codec(JsonCodec.id)
+
+
+def _machine(host):
+    """
+    Address of the machine a message came from, unix domain sockets and the
+    loopback interface are this machine.
+
+    :param host: str or None
+    :return: str
+    """
+    if not host or host == '::1' or host.startswith('127.'):
+        return net.HOST_IP
+    return host
+
+
+def trusted(host, name):
+    """
+    Check if a host runs a known peer of a trusted group that advertised a
+    codec.
+
+    :param host: address the message came from, None for unix domain sockets
+    :param name: name of the codec
+    :return: bool
+    """
+    host = _machine(host)
+
+    with LOCK:
+        for address, names in PEER_CODECS.items():
+            if (
+                _machine(address[0]) == host and name in names and
+                PEER_GROUPS.get(address) in net.TRUSTED_GROUPS
+            ):
+                return True
+
+    return False
+
+
+def accept(codec_id, host):
+    """
+    Get the codec of a message sent by a remote peer. Restricted codecs are
+    only accepted from trusted peers.
+
+    :param codec_id: int
+    :param host: address the message came from, None for unix domain sockets
+    :return: ``Codec``
+    :raises: ``ProtocolError`` if the codec isn't accepted from the host
+    """
+    codec = get_codec(codec_id)
+
+    if codec.restricted and not trusted(host, codec.name):
+        raise ProtocolError(
+            "Refused a {0} message from {1}, it is not a trusted peer.".format(codec.name, host)
+        )
+
+    return codec
+
+
+def downgrade(host, port):
+    """
+    Stop picking restricted codecs for a remote peer that refused one, until
+    the peer is found again.
+
+    :param host: str
+    :param port: int
+    :return: None
+    """
+    with LOCK:
+        DOWNGRADED.add((host, port))
+
+
+def refused(codec, frame, response):
+    """
+    Check if a remote peer refused a request sent in a restricted codec. The
+    refusal is the ``REFUSED`` flag in JSON, the request was never run.
+
+    :param codec: ``Codec`` the request was sent in
+    :param frame: ``Frame`` of the response
+    :param response: decoded response
+    :return: bool
+    """
+    return (
+        codec.restricted and frame.codec == JsonCodec.id and
+        response == net.Peer().get_flag('REFUSED')
+    )
+
+
+# unframed messages
+LEGACY = LegacyJsonCodec()
+
+# default codecs
+register_codec(JsonCodec())
+register_codec(MsgpackCodec())
+register_codec(PickleCodec())
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Context Module
+--------------
+
+Contains the context of the request a connection is running for.
+
+Every request carries the time the requesting peer is willing to wait for it.
+The remote peer turns that into a deadline as soon as the request arrives and
+drops requests that are past it before they run. A connection can see what is
+left of it through ``net.context()``, and any call it makes to another peer
+only gets what is left, so a chain of calls never runs past the deadline of
+the first one.
+
+.. code-block:: python
+
+    @net.connect()
+    def render(shot):
+        remaining = net.context().remaining()
+        if remaining is not None and remaining < 1:
+            return cached_frame(shot)
+        return full_render(shot)
+"""
+
+__all__ = [
+    'CALL_OPTIONS',
+    'RequestContext',
+    'context',
+    'scope',
+    'budget',
+    'outgoing',
+]
+
+# std imports
+import time
+import contextvars
+from contextlib import contextmanager
+
+# package imports
+from net.errors import DeadlineExceeded
+
+# keyword arguments that steer a call instead of being sent to the remote peer
+CALL_OPTIONS = ('time_out', 'wait')
+
+# follows connections defined with async def
+CURRENT = contextvars.ContextVar('net_request_context', default=None)
+
+
+class RequestContext(object):
+    """
+    Context of the request a connection is running for.
+
+    :param deadline: ``time.time()`` the requesting peer stops waiting at,
+     None if it waits forever
+    """
+
+    def __init__(self, deadline=None):
+        self._deadline = deadline
+
+    def __repr__(self):
+        return '<net.RequestContext remaining:{0}>'.format(self.remaining())
+
+    @property
+    def deadline(self):
+        """
+        Time the requesting peer stops waiting at.
+
+        :return: float ``time.time()`` or None
+        """
+        return self._deadline
+
+    @property
+    def expired(self):
+        """
+        Whether the requesting peer stopped waiting.
+
+        :return: bool
+        """
+        return self._deadline is not None and self._deadline <= time.time()
+
+    def remaining(self):
+        """
+        Seconds until the requesting peer stops waiting.
+
+        :return: float or None if it waits forever
+        """
+        if self._deadline is None:
+            return None
+        return max(self._deadline - time.time(), 0.0)
+
+
+def context():
+    """
+    Get the context of the request the running connection is answering. Outside
+    of a request the context has no deadline.
+
+    .. code-block:: python
+
+        @net.connect()
+        def your_function(some_value):
+            remaining = net.context().remaining()
+
+    :return: ``RequestContext``
+    """
+    current = CURRENT.get()
+    return current if current is not None else RequestContext()
+
+
+@contextmanager
+def scope(deadline=None):
+    """
+    Run the code in the block as part of a request.
+
+    :param deadline: ``time.time()`` the requesting peer stops waiting at
+    :return: ``RequestContext``
+    """
+    current = RequestContext(deadline)
+
+    token = CURRENT.set(current)
+    try:
+        yield current
+    finally:
+        CURRENT.reset(token)
+
+
+def budget(time_out=None):
+    """
+    Seconds an outgoing call can take, the time out it was given or what is
+    left of the deadline of the request being answered, whichever is shorter.
+
+    :param time_out: seconds or None
+    :return: seconds or None to wait forever
+    :raises: ``DeadlineExceeded`` if the deadline already passed
+    """
+    remaining = context().remaining()
+    if remaining is None:
+        return time_out
+
+    if remaining <= 0:
+        raise DeadlineExceeded("The deadline of the request being answered has passed.")
+
+    return min(time_out, remaining) if time_out else remaining
+
+
+def outgoing(kwargs):
+    """
+    Keyword arguments sent to the remote peer, without the ones that steer the
+    call. The peer is passed on as its address so it can be encoded.
+
+    :param kwargs: keyword arguments of the call
+    :return: dict
+    """
+    kwargs = dict((key, value) for key, value in kwargs.items() if key not in CALL_OPTIONS)
+
+    peer = kwargs.get('peer')
+    if peer is not None and not isinstance(peer, (tuple, list)):
+        kwargs['peer'] = (peer.host, peer.port)
+
+    return kwargs
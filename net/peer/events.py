@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Events Module
+-------------
+
+Contains the queue that delivers triggered events to the subscribed peers in
+the background.
+
+Triggering an event only queues it, the dispatcher threads contact the
+subscribers so the application carries on straight away. The queue holds at
+most ``net.EVENT_QUEUE_LIMIT`` events. What happens to an event triggered while
+it is full is up to ``net.EVENT_POLICY``, ``block`` waits for room,
+``drop_oldest`` drops the event that waited the longest and ``drop_newest``
+drops the event being triggered. Events are delivered in the order they were
+triggered with a single dispatcher thread.
+"""
+
+__all__ = [
+    'POLICIES',
+    'EventQueue',
+]
+
+# std imports
+import time
+import threading
+from collections import deque
+
+# package imports
+import net
+
+# overflow policies
+POLICIES = ('block', 'drop_oldest', 'drop_newest')
+
+
+class EventQueue(object):
+    """
+    Bounded queue of triggered events and the threads delivering them. Do not
+    interact with directly, it is managed by the ``Peer``.
+
+    :param deliver: function taking the event id, args and kwargs
+    :param size: most events queued
+    :param policy: what to do with events triggered while the queue is full
+    :param workers: number of dispatcher threads
+    """
+
+    def __init__(self, deliver, size=None, policy=None, workers=None,
+                 name="Network_Event_Dispatcher"):
+        self._deliver = deliver
+        self._size = size if size else net.EVENT_QUEUE_LIMIT
+        self._policy = policy if policy else net.EVENT_POLICY
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._dispatching = 0
+
+        if self._policy not in POLICIES:
+            raise ValueError("Invalid event policy {0}, expected one of {1}".format(
+                self._policy, ', '.join(POLICIES)
+            ))
+
+        # metrics
+        self._delivered = 0
+        self._dropped = 0
+        self._failed = 0
+        self._max_depth = 0
+
+        self._threads = []
+        for index in range(workers if workers else max(net.EVENT_WORKERS, 1)):
+            thread = threading.Thread(target=self._work)
+            thread.name = "{0}_{1}".format(name, index)
+            thread.daemon = True
+            self._threads.append(thread)
+            thread.start()
+
+    @property
+    def policy(self):
+        """
+        What happens to events triggered while the queue is full.
+
+        :return: str
+        """
+        return self._policy
+
+    @property
+    def depth(self):
+        """
+        Number of events waiting to be delivered.
+
+        :return: int
+        """
+        return len(self._queue)
+
+    def put(self, event, args, kwargs):
+        """
+        Queue an event to be delivered.
+
+        :param event: event id
+        :param args: args to pass to the subscribed connections
+        :param kwargs: kwargs to pass to the subscribed connections
+        :return: bool, False if the event was dropped
+        """
+        with self._condition:
+            while len(self._queue) >= self._size:
+                if self._policy == 'drop_newest':
+                    self._dropped += 1
+                    net.LOGGER.warning("Event queue is full, dropped {0}".format(event))
+                    return False
+
+                if self._policy == 'drop_oldest':
+                    dropped = self._queue.popleft()
+                    self._dropped += 1
+                    net.LOGGER.warning("Event queue is full, dropped {0}".format(dropped[0]))
+                    break
+
+                self._condition.wait()
+
+            self._queue.append((event, args, kwargs))
+            self._max_depth = max(self._max_depth, len(self._queue))
+            self._condition.notify_all()
+
+        return True
+
+    def _work(self):
+        """
+        Dispatcher thread, delivers queued events until the process exits.
+        """
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+
+                event, args, kwargs = self._queue.popleft()
+                self._dispatching += 1
+
+                # there is room for the triggers waiting on a full queue
+                self._condition.notify_all()
+
+            try:
+                self._deliver(event, args, kwargs)
+            except Exception as err:
+                net.LOGGER.error("Event {0} could not be delivered: {1}".format(event, err))
+                failed = True
+            else:
+                failed = False
+
+            with self._condition:
+                self._dispatching -= 1
+                if failed:
+                    self._failed += 1
+                else:
+                    self._delivered += 1
+                self._condition.notify_all()
+
+    def flush(self, time_out=None):
+        """
+        Wait until every queued event has been delivered, call before shutting
+        down so no events are lost with the dispatcher threads.
+
+        :param time_out: seconds to wait, None waits until they are delivered
+        :return: bool, False if there were events left when the time ran out
+        """
+        end = time.time() + time_out if time_out is not None else None
+
+        with self._condition:
+            while self._queue or self._dispatching:
+                remaining = end - time.time() if end is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+
+        return True
+
+    def stats(self):
+        """
+        Get the event queue metrics.
+
+        :return: {
+            'queued': int events waiting to be delivered,
+            'queue_limit': int,
+            'policy': str,
+            'dispatching': int events being delivered,
+            'delivered': int,
+            'dropped': int events dropped because the queue was full,
+            'failed': int,
+            'max_depth': int most events queued at once,
+        }
+        """
+        with self._condition:
+            return {
+                'queued': len(self._queue),
+                'queue_limit': self._size,
+                'policy': self._policy,
+                'dispatching': self._dispatching,
+                'delivered': self._delivered,
+                'dropped': self._dropped,
+                'failed': self._failed,
+                'max_depth': self._max_depth,
+            }
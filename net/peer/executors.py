@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Process Executor Module
+-----------------------
+
+Contains the process pools that run CPU-bound connections outside of the
+servers worker threads.
+"""
+
+__all__ = [
+    'process_pool',
+    'process_connection',
+    'shutdown',
+]
+
+# std imports
+import os
+import asyncio
+import time
+import inspect
+import functools
+import importlib
+import threading
+import multiprocessing
+from concurrent import futures
+
+# package imports
+import net
+from net.peer import streams
+
+# name of the default process pool
+DEFAULT = 'process'
+
+# process pools by name
+POOLS = {}
+
+# connections that run in a process pool, by (module, name)
+CONNECTIONS = {}
+
+# threading
+LOCK = threading.Lock()
+
+
+def process_pool(name=DEFAULT, size=None):
+    """
+    Get a named process pool, starting it if it isn't running yet. Every worker
+    process is started up front so the first requests don't pay for it. The
+    workers are spawned and import the modules of the connections they run, so
+    connections run by the pool must be defined at the top level of a module.
+
+    .. code-block:: python
+
+        # start the pool once all the connections are defined
+        net.process_pool('numeric', size=4)
+
+    :param name: name of the pool
+    :param size: number of worker processes, defaults to ``net.PROCESS_LIMIT``
+    :return: ``concurrent.futures.ProcessPoolExecutor``
+    """
+    with LOCK:
+        pool = POOLS.get(name)
+        if pool is not None:
+            return pool
+
+        size = size if size else net.PROCESS_LIMIT or multiprocessing.cpu_count()
+
+        # Forking copies the locks held by the server threads, the workers are
+        # spawned instead. They import net before the initializer runs, the
+        # environment tells them they are workers and should not start a peer
+        # server of their own.
+        os.environ["NET_PROCESS_WORKER"] = "1"
+        try:
+            pool = futures.ProcessPoolExecutor(
+                max_workers=size,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=initialize,
+            )
+            POOLS[name] = pool
+
+            # hold every worker busy at the same time so they all get started
+            for future in [pool.submit(warm, 0.05) for _ in range(size)]:
+                future.result()
+        finally:
+            del os.environ["NET_PROCESS_WORKER"]
+
+        net.LOGGER.debug("Started process pool {0} with {1} workers".format(name, size))
+
+        return pool
+
+
+def shutdown(wait=True):
+    """
+    Shut down every running process pool.
+
+    :param wait: wait for the running connections to finish
+    :return: None
+    """
+    with LOCK:
+        pools = list(POOLS.values())
+        POOLS.clear()
+
+    for pool in pools:
+        pool.shutdown(wait=wait)
+
+
+def initialize():
+    """
+    Runs in a worker process when it starts. Flags it as a worker and keeps the
+    processes started by its connections from thinking they are workers too.
+
+    :return: None
+    """
+    net.PROCESS_WORKER = True
+    os.environ.pop("NET_PROCESS_WORKER", None)
+
+
+def warm(delay):
+    """
+    Runs in a worker process to get it started.
+
+    :param delay: seconds to hold the worker
+    :return: process id
+    """
+    time.sleep(delay)
+    return os.getpid()
+
+
+def address(func):
+    """
+    Get the address a connection is found at in a worker process.
+
+    :param func: function
+    :return: (module, name)
+    """
+    return func.__module__, getattr(func, '__qualname__', func.__name__)
+
+
+def process_connection(func, pool=DEFAULT):
+    """
+    Wrap a connection so that it is run in a process pool. The wrapper is what
+    gets registered with the peer, it blocks the worker thread running the
+    request until the worker process is done.
+
+    :param func: function
+    :param pool: name of the process pool
+    :return: function
+    """
+    key = address(func)
+    CONNECTIONS[key] = func
+
+    @functools.wraps(func)
+    def run(*args, **kwargs):
+        # streamed arguments can't be handed to another process
+        args, kwargs = streams.materialize(args, kwargs)
+
+        future = process_pool(pool).submit(
+            run_connection, key, picklable(args), picklable(kwargs)
+        )
+        return future.result()
+
+    run.pool = pool
+
+    return run
+
+
+def run_connection(key, args, kwargs):
+    """
+    Runs in a worker process. Find the connection and run it.
+
+    :param key: (module, name) of the connection
+    :param args: positional arguments
+    :param kwargs: keyword arguments
+    :return: response
+    """
+    connection = CONNECTIONS.get(key)
+
+    # workers are spawned, they import the module the connection is in
+    if connection is None:
+        module, name = key
+        connection = importlib.import_module(module)
+        for part in name.split('.'):
+            connection = getattr(connection, part)
+
+        connection = CONNECTIONS.get(key, connection)
+
+    response = connection(*args, **kwargs)
+
+    # older versions of asyncio count plain generators as coroutines too
+    if asyncio.iscoroutine(response) and not inspect.isgenerator(response):
+        loop = asyncio.new_event_loop()
+        try:
+            response = loop.run_until_complete(response)
+        finally:
+            loop.close()
+
+    # generators can't leave the worker process
+    if inspect.isgenerator(response):
+        response = list(response)
+
+    return picklable(response)
+
+
+def picklable(data):
+    """
+    Copy the out-of-band buffers in the data so it can be sent to or from a
+    worker process.
+
+    :param data: Anything
+    :return: data
+    """
+    if isinstance(data, memoryview):
+        return data.tobytes()
+
+    if isinstance(data, dict):
+        return {key: picklable(value) for key, value in data.items()}
+
+    if type(data) in (list, tuple):
+        return type(data)(picklable(value) for value in data)
+
+    return data
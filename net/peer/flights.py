@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Single Flight Module
+--------------------
+
+Contains the deduplication of identical calls running at the same time.
+
+The first call with a key runs, every identical call that arrives while it is
+still running waits for it and gets the same result. On the peer running a
+connection that is the encoded response, on the calling peer that is the
+response of a single round trip.
+"""
+
+__all__ = [
+    'SingleFlight',
+    'register',
+    'flight',
+]
+
+# std imports
+import threading
+from concurrent import futures
+
+# package imports
+from net.errors import DeadlineExceeded
+
+# connection -> SingleFlight of the requests it is running
+FLIGHTS = {}
+
+
+class SingleFlight(object):
+    """
+    Runs identical calls that overlap only once.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+        # metrics
+        self._runs = 0
+        self._shared = 0
+
+    def do(self, key, func, shareable=None, time_out=None):
+        """
+        Run a call, or wait for the identical call that is already running.
+
+        :param key: hashable
+        :param func: function taking no arguments
+        :param shareable: function taking the result and returning whether the
+         waiting calls can use it, they run ``func`` themselves if they can't
+        :param time_out: seconds this call waits on the one already running
+        :return: result of ``func``
+        :raises: ``DeadlineExceeded`` if the running call takes longer than the time out
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = futures.Future()
+                self._runs += 1
+
+        if not leader:
+            try:
+                result = future.result(time_out)
+            except futures.TimeoutError:
+                raise DeadlineExceeded(
+                    "The identical call did not finish within {0} seconds.".format(time_out)
+                )
+
+            if shareable is not None and not shareable(result):
+                return func()
+
+            with self._lock:
+                self._shared += 1
+            return result
+
+        try:
+            result = func()
+        except BaseException as err:
+            self._finish(key)
+            future.set_exception(err)
+            raise
+
+        self._finish(key)
+        future.set_result(result)
+        return result
+
+    def _finish(self, key):
+        """
+        Stop sharing a call, calls arriving from now on run again.
+
+        :param key: hashable
+        """
+        with self._lock:
+            self._calls.pop(key, None)
+
+    def stats(self):
+        """
+        Get the single flight metrics.
+
+        :return: {
+            'in_flight': int calls running,
+            'runs': int calls that ran,
+            'shared': int calls answered by a call that was already running,
+        }
+        """
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'runs': self._runs,
+                'shared': self._shared,
+            }
+
+
+def register(connection):
+    """
+    Deduplicate identical requests to a connection running on this peer.
+
+    :param connection: registered function
+    :return: ``SingleFlight``
+    """
+    FLIGHTS[connection] = SingleFlight()
+    return FLIGHTS[connection]
+
+
+def flight(connection):
+    """
+    Get the single flight of a connection.
+
+    :param connection: registered function
+    :return: ``SingleFlight`` or None if requests to it aren't deduplicated
+    """
+    return FLIGHTS.get(connection)
@@ -11,14 +11,20 @@ __all__ = [
 ]
 
 # std imports
-import json
+import time
+import socket
+import asyncio
+import struct
+import inspect
+import functools
+import threading
 import traceback
+import socketserver
 
 # package imports
 import net
-
-# python 2/3 imports
-from net.imports import socketserver
+from net.peer import balancer, buffers, caches, codecs, flights, protocol, shared, streams
+from net.peer.context import scope
 
 
 class PeerHandler(socketserver.BaseRequestHandler):
@@ -30,55 +36,579 @@ class PeerHandler(socketserver.BaseRequestHandler):
     # noinspection PyPep8Naming
     def handle(self):
         """
-        Handles all incoming requests to the server.
+        Handles all incoming requests to the server. The connection is kept
+        alive so the requesting peer can send several requests over the same
+        socket. Every request is queued on the servers worker pool and is
+        answered with its request id as soon as it finishes, so a slow request
+        never holds up the ones behind it. Idle connections are closed after twice the pool idle
+        time so the requesting peer always evicts them first.
         """
-        raw = self.request.recv(1024)
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._in_flight = 0
 
-        local_peer = net.Peer()
+        # request id -> credit of the streamed responses being sent
+        self._streams = {}
 
-        # response codes
-        null = local_peer.get_flag('NULL').encode('ascii')
-        invalid_connection = local_peer.get_flag('INVALID_CONNECTION').encode('ascii')
+        # streamed arguments of the requests in flight
+        self._arguments = streams.ArgumentStreams(self.send_control)
 
-        # if there is no data, bail and don't respond
-        if not raw:
-            self.request.sendall(null)
+        # restricted codecs are only accepted from trusted peers
+        self._sender = self.sender(self.client_address)
+
+        if self.request.family == socket.AF_INET:
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.request.settimeout(net.POOL_IDLE * 2)
+
+        try:
+            while True:
+                try:
+                    frame = protocol.recv_message(self.request)
+                except socket.timeout:
+                    # only close the connection if there is nothing in flight
+                    if self._in_flight:
+                        continue
+                    return
+                except socket.error:
+                    return
+
+                # the requesting peer closed the connection
+                if frame is None:
+                    return
+
+                # flow control of the responses being streamed
+                if frame.type in (protocol.CREDIT, protocol.CANCEL):
+                    self.control(frame)
+                    continue
+
+                # the next part of a streamed argument
+                if frame.type == protocol.STREAM:
+                    argument = self._arguments.get(frame.id)
+                    if argument is not None:
+                        argument.put(self.accept(frame, self._sender))
+                    continue
+
+                # the requesting peer wants to move the connection onto shared
+                # memory, everything after the answer goes through it.
+                if frame.type == protocol.SHARED_MEMORY:
+                    try:
+                        self.request = shared.accept(self.request, frame) or self.request
+                    except socket.error:
+                        return
+                    continue
+
+                # peers running an older version of net send a single unframed
+                # request and expect a single unframed response.
+                if frame.type == protocol.LEGACY:
+                    try:
+                        frame.body.extend(self.request.recv(1024))
+                    except socket.error:
+                        return
+
+                    # run on the workers like every other request
+                    future = self.server.workers.submit(self.respond, frame.body, codecs.LEGACY)
+                    if future is None:
+                        response = codecs.LEGACY.encode(net.Peer().get_flag('BUSY'))
+                    else:
+                        response = future.result()[1]
+
+                    self.request.sendall(response)
+                    return
+
+                with self._lock:
+                    self._in_flight += 1
+                self._arguments.start(frame.id)
+
+                # the request is answered with the BUSY flag if the server has too
+                # much work queued already.
+                if self.server.workers.submit(self.dispatch, frame, time.time()) is None:
+                    self.reject(frame)
+
+        finally:
+            # stop the generators streaming to the requesting peer
+            with self._lock:
+                for credit in self._streams.values():
+                    credit.cancel()
+            self._arguments.close(socket.error("Connection to the requesting peer closed."))
+
+            # connections moved onto shared memory release it here
+            if isinstance(self.request, shared.RingSocket):
+                self.request.close_rings()
+
+    def dispatch(self, frame, arrived=None):
+        """
+        Execute a request and send the response back tagged with the request id.
+
+        :param frame: ``Frame``
+        :param arrived: ``time.time()`` the request arrived at
+        """
+        try:
+            options = {}
+            codec, response, out_of_band = self.respond(
+                frame.body, frame.codec, frame.buffers,
+                functools.partial(self._arguments.get, frame.id), arrived, options, self._sender
+            )
+
+            # the requesting peer routes its calls by the load of this peer
+            if options.get('load'):
+                self.send_control(frame.id, protocol.LOAD, balancer.report(self.server.workers))
+
+            # generators are streamed item by item
+            if out_of_band is None:
+                self.stream(frame, codec, response)
+            else:
+                self.send_response(frame, codec, response, out_of_band)
+        finally:
+            self._arguments.finish(frame.id)
+            with self._lock:
+                self._in_flight -= 1
+
+    def stream(self, frame, codec, generator):
+        """
+        Send every item a generator yields as a ``STREAM`` message, waiting for
+        credit from the requesting peer so it never gets too far ahead. The
+        stream is closed with a ``RESPONSE`` message, or with the error that
+        stopped the generator.
+
+        :param frame: ``Frame`` of the request
+        :param codec: ``Codec`` the request is encoded with
+        :param generator: generator returned by the connection
+        """
+        credit = streams.StreamCredit()
+        with self._lock:
+            self._streams[frame.id] = credit
+
+        try:
+            for item in generator:
+                if not credit.acquire():
+                    net.LOGGER.debug("Stream {0} cancelled by {1}".format(
+                        frame.id, self.client_address
+                    ))
+                    return
+
+                item, out_of_band = buffers.extract(item)
+                self.send_response(
+                    frame, codec, codec.encode(item), out_of_band, protocol.STREAM
+                )
+
+            self.send_response(frame, codec, codec.encode(None), [])
+
+        except Exception:
+            self.send_response(frame, *self.error(codec))
+
+        finally:
+            generator.close()
+            with self._lock:
+                self._streams.pop(frame.id, None)
+
+    def control(self, frame):
+        """
+        Apply a ``CREDIT`` or ``CANCEL`` message to the stream it belongs to.
+
+        :param frame: ``Frame``
+        """
+        with self._lock:
+            credit = self._streams.get(frame.id)
+
+        if credit is None:
             return
 
-        # convert from json
+        if frame.type == protocol.CANCEL:
+            credit.cancel()
+        else:
+            credit.grant(struct.unpack('!I', bytes(frame.body))[0])
+
+    def reject(self, frame):
+        """
+        Answer a request with the BUSY flag without running it.
+
+        :param frame: ``Frame``
+        """
+        try:
+            codec = self.get_codec(frame.codec, self._sender)
+            self.send_response(frame, codec, codec.encode(net.Peer().get_flag('BUSY')), [])
+        except Exception:
+            self.send_response(frame, *self.error(frame.codec))
+        finally:
+            self._arguments.finish(frame.id)
+            with self._lock:
+                self._in_flight -= 1
+
+    def send_control(self, request_id, message_type, body):
+        """
+        Send a flow control message for a streamed argument, or the load of
+        this peer.
+
+        :param request_id: id of the request
+        :param message_type: ``CREDIT``, ``CANCEL`` or ``LOAD``
+        :param body: bytes
+        """
+        try:
+            with self._send_lock:
+                protocol.send_message(self.request, message_type, body, request_id=request_id)
+        except socket.error as err:
+            net.LOGGER.debug("Could not send flow control to {0}: {1}".format(
+                self.client_address, err
+            ))
+
+    def send_response(self, frame, codec, response, out_of_band, message_type=protocol.RESPONSE):
+        """
+        Send a response tagged with the request id.
+
+        :param frame: ``Frame`` of the request
+        :param codec: ``Codec`` the response is encoded with
+        :param response: encoded response
+        :param out_of_band: out-of-band buffers
+        :param message_type: ``RESPONSE`` or ``STREAM``
+        """
+        try:
+            with self._send_lock:
+                protocol.send_message(
+                    self.request, message_type, response, codec.id, frame.id, out_of_band
+                )
+
+        except socket.error as err:
+            net.LOGGER.debug("Could not send the response to {0}: {1}".format(
+                self.client_address, err
+            ))
+
+    @classmethod
+    def respond(cls, raw, codec, received=(), incoming=None, arrived=None, options=None,
+                sender=None):
+        """
+        Execute a single request and build the response. The response is
+        encoded with the same codec as the request. Binary data in the request
+        is handed to the connection as a ``memoryview`` over the received
+        buffer, binary data in the response is sent back out-of-band.
+
+        :param raw: bytes
+        :param codec: ``Codec`` or codec id the request is encoded with
+        :param received: out-of-band buffers sent with the request
+        :param incoming: function returning the ``ArgumentStream`` of the request
+        :param arrived: ``time.time()`` the request arrived at, the deadline of
+         the request counts from it
+        :param options: dict the options of the request are copied into
+        :param sender: host the request came from, None for unix domain sockets
+        :return: (``Codec``, bytes, list of out-of-band buffers), or
+         (``Codec``, generator, None) if the response is to be streamed
+        """
+        try:
+            codec = cls.get_codec(codec, sender)
+        except protocol.ProtocolError:
+            return cls.refuse()
+
+        try:
+            connection, args, kwargs, resolved = cls.resolve(raw, codec, received, incoming)
+        except Exception:
+            return cls.error(codec)
+
+        if options is not None:
+            options.update(resolved)
+
+        return cls.execute(
+            codec, connection, args, kwargs, resolved['stream'], cls.deadline(resolved, arrived)
+        )
+
+    @staticmethod
+    def get_codec(codec, sender=None):
+        """
+        Get the codec a request is encoded with. Restricted codecs, like
+        pickle, are only accepted from trusted peers.
+
+        :param codec: ``Codec`` or codec id
+        :param sender: host the request came from, None for unix domain sockets
+        :return: ``Codec``
+        :raises: ``ProtocolError`` if the codec isn't accepted from the sender
+        """
+        if isinstance(codec, codecs.Codec):
+            return codec
+        return codecs.accept(codec, sender)
+
+    @staticmethod
+    def sender(address):
+        """
+        Host of the requesting peer.
+
+        :param address: address of the requesting peer
+        :return: str, None for unix domain sockets
+        """
+        return address[0] if isinstance(address, tuple) else None
+
+    @staticmethod
+    def accept(frame, sender=None):
+        """
+        Check the codec of the next part of a streamed argument before it is
+        decoded.
+
+        :param frame: ``Frame``
+        :param sender: host the frame came from, None for unix domain sockets
+        :return: ``Frame`` or the error refusing it
+        """
+        try:
+            codecs.accept(frame.codec, sender)
+        except (protocol.ProtocolError, ValueError) as err:
+            return err
+        return frame
+
+    @staticmethod
+    def resolve(raw, codec, received=(), incoming=None):
+        """
+        Decode a request and find the connection it targets. Requests that
+        can't be run resolve to the flag they should be answered with.
+
+        :param raw: bytes
+        :param codec: ``Codec`` the request is encoded with
+        :param received: out-of-band buffers sent with the request
+        :param incoming: function returning the ``ArgumentStream`` of the request
+        :return: (connection, args, kwargs, {
+            'stream': bool the requesting peer accepts streamed responses,
+            'deadline': float seconds the requesting peer waits or None,
+            'load': bool the requesting peer wants the load of this peer,
+        })
+        """
+        local_peer = net.Peer()
+        options = {'stream': False, 'deadline': None, 'load': False}
+
+        # if there is no data, bail and respond null
+        if not raw:
+            return local_peer.get_flag, ('NULL',), {}, options
+
+        data = buffers.restore(codec.decode(raw), received)
+
+        # skip if there is no data in the request
+        if not data:
+            return local_peer.get_flag, ('NULL',), {}, options
+
+        options['deadline'] = data.get('deadline')
+        options['load'] = bool(data.get('load'))
+
+        # Get the registered connection
+        connection = local_peer.registered_connections.get(data['connection'])
+
+        # throw invalid if the connection doesn't exist on this peer.
+        if not connection:
+            return local_peer.get_flag, ('INVALID_CONNECTION',), {}, options
+
+        # iterator and file object arguments arrive after the request
+        args, kwargs = streams.attach(data['args'], data['kwargs'], incoming)
+        options['stream'] = bool(data.get('stream'))
+
+        return connection, args, kwargs, options
+
+    @staticmethod
+    def deadline(options, arrived=None):
+        """
+        Turn the time the requesting peer waits into a deadline on this peer.
+
+        :param options: options of the request from ``resolve``
+        :param arrived: ``time.time()`` the request arrived at
+        :return: float ``time.time()`` or None if the requesting peer waits forever
+        """
+        if not options['deadline']:
+            return None
+        return (arrived if arrived else time.time()) + options['deadline']
+
+    @classmethod
+    def execute(cls, codec, connection, args, kwargs, stream=False, deadline=None):
+        """
+        Run a connection and encode its response. Requests that are past their
+        deadline are answered with an error without running.
+
+        :param codec: ``Codec`` the request is encoded with
+        :param connection: function
+        :param args: positional arguments
+        :param kwargs: keyword arguments
+        :param stream: hand back generators to be streamed instead of encoding them
+        :param deadline: ``time.time()`` the requesting peer stops waiting at
+        :return: (``Codec``, bytes, list of out-of-band buffers), or
+         (``Codec``, generator, None) if the response is to be streamed
+        """
+        try:
+            # nobody is waiting on the response anymore
+            if deadline is not None and deadline <= time.time():
+                raise net.DeadlineExceeded("Request expired before it ran.")
+
+            key = cls.request_key(codec, connection, args, kwargs)
+            if key is None:
+                return cls.compute(codec, connection, args, kwargs, stream, deadline=deadline)
+
+            # memoized connections answer repeated requests with the encoded
+            # response from the last time.
+            memo = caches.memo(connection)
+            if memo is not None:
+                hit, encoded = memo.get(key)
+                if hit:
+                    return encoded
+
+            # identical requests running at the same time share a single run,
+            # streamed responses can't be shared so those run on their own.
+            compute = functools.partial(
+                cls.compute, codec, connection, args, kwargs, stream, memo, key, deadline
+            )
+            flight = flights.flight(connection)
+            if flight is not None:
+                return flight.do(
+                    key, compute, lambda encoded: encoded[2] is not None,
+                    deadline - time.time() if deadline is not None else None
+                )
+
+            return compute()
+        except Exception:
+            return cls.error(codec)
+
+    @classmethod
+    def compute(cls, codec, connection, args, kwargs, stream=False, memo=None, key=None,
+                deadline=None):
+        """
+        Run a connection and encode its response, memoizing it if the
+        connection has a memo.
+
+        :param codec: ``Codec`` the request is encoded with
+        :param connection: function
+        :param args: positional arguments
+        :param kwargs: keyword arguments
+        :param stream: hand back generators to be streamed instead of encoding them
+        :param memo: ``ResponseCache`` of the connection
+        :param key: key of the request
+        :param deadline: ``time.time()`` the requesting peer stops waiting at
+        :return: (``Codec``, bytes, list of out-of-band buffers), or
+         (``Codec``, generator, None) if the response is to be streamed
+        """
         try:
-            data = raw.decode('ascii')
+            # the connection sees the deadline through net.context()
+            with scope(deadline):
+                response = cls.run(connection, args, kwargs)
+
+            if stream and inspect.isgenerator(response):
+                return codec, response, None
+
+            encoded = cls.encode(codec, response)
+            if memo is not None:
+                cls.remember(memo, key, encoded)
+
+            return encoded
+        except Exception:
+            return cls.error(codec)
+
+    @staticmethod
+    def request_key(codec, connection, args, kwargs):
+        """
+        Key identical requests to a memoized or single flight connection share.
+
+        :param codec: ``Codec`` the request is encoded with
+        :param connection: function
+        :param args: positional arguments
+        :param kwargs: keyword arguments
+        :return: hashable or None if the request can't be shared
+        """
+        if caches.memo(connection) is None and flights.flight(connection) is None:
+            return None
+
+        call = caches.call_key(args, kwargs)
+        if call is None:
+            return None
+
+        return codec.id, call
+
+    @staticmethod
+    def remember(memo, key, encoded):
+        """
+        Memoize an encoded response.
 
+        :param memo: ``ResponseCache``
+        :param key: key of the request
+        :param encoded: (``Codec``, bytes, list of out-of-band buffers)
+        """
+        # the buffers point into the response, which outlives the request
+        # and can change, so the memo keeps copies of them.
+        codec, body, out_of_band = encoded
+        out_of_band = [memoryview(memoryview(view).tobytes()) for view in out_of_band]
+
+        size = len(body) + sum(view.nbytes for view in out_of_band)
+        memo.put(key, (codec, body, out_of_band), size)
+
+    @staticmethod
+    def run(connection, args, kwargs):
+        """
+        Run a connection. Connections defined with ``async def`` are run to
+        completion on a private event loop.
+
+        :param connection: function
+        :param args: positional arguments
+        :param kwargs: keyword arguments
+        :return: response
+        """
+        response = connection(*args, **kwargs)
+
+        # older versions of asyncio count plain generators as coroutines too
+        if asyncio.iscoroutine(response) and not inspect.isgenerator(response):
+            loop = asyncio.new_event_loop()
             try:
-                data = json.loads(data)
-            except Exception as err:
-                net.LOGGER.info("Could not decode server request data: {0}".format(err))
+                response = loop.run_until_complete(response)
+            finally:
+                loop.close()
 
-            # skip if there is no data in the request
-            if not data:
-                self.request.sendall(null)
-                return
+        return response
 
-            # Get the registered connection
-            connection = local_peer.registered_connections.get(data['connection'])
+    @staticmethod
+    def encode(codec, response):
+        """
+        Encode a response, pulling out the binary data to send out-of-band.
 
-            # throw invalid if the connection doesn't exist on this peer.
-            if not connection:
-                self.request.sendall(invalid_connection)
-                return
+        :param codec: ``Codec`` the request is encoded with
+        :param response: Anything
+        :return: (``Codec``, bytes, list of out-of-band buffers)
+        """
+        # peers that can't take a stream get every item at once
+        if inspect.isgenerator(response):
+            response = list(response)
 
-            # execute the connection handler and send back
-            response = connection(*data['args'], **data['kwargs'])
+        # unframed responses can't carry out-of-band buffers
+        if codec is codecs.LEGACY:
+            return codec, codec.encode(response), []
 
-            self.request.sendall(json.dumps(response).encode('ascii'))
+        response, out_of_band = buffers.extract(response)
+        return codec, codec.encode(response), out_of_band
 
-        except Exception as err:
-            net.LOGGER.error(err)
-            net.LOGGER.error(traceback.format_exc())
+    @staticmethod
+    def refuse():
+        """
+        Build the response refusing a request in a codec that isn't accepted
+        from the requesting peer. It is answered in json with the ``REFUSED``
+        flag so the requesting peer can send it again in json.
+
+        :return: (``Codec``, bytes, list of out-of-band buffers)
+        """
+        codec = codecs.get_codec(codecs.JsonCodec.id)
+        return codec, codec.encode(net.Peer().get_flag('REFUSED')), []
 
-            packet = {
-                'payload': 'error',
-                'traceback': traceback.format_exc()
-            }
+    @staticmethod
+    def error(codec):
+        """
+        Build the error response for the exception being handled.
+
+        :param codec: ``Codec`` or codec id the request is encoded with
+        :return: (``Codec``, bytes, list of out-of-band buffers)
+        """
+        packet = PeerHandler.error_packet()
+
+        # the error is reported in json if the requested codec is unusable
+        if not isinstance(codec, codecs.Codec):
+            codec = codecs.get_codec(codecs.JsonCodec.id)
+
+        return codec, codec.encode(packet), []
+
+    @staticmethod
+    def error_packet():
+        """
+        Build the error packet for the exception being handled, the requesting
+        peer raises it with the remote traceback.
+
+        :return: dict
+        """
+        net.LOGGER.error(traceback.format_exc())
 
-            self.request.sendall(json.dumps(packet).encode('ascii'))
+        return {
+            'payload': 'error',
+            'traceback': traceback.format_exc()
+        }
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+Local Transport Module
+----------------------
+
+Contains the Unix domain socket transport used between peers on the same host.
+
+Every peer also listens on a Unix domain socket next to its TCP port. The path
+is derived from the port and advertised through ``net.info``. Requests to a
+peer on the local host go over the Unix domain socket when it is available,
+skipping the loopback TCP stack, and fall back to TCP when it isn't.
+"""
+
+__all__ = [
+    'UnixPeerServer',
+    'socket_path',
+    'is_local',
+    'register_peer_socket',
+    'peer_socket',
+    'serve',
+    'connect',
+]
+
+# std imports
+import os
+import atexit
+import socket
+import threading
+import socketserver
+
+# package imports
+import net
+from net.peer.workers import LimitedThreadingMixIn
+
+# (host, port) -> unix socket path advertised by the remote peer
+PEER_SOCKETS = {}
+
+# threading
+LOCK = threading.Lock()
+
+
+class UnixPeerServer(LimitedThreadingMixIn, socketserver.UnixStreamServer, object):
+    """
+    Serves the Unix domain socket of a ``PeerServer``, sharing its worker pool.
+    Do not interact with directly.
+    """
+
+    # keep-alive handler threads should never hold up the application exiting
+    daemon_threads = True
+
+    def __init__(self, path, server):
+        from net.peer.handler import PeerHandler
+
+        self._server = server
+        super(UnixPeerServer, self).__init__(path, PeerHandler)
+
+    @property
+    def workers(self):
+        """
+        Bounded worker pool running incoming requests.
+
+        :return: ``WorkerPool``
+        """
+        return self._server.workers
+
+    @property
+    def connections(self):
+        """
+        Limit on the incoming connections served at the same time, shared with
+        the ``PeerServer``.
+
+        :return: ``ConnectionLimit``
+        """
+        return self._server.connections
+
+    def remove(self):
+        """
+        Close the socket and remove the socket file.
+        """
+        self.server_close()
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+
+def supported():
+    """
+    Whether Unix domain sockets can be used.
+
+    :return: bool
+    """
+    return hasattr(socket, 'AF_UNIX') and bool(net.SOCKET_DIR)
+
+
+def socket_path(port):
+    """
+    Get the Unix domain socket path of the peer running on a port of this host.
+
+    :param port: int
+    :return: str
+    """
+    return os.path.join(net.SOCKET_DIR, 'net_{0}.sock'.format(port))
+
+
+def is_local(host):
+    """
+    Whether a host address refers to this host.
+
+    :param host: str
+    :return: bool
+    """
+    return host in (net.HOST_IP, '127.0.0.1', 'localhost', socket.gethostname())
+
+
+def register_peer_socket(host, port, path):
+    """
+    Remember the Unix domain socket path a remote peer advertised.
+
+    :param host: target host ipv4 format
+    :param port: target port int
+    :param path: str or None
+    :return: None
+    """
+    with LOCK:
+        if path:
+            PEER_SOCKETS[(host, port)] = path
+        else:
+            PEER_SOCKETS.pop((host, port), None)
+
+
+def peer_socket(host, port):
+    """
+    Get the Unix domain socket path to use for a peer.
+
+    :param host: target host ipv4 format
+    :param port: target port int
+    :return: str or None if the peer has to be reached over TCP
+    """
+    if not supported() or not is_local(host):
+        return None
+
+    path = PEER_SOCKETS.get((host, port)) or socket_path(port)
+    if not os.path.exists(path):
+        return None
+
+    return path
+
+
+def serve(server):
+    """
+    Bind the Unix domain socket for a peer server. The socket file is removed
+    when the application exits.
+
+    :param server: ``PeerServer``
+    :return: ``UnixPeerServer`` or None if it can't be bound
+    """
+    if not supported():
+        return None
+
+    path = socket_path(server.port)
+
+    # The TCP port is ours, so anything left at the path belongs to a peer
+    # that is no longer running.
+    try:
+        if os.path.exists(path):
+            os.unlink(path)
+        unix_server = UnixPeerServer(path, server)
+    except (OSError, socket.error) as err:
+        net.LOGGER.debug("Could not bind unix socket {0}: {1}".format(path, err))
+        return None
+
+    atexit.register(unix_server.remove)
+
+    return unix_server
+
+
+def connect(host, port, time_out=None):
+    """
+    Open a Unix domain socket connection to a peer on the local host.
+
+    :param host: target host ipv4 format
+    :param port: target port int
+    :param time_out: connect timeout in seconds
+    :return: socket or None if the peer has to be reached over TCP
+    """
+    path = peer_socket(host, port)
+    if not path:
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    if time_out:
+        sock.settimeout(time_out)
+
+    try:
+        sock.connect(path)
+    except (OSError, socket.error):
+        sock.close()
+        return None
+
+    return sock
@@ -10,7 +10,6 @@ __all__ = ['Peer']
 
 # std imports
 import re
-import copy
 import functools
 import threading
 
@@ -19,6 +18,10 @@ from six import add_metaclass
 
 # package imports
 import net
+from net.peer import breakers
+from net.peer.events import EventQueue
+from net.peer.codecs import register_peer_codecs
+from net.peer.local import register_peer_socket
 
 # utilities
 ID_REGEX = re.compile(r"(?P<host>.+):(?P<port>\d+) -> (?P<group>.+)")
@@ -79,7 +82,10 @@ class Peer(object):
             subscriptions=None,
             connections=None,
             flags=None,
-            test=False
+            codecs=None,
+            socket=None,
+            test=False,
+            engine=None
     ):
 
         # describing factors about this peer.
@@ -87,18 +93,30 @@ class Peer(object):
         self._port = port
         self._host = host
         self._is_hub = hub if hub else net.IS_HUB
-        self._server = net.PeerServer(test=test)
+        self._server = net.PeerServer(test=test, engine=engine)
 
         # instance connections
         self._registered_subscriptions = subscriptions if subscriptions else {}
+        self._subscriptions_lock = threading.Lock()
         self._registered_connections = connections if connections else {}
         self._registered_flags = flags if flags else {}
         self._tag_map = {}
 
+        # triggered events waiting to be delivered, started on first use
+        self._events = None
+
         # load information about the remote peer.
         if self.host and self.port:
             self.load_remote_connections()
 
+            # remember the codecs the remote peer supports
+            if codecs:
+                register_peer_codecs(self.host, self.port, codecs, self.group)
+
+            # remember where the remote peer listens on this host
+            if socket:
+                register_peer_socket(self.host, self.port, socket)
+
     @property
     def server(self):
         """
@@ -108,6 +126,22 @@ class Peer(object):
         """
         return self._server
 
+    @property
+    def events(self):
+        """
+        Queue delivering the triggered events in the background. Queue depth
+        and delivery counts are available from ``net.Peer().events.stats()``.
+
+        :return: ``EventQueue``
+        """
+        with LOCK:
+            if self._events is None:
+                self._events = EventQueue(
+                    lambda event, args, kwargs: self.trigger_event(event, *args, **kwargs)
+                )
+
+        return self._events
+
     @property
     def hub(self):
         """
@@ -249,9 +283,10 @@ class Peer(object):
         :param connection: connection id
         :return: None
         """
-        subscription = self.registered_subscriptions.setdefault(event, {})
-        peer_connection = subscription.setdefault((host, port), [])
-        peer_connection.append(connection)
+        with self._subscriptions_lock:
+            subscription = self.registered_subscriptions.setdefault(event, {})
+            peer_connection = subscription.setdefault((host, port), [])
+            peer_connection.append(connection)
 
     def register_flag(self, flag, handler):
         """
@@ -295,7 +330,7 @@ class Peer(object):
         try:
             if response in Peer().registered_flags:
                 return Peer().registered_flags[response](connection, peer)
-        except TypeError:
+        except (TypeError, ValueError):
             pass
 
     def get_flag(self, flag):
@@ -311,6 +346,51 @@ class Peer(object):
 
         return flag
 
+    @staticmethod
+    def address(peer):
+        """
+        Get the address of a peer.
+
+        :param peer: ``net.Peer`` or (host, port)
+        :return: (host, port)
+        """
+        if isinstance(peer, tuple):
+            return peer[0], peer[1]
+        return peer.host, peer.port
+
+    def process_response(self, response, connection, peer):
+        """
+        Run a response from a remote peer through the registered flags.
+
+        :param response: Anything
+        :param connection: the connection id that was run
+        :param peer: ``net.Peer`` or (host, port)
+        :return: response
+        """
+        try:
+            if response in self.registered_flags:
+                response = self.process_flags(response, connection, peer)
+        except (TypeError, ValueError):
+            pass
+
+        return response
+
+    @staticmethod
+    def process_error(response):
+        """
+        Check a response for a remote error and raise it locally with the
+        remote traceback.
+
+        :param response: Anything
+        :return: None
+        """
+        if isinstance(response, dict):
+            if response.get('payload') and response.get('payload') == 'error':
+                # unpack the traceback and raise an exception
+                full_error = "RemoteError\n" + response['traceback']
+                net.LOGGER.error(full_error)
+                raise Exception(full_error)
+
     def execute(self, peer, connection, args, kwargs):
         """
         Execute a request on a remote peer. This should not be used directly.
@@ -323,22 +403,50 @@ class Peer(object):
         :param kwargs: keyword arguments to pass to the target connection (must be json compatible)
         :return:
         """
-        if isinstance(peer, tuple):
-            host = peer[0]
-            port = peer[1]
-        else:
-            host = peer.host
-            port = peer.port
+        host, port = self.address(peer)
 
         response = self._server.request(host, port, connection, args, kwargs)
 
-        try:
-            if response in self.registered_flags:
-                response = self.process_flags(response, connection, peer)
-        except TypeError:
-            pass
+        return self.process_response(response, connection, peer)
 
-        return response
+    def execute_async(self, peer, connection, args, kwargs):
+        """
+        Awaitable counterpart to ``execute``, built on asyncio streams so the
+        calling thread is never blocked.
+
+        .. code-block:: python
+
+            results = await asyncio.gather(*[
+                net.Peer().execute_async(peer, 'net.defaults.handlers.info', (), {})
+                for peer in net.peer_group()
+            ])
+
+        :param peer: ``net.Peer`` or (host, port)
+        :param connection: the target connection id to run
+        :param args: positional arguments to pass to the target connection
+        :param kwargs: keyword arguments to pass to the target connection
+        :return: coroutine
+        """
+        from net.peer.aio import execute_async
+        return execute_async(self, peer, connection, args, kwargs)
+
+    def queue_event(self, event, *args, **kwargs):
+        """
+        Queue an event to be delivered to the subscribed peers in the
+        background. The event is triggered in place if ``net.EVENT_WORKERS`` is
+        0. This is for internal use only, use the ``net.event`` decorator
+        instead.
+
+        :param event: event id
+        :param args: args to pass to the subscribed connections
+        :param kwargs: args to pass to the subscribed connections
+        :return: bool, False if the queue was full and the event was dropped
+        """
+        if net.EVENT_WORKERS <= 0:
+            self.trigger_event(event, *args, **kwargs)
+            return True
+
+        return self.events.put(event, args, kwargs)
 
     def trigger_event(self, event, *args, **kwargs):
         """
@@ -350,9 +458,14 @@ class Peer(object):
         :param kwargs: args to pass to the subscribed connections
         :return: None
         """
-        event = self.registered_subscriptions.get(event)
+        # subscribers can register while the event is being delivered
+        with self._subscriptions_lock:
+            subscribers = [
+                (peer, list(connections))
+                for peer, connections in self.registered_subscriptions.get(event, {}).items()
+            ]
 
-        if not event:
+        if not subscribers:
             net.LOGGER.info(
                 "Invalid Event {0}.\n"
                 "This event has no subscribers so it will be skipped."
@@ -369,10 +482,18 @@ class Peer(object):
         threads = []
 
         # loop over and multi thread the requests
-        for peer, connections in event.items():
+        for peer, connections in subscribers:
             for connection in connections:
                 host, port = peer
 
+                # Peers whose circuit breaker is open are skipped instead of
+                # holding up the event until their requests time out.
+                if not breakers.available(host, port):
+                    net.LOGGER.debug(
+                        "Skipping unavailable subscriber {0} of {1}".format(peer, connection)
+                    )
+                    continue
+
                 # try to execute the subscription trigger on the subscribed peer
                 # For the purpose of protecting the event triggering peer from
                 # remote errors, all connection errors and remote runtime errors
@@ -420,20 +541,18 @@ class Peer(object):
         for thread in threads:
             thread.join()
 
-        # create a working copy before we prune
-        updated_subscriptions = copy.deepcopy(self.registered_subscriptions)
-
-        # Clean out the stale peers that are no longer valid.
-        for event, event_data in self.registered_subscriptions.items():
+        if not stale:
+            return
 
-            # clean out the offline or unreachable peers
-            for stale_address in stale:
-                if stale_address in event_data:
-                    del updated_subscriptions[event][stale_address]
+        # Clean out the stale peers that are no longer valid, in place so the
+        # subscriptions registered in the meantime are kept.
+        with self._subscriptions_lock:
+            for event, event_data in list(self.registered_subscriptions.items()):
 
-            # delete the event if it is empty
-            if not event_data.keys():
-                del updated_subscriptions[event]
+                # clean out the offline or unreachable peers
+                for stale_address in stale:
+                    event_data.pop(stale_address, None)
 
-        # update the subscriptions registry
-        self._registered_subscriptions = updated_subscriptions
+                # delete the event if it is empty
+                if not event_data:
+                    del self.registered_subscriptions[event]
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+Connection Pool Module
+----------------------
+
+Contains the keep-alive connection pool used for outgoing requests.
+"""
+
+__all__ = ['ConnectionPool']
+
+# std imports
+import time
+import socket
+import threading
+
+# package imports
+import net
+from net.peer import local, shared
+from net.peer.channel import Channel, ConnectTimeout
+
+
+class ConnectionPool(object):
+    """
+    Keeps multiplexed channels open per (host, port) so consecutive requests to
+    the same peer skip the connect and teardown, and concurrent requests share
+    a connection instead of opening one each. Do not interact with directly, it
+    is managed by the ``PeerServer``.
+    """
+
+    def __init__(self, size=None, idle=None):
+        self._size = size
+        self._idle = idle
+        self._lock = threading.Lock()
+
+        # (host, port) -> [Channel, ...]
+        self._channels = {}
+
+        # (host, port) -> number of channels being opened
+        self._opening = {}
+        self._last_sweep = time.time()
+
+        # counters
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @property
+    def size(self):
+        """
+        Maximum number of channels kept open per peer.
+
+        :return: int
+        """
+        if self._size is None:
+            return net.POOL_SIZE
+        return self._size
+
+    @property
+    def idle(self):
+        """
+        Seconds an idle channel is kept before it is evicted.
+
+        :return: float
+        """
+        if self._idle is None:
+            return net.POOL_IDLE
+        return self._idle
+
+    @property
+    def hits(self):
+        """
+        Number of requests that reused a pooled channel.
+
+        :return: int
+        """
+        return self._hits
+
+    @property
+    def misses(self):
+        """
+        Number of requests that had to open a new channel.
+
+        :return: int
+        """
+        return self._misses
+
+    @staticmethod
+    def close(sock):
+        """
+        Safely close a socket.
+
+        :param sock: socket
+        :return: None
+        """
+        try:
+            sock.close()
+        except socket.error:
+            pass
+
+    def connect(self, host, port, time_out=None):
+        """
+        Open a new connection to the peer, over its unix domain socket if it
+        runs on the local host.
+
+        :param host: target host ipv4 format
+        :param port: target port int
+        :param time_out: connect timeout in seconds, ``net.CONNECT_TIME_OUT``
+         if not given
+        :return: socket
+        """
+        sock = local.connect(host, port, time_out)
+        if sock is not None:
+            return sock
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        # never wait forever on a peer that went down
+        sock.settimeout(time_out or net.CONNECT_TIME_OUT or None)
+
+        try:
+            sock.connect((host, port))
+        except socket.timeout:
+            self.close(sock)
+            raise ConnectTimeout("Timed out connecting to {0}".format((host, port)))
+        except Exception:
+            self.close(sock)
+            raise
+
+        sock.settimeout(time_out or None)
+
+        return sock
+
+    def open(self, host, port, time_out=None):
+        """
+        Open a new connection for a channel, moving it onto shared memory if
+        that is configured and the peer runs on the local host.
+
+        :param host: target host ipv4 format
+        :param port: target port int
+        :param time_out: connect timeout in seconds
+        :return: socket or ``RingSocket``
+        """
+        sock = self.connect(host, port, time_out)
+        if not shared.wanted(host, port):
+            return sock
+
+        upgraded = shared.upgrade(sock, host, port, time_out)
+        if upgraded is None:
+            return self.connect(host, port, time_out)
+
+        return upgraded
+
+    def acquire(self, host, port, time_out=None):
+        """
+        Get a channel to the peer. The least busy open channel is reused unless
+        it is busy and there is room in the pool for another one.
+
+        :param host: target host ipv4 format
+        :param port: target port int
+        :param time_out: connect timeout in seconds
+        :return: (``Channel``, bool reused)
+        """
+        self.sweep()
+        address = (host, port)
+
+        with self._lock:
+            channels = [channel for channel in self._channels.get(address, []) if not channel.closed]
+            self._channels[address] = channels
+            opening = self._opening.get(address, 0)
+
+            if channels:
+                channel = min(channels, key=lambda item: item.in_flight)
+                if not channel.in_flight or len(channels) + opening >= self.size:
+                    self._hits += 1
+                    return channel, True
+
+            self._misses += 1
+            self._opening[address] = opening + 1
+
+        try:
+            channel = Channel(host, port, self.open(host, port, time_out))
+        finally:
+            with self._lock:
+                self._opening[address] -= 1
+
+        with self._lock:
+            self._channels.setdefault(address, []).append(channel)
+
+        return channel, False
+
+    def discard(self, channel):
+        """
+        Close a channel that is broken or in an unknown state.
+
+        :param channel: ``Channel``
+        :return: None
+        """
+        channel.close()
+
+    def sweep(self, force=False):
+        """
+        Evict the channels that have been idle for longer than the idle timeout.
+        This runs at most once a second unless forced.
+
+        :param force: bool
+        :return: None
+        """
+        now = time.time()
+        if not force and now - self._last_sweep < 1:
+            return
+
+        with self._lock:
+            self._last_sweep = now
+            for address, channels in list(self._channels.items()):
+                alive = []
+                for channel in channels:
+                    if channel.closed:
+                        continue
+
+                    if channel.in_flight or now - channel.last_used < self.idle:
+                        alive.append(channel)
+                        continue
+
+                    self._evictions += 1
+                    channel.close()
+
+                if alive:
+                    self._channels[address] = alive
+                else:
+                    del self._channels[address]
+
+    def clear(self):
+        """
+        Close every pooled channel.
+
+        :return: None
+        """
+        with self._lock:
+            for channels in self._channels.values():
+                for channel in channels:
+                    channel.close()
+            self._channels = {}
+
+    def stats(self):
+        """
+        Get the pool counters.
+
+        :return: {
+            'hits': int,
+            'misses': int,
+            'evictions': int,
+            'open': int,
+            'idle': int,
+            'in_flight': int,
+        }
+        """
+        with self._lock:
+            channels = [
+                channel for address in self._channels
+                for channel in self._channels[address] if not channel.closed
+            ]
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'open': len(channels),
+                'idle': len([channel for channel in channels if not channel.in_flight]),
+                'in_flight': sum(channel.in_flight for channel in channels),
+            }
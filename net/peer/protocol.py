@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+"""
+Protocol Module
+---------------
+
+Contains the framing used on the wire between peers.
+
+Every message is sent as a fixed size header followed by the body.
+
+.. code-block:: text
+
+    +-------+---------+------+-------+----+-------+--------+----------------+
+    | magic | version | type | codec | id | parts | length | body           |
+    | 2s    | B       | B    | B     | I  | H     | Q      | <length> bytes |
+    +-------+---------+------+-------+----+-------+--------+----------------+
+
+The codec is the id of the ``net.peer.codecs.Codec`` the body is encoded with.
+The id is the request id, a response carries the id of the request it answers
+so many requests can be in flight on a single connection and be answered in any
+order. Parts is the number of ``BUFFER`` frames that follow the message, each
+one carrying the raw memory of a buffer that was sent out-of-band (see
+``net.peer.buffers``). A ``SHARED_MEMORY`` message moves the connection onto
+shared memory (see ``net.peer.shared``). ``STREAM``, ``CREDIT`` and ``CANCEL``
+messages carry streamed responses and their flow control (see
+``net.peer.streams``). A ``LOAD`` message reports the load of the peer right
+before the response to a request that asked for it (see ``net.peer.balancer``).
+
+Frames of any other version are rejected with a ``ProtocolError``, which
+closes the connection, instead of being read with the wrong layout.
+
+The first byte of the magic is not valid ascii so a peer running an older
+version of net, that expects raw ascii json, fails to decode the request and
+responds with an error packet instead of hanging.
+"""
+
+__all__ = [
+    'HEADER',
+    'MAGIC',
+    'VERSION',
+    'LEGACY',
+    'REQUEST',
+    'RESPONSE',
+    'BUFFER',
+    'SHARED_MEMORY',
+    'STREAM',
+    'CREDIT',
+    'CANCEL',
+    'LOAD',
+    'Frame',
+    'ProtocolError',
+    'is_framed',
+    'pack_message',
+    'send_message',
+    'recv_header',
+    'unpack_header',
+    'recv_body',
+    'recv_message',
+    'recv_exact',
+    'recv_legacy',
+]
+
+# std imports
+import struct
+import socket
+from collections import namedtuple
+
+# frame description
+MAGIC = b'\x89N'
+VERSION = 4
+HEADER = struct.Struct('!2sBBBIHQ')
+
+# request ids wrap around at this value
+MAX_ID = 0xFFFFFFFF
+
+# codec id used for unframed messages, these are always json.
+LEGACY_CODEC = 1
+
+# message types
+LEGACY = 0
+REQUEST = 1
+RESPONSE = 2
+BUFFER = 3
+SHARED_MEMORY = 4
+STREAM = 5
+CREDIT = 6
+CANCEL = 7
+LOAD = 8
+
+# largest single read handed to the kernel
+CHUNK_SIZE = 1024 * 1024
+
+# most buffers handed to a single sendmsg call
+MAX_PARTS = 512
+
+# most buffers a single message can carry
+MAX_BUFFERS = 0xFFFF
+
+
+# a received message
+Frame = namedtuple('Frame', ['type', 'codec', 'id', 'body', 'buffers'])
+
+
+class ProtocolError(socket.error):
+    """
+    Raised when a peer sends data that can't be read as a frame.
+    """
+
+
+def is_framed(raw):
+    """
+    Check if the leading bytes of a message are the start of a frame.
+
+    :param raw: bytes
+    :return: bool
+    """
+    return bytes(raw[:1]) == MAGIC[:1]
+
+
+def pack_message(message_type, body, codec=LEGACY_CODEC, request_id=0, buffers=()):
+    """
+    Build the parts of a framed message followed by a ``BUFFER`` frame for
+    each of the out-of-band buffers, without joining them.
+
+    :param message_type: int
+    :param body: bytes like
+    :param codec: id of the codec the body is encoded with
+    :param request_id: id of the request this message belongs to
+    :param buffers: list of memoryview sent out-of-band
+    :return: list of bytes like
+    """
+    if len(buffers) > MAX_BUFFERS:
+        raise ProtocolError("A message can only carry {0} buffers.".format(MAX_BUFFERS))
+
+    parts = [
+        HEADER.pack(MAGIC, VERSION, message_type, codec, request_id, len(buffers), len(body)),
+        body
+    ]
+    for buf in buffers:
+        parts.append(HEADER.pack(MAGIC, VERSION, BUFFER, 0, request_id, 0, len(buf)))
+        parts.append(buf)
+
+    return parts
+
+
+def send_message(sock, message_type, body, codec=LEGACY_CODEC, request_id=0, buffers=()):
+    """
+    Send a single framed message followed by a ``BUFFER`` frame for each of
+    the out-of-band buffers. The headers, the body and the buffers are handed
+    to the kernel together without joining them into a new buffer first.
+
+    :param sock: socket
+    :param message_type: int
+    :param body: bytes like
+    :param codec: id of the codec the body is encoded with
+    :param request_id: id of the request this message belongs to
+    :param buffers: list of memoryview sent out-of-band
+    :return: None
+    """
+    parts = pack_message(message_type, body, codec, request_id, buffers)
+
+    # windows doesn't support scatter/gather sends
+    if not hasattr(sock, 'sendmsg'):
+        for part in parts:
+            sock.sendall(part)
+        return
+
+    parts = [memoryview(part) for part in parts if len(part)]
+    while parts:
+        sent = sock.sendmsg(parts[:MAX_PARTS])
+
+        # drop everything that made it out and send the rest
+        while parts and sent >= len(parts[0]):
+            sent -= len(parts[0])
+            parts.pop(0)
+        if parts:
+            parts[0] = parts[0][sent:]
+
+
+def recv_exact(sock, size, partial=False):
+    """
+    Read exactly ``size`` bytes from the socket into a single preallocated
+    buffer.
+
+    :param sock: socket
+    :param size: int
+    :param partial: return what was read if the socket closes early instead of raising
+    :return: bytearray or None if the socket was closed before any data arrived
+    """
+    buf = bytearray(size)
+    view = memoryview(buf)
+
+    received = 0
+    while received < size:
+        try:
+            read = sock.recv_into(view[received:], min(size - received, CHUNK_SIZE))
+        except socket.timeout:
+            # timing out half way through a message leaves the stream unusable
+            if received:
+                raise ProtocolError("Timed out after {0} of {1} bytes.".format(received, size))
+            raise
+        if not read:
+            if not received:
+                return None
+            if partial:
+                return buf[:received]
+            raise ProtocolError(
+                "Connection closed after {0} of {1} bytes.".format(received, size)
+            )
+        received += read
+
+    return buf
+
+
+def recv_header(sock):
+    """
+    Read a single frame header.
+
+    :param sock: socket
+    :return: (message type, codec, request id, parts, length), bytearray with
+     the unframed data read if the peer isn't framing, or None if the socket was
+     closed
+    """
+    header = recv_exact(sock, HEADER.size, partial=True)
+    if header is None or not is_framed(header):
+        return header
+
+    return unpack_header(header)
+
+
+def unpack_header(header):
+    """
+    Unpack a frame header.
+
+    :param header: bytes like
+    :return: (message type, codec, request id, parts, length)
+    :raises: ``ProtocolError`` if it isn't a header of this version
+    """
+    if len(header) < HEADER.size:
+        raise ProtocolError("Connection closed while reading the header.")
+
+    magic, version, message_type, codec, request_id, parts, length = HEADER.unpack(bytes(header))
+    if magic != MAGIC:
+        raise ProtocolError("Invalid frame received.")
+
+    # the header and the messages changed with every version before this one
+    if version != VERSION:
+        raise ProtocolError("Unsupported protocol version {0}, expected {1}.".format(
+            version, VERSION
+        ))
+
+    return message_type, codec, request_id, parts, length
+
+
+def recv_body(sock, length):
+    """
+    Read the body of a frame into a single preallocated buffer.
+
+    :param sock: socket
+    :param length: int
+    :return: bytearray
+    """
+    if not length:
+        return bytearray()
+
+    try:
+        body = recv_exact(sock, length)
+    except socket.timeout:
+        raise ProtocolError("Timed out while reading the body.")
+
+    if body is None:
+        raise ProtocolError("Connection closed while reading the body.")
+
+    return body
+
+
+def recv_message(sock):
+    """
+    Read a single framed message and the out-of-band buffers that follow it
+    from the socket. If the data on the socket isn't framed, it was sent by a
+    peer running an older version of net and the bytes read so far are
+    returned with the ``LEGACY`` message type.
+
+    :param sock: socket
+    :return: ``Frame`` or None if the socket was closed
+    """
+    header = recv_header(sock)
+    if header is None:
+        return None
+
+    if not isinstance(header, tuple):
+        return Frame(LEGACY, LEGACY_CODEC, 0, header, [])
+
+    message_type, codec, request_id, parts, length = header
+    body = recv_body(sock, length)
+
+    buffers = []
+    for _ in range(parts):
+        try:
+            header = recv_header(sock)
+        except socket.timeout:
+            raise ProtocolError("Timed out while reading a buffer.")
+
+        if not isinstance(header, tuple) or header[0] != BUFFER or header[2] != request_id:
+            raise ProtocolError("Expected a buffer for request {0}.".format(request_id))
+
+        buffers.append(memoryview(recv_body(sock, header[4])))
+
+    return Frame(message_type, codec, request_id, body, buffers)
+
+
+def recv_legacy(sock, head=b''):
+    """
+    Read an unframed response from a peer running an older version of net.
+    These peers send a single response and close the connection.
+
+    :param sock: socket
+    :param head: bytes that have already been read
+    :return: bytearray
+    """
+    data = bytearray(head)
+    while True:
+        chunk = sock.recv(CHUNK_SIZE)
+        if not chunk:
+            return data
+        data.extend(chunk)
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+Replicas Module
+---------------
+
+Contains the hedged and retried calls to connections served by several peers.
+
+A call to a group is sent to one of its peers. If that peer hasn't answered
+after the hedge delay a backup request is sent to another peer, and the first
+answer wins. Calls that fail to reach a peer, or that a peer was too busy to
+run, are retried on the next one. Only use this for connections that are safe
+to run more than once, the losing requests are not stopped.
+
+Every extra request, hedge or retry, is paid for from the retry budget of the
+group. The budget grows with the number of calls made to the group, so a group
+that is struggling gets a bounded amount of extra traffic instead of twice the
+load.
+"""
+
+__all__ = [
+    'RetryBudget',
+    'retry_budget',
+    'replicas',
+    'hedge',
+]
+
+# std imports
+import time
+import inspect
+import socket
+import threading
+from collections import deque, OrderedDict
+from concurrent import futures
+
+# compatibility
+import six
+
+# package imports
+import net
+from net.peer import balancer, breakers
+
+# seconds the retry budgets look back
+WINDOW = 10.0
+
+# group -> RetryBudget, least recently used first
+BUDGETS = OrderedDict()
+
+# most budgets kept, explicit peer lists can come and go without end
+BUDGET_LIMIT = 128
+
+# threading
+LOCK = threading.Lock()
+
+
+class RetryBudget(object):
+    """
+    Number of hedges and retries that can be sent to a group. Extra requests
+    are allowed while they stay under ``minimum`` plus ``ratio`` times the
+    calls made in the last ``WINDOW`` seconds.
+
+    :param ratio: extra requests allowed per call
+    :param minimum: extra requests always allowed per ``WINDOW`` seconds
+    """
+
+    def __init__(self, ratio=None, minimum=None):
+        self._ratio = net.RETRY_RATIO if ratio is None else ratio
+        self._minimum = net.RETRY_MINIMUM if minimum is None else minimum
+        self._calls = deque()
+        self._extra = deque()
+        self._lock = threading.Lock()
+
+        # metrics
+        self._denied = 0
+
+    def _trim(self):
+        """
+        Forget what happened before the window, the lock has to be held.
+        """
+        start = time.time() - WINDOW
+        for history in (self._calls, self._extra):
+            while history and history[0] < start:
+                history.popleft()
+
+    def record(self):
+        """
+        Count a call, which adds to the budget.
+        """
+        with self._lock:
+            self._trim()
+            self._calls.append(time.time())
+
+    def withdraw(self):
+        """
+        Ask to send an extra request.
+
+        :return: bool, False if the budget is spent
+        """
+        with self._lock:
+            self._trim()
+            if len(self._extra) >= self._minimum + self._ratio * len(self._calls):
+                self._denied += 1
+                return False
+
+            self._extra.append(time.time())
+            return True
+
+    def stats(self):
+        """
+        Get the retry budget metrics.
+
+        :return: {
+            'calls': int calls in the window,
+            'extra': int hedges and retries in the window,
+            'denied': int hedges and retries that weren't sent,
+        }
+        """
+        with self._lock:
+            self._trim()
+            return {
+                'calls': len(self._calls),
+                'extra': len(self._extra),
+                'denied': self._denied,
+            }
+
+
+def retry_budget(group):
+    """
+    Get the retry budget of a group.
+
+    :param group: name of the group or list of ``net.Peer`` or (host, port)
+    :return: ``RetryBudget``
+    """
+    if not isinstance(group, six.string_types) and group is not None:
+        group = frozenset(net.Peer().address(peer) for peer in group)
+
+    with LOCK:
+        current = BUDGETS.pop(group, None)
+        if current is None:
+            current = RetryBudget()
+        BUDGETS[group] = current
+
+        while len(BUDGETS) > BUDGET_LIMIT:
+            BUDGETS.popitem(last=False)
+
+        return current
+
+
+def replicas(group):
+    """
+    Get the peers of a group in the order they are tried. The first peer is
+    picked by its load, the rest follow from the least to the most busy and
+    peers whose circuit breaker is open go last.
+
+    :param group: name of the group or list of ``net.Peer`` or (host, port)
+    :return: list of ``net.Peer`` or (host, port)
+    """
+    if group is None or isinstance(group, six.string_types):
+        peers = list(net.peer_group(group))
+    else:
+        peers = list(group)
+
+    local_peer = net.Peer()
+    available = [peer for peer in peers if breakers.available(*local_peer.address(peer))]
+    unavailable = [peer for peer in peers if peer not in available]
+
+    return balancer.rank(available) + unavailable
+
+
+def _discard(future):
+    """
+    Close the streamed response of a request that lost the race.
+
+    :param future: ``concurrent.futures.Future``
+    """
+    try:
+        response = future.result()
+    except Exception:
+        return
+
+    if inspect.isgenerator(response):
+        response.close()
+
+
+def hedge(executor, call, peers, hedge_after=None, retries=1, time_out=None, budget=None):
+    """
+    Call a connection on one of several peers, hedging slow requests and
+    retrying failed ones on the next peer.
+
+    :param executor: ``concurrent.futures.Executor`` sending the requests
+    :param call: function taking a peer and making the request
+    :param peers: list of ``net.Peer`` or (host, port), in the order to try them
+    :param hedge_after: seconds to wait on a request before sending a backup
+     request to the next peer, None never hedges
+    :param retries: most extra requests, hedges and retries, for the call
+    :param time_out: seconds to wait for an answer
+    :param budget: ``RetryBudget`` paying for the extra requests
+    :return: response of the first peer to answer
+    :raises: the error of the last request if none of them were answered
+    """
+    peers = list(peers)
+    if not peers:
+        raise net.PeerUnavailable("There are no peers to send the request to.")
+
+    budget = budget if budget is not None else RetryBudget()
+    end = time.time() + time_out if time_out else None
+    pending = {}
+    error = None
+    sent = [0]
+
+    def send():
+        peer = peers.pop(0)
+        pending[executor.submit(call, peer)] = peer
+
+    def extra():
+        return bool(peers) and retries - sent[0] > 0 and budget.withdraw()
+
+    budget.record()
+    send()
+
+    try:
+        while pending:
+            wait = hedge_after if hedge_after is not None and peers else None
+            if end is not None:
+                left = max(end - time.time(), 0)
+                wait = left if wait is None else min(wait, left)
+
+            done, _ = futures.wait(list(pending), timeout=wait, return_when=futures.FIRST_COMPLETED)
+
+            if not done:
+                if end is not None and time.time() >= end:
+                    raise net.DeadlineExceeded(
+                        "None of the peers answered within {0} seconds.".format(time_out)
+                    )
+
+                # the request is slow, race a backup request against it
+                if extra():
+                    sent[0] += 1
+                    send()
+                else:
+                    hedge_after = None
+                continue
+
+            for future in done:
+                pending.pop(future)
+                try:
+                    return future.result()
+                except (socket.error, net.PeerBusy) as err:
+                    # the peer couldn't be reached or didn't run the request
+                    error = err
+
+            # try the next peer if nothing else is still running
+            if not pending and extra():
+                sent[0] += 1
+                send()
+
+        raise error
+
+    finally:
+        for future in pending:
+            future.add_done_callback(_discard)
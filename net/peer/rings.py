@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+Rings Module
+------------
+
+Contains the consistent hash rings used to send every call for a key to the
+same peer of a group.
+
+Every peer is placed on the ring ``net.RING_NODES`` times, at the hash of its
+address and the number of the node. A key belongs to the first node after its
+own hash, going clockwise. When a peer joins or leaves only the keys on its
+own nodes move, about 1/N of them for a group of N peers, the rest stay put.
+
+The ring of a group follows the discovery cache. Every lookup compares the
+peers of the group with the peers on the ring and only adds or removes the
+ones that changed.
+"""
+
+__all__ = [
+    'HashRing',
+    'ring',
+    'key_hash',
+]
+
+# std imports
+import bisect
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
+
+# compatibility
+import six
+
+# package imports
+import net
+from net.peer import caches
+
+# group -> HashRing, least recently used first
+RINGS = OrderedDict()
+
+# most rings kept, explicit peer lists can come and go without end
+RING_LIMIT = 128
+
+# threading
+LOCK = threading.Lock()
+
+
+def key_hash(key):
+    """
+    Position of a key on the ring. Equal keys get the same position on every
+    peer, so every peer routes a key the same way.
+
+    :param key: Anything
+    :return: int
+    """
+    if isinstance(key, six.text_type):
+        raw = key.encode('utf-8')
+    elif isinstance(key, six.binary_type):
+        raw = key
+    else:
+        # objects without a canonical form are placed by their repr
+        try:
+            raw = caches.canonical([key], {}).encode('utf-8')
+        except TypeError:
+            raw = repr(key).encode('utf-8')
+
+    return struct.unpack('!Q', hashlib.md5(raw).digest()[:8])[0]
+
+
+class HashRing(object):
+    """
+    Consistent hash ring over the peers of a group.
+
+    .. code-block:: python
+
+        ring = HashRing(net.peer_group('shards'))
+        peer = ring.lookup(entity_id)
+
+    :param peers: list of ``net.Peer`` or (host, port)
+    :param nodes: virtual nodes per peer
+    """
+
+    def __init__(self, peers=(), nodes=None):
+        self._nodes = nodes if nodes else net.RING_NODES
+        self._hashes = []
+        self._owners = {}
+        self._peers = {}
+        self._lock = threading.Lock()
+
+        self.update(peers)
+
+    def __len__(self):
+        return len(self._peers)
+
+    def __contains__(self, peer):
+        return net.Peer().address(peer) in self._peers
+
+    def _points(self, address):
+        """
+        Positions of the virtual nodes of a peer.
+
+        :param address: (host, port)
+        :return: list of int
+        """
+        return [
+            key_hash('{0}:{1}#{2}'.format(address[0], address[1], index))
+            for index in range(self._nodes)
+        ]
+
+    def add(self, peer):
+        """
+        Place a peer on the ring.
+
+        :param peer: ``net.Peer`` or (host, port)
+        """
+        address = net.Peer().address(peer)
+
+        with self._lock:
+            if address in self._peers:
+                self._peers[address] = peer
+                return
+
+            self._peers[address] = peer
+            for point in self._points(address):
+                # 64 bit positions practically never collide, the first peer
+                # keeps the node if they do
+                if point in self._owners:
+                    continue
+
+                bisect.insort(self._hashes, point)
+                self._owners[point] = address
+
+    def remove(self, peer):
+        """
+        Take a peer off the ring, its keys move to the peers after its nodes.
+
+        :param peer: ``net.Peer`` or (host, port)
+        """
+        address = net.Peer().address(peer)
+
+        with self._lock:
+            if self._peers.pop(address, None) is None:
+                return
+
+            for point in self._points(address):
+                if self._owners.get(point) != address:
+                    continue
+
+                del self._owners[point]
+                del self._hashes[bisect.bisect_left(self._hashes, point)]
+
+    def update(self, peers):
+        """
+        Bring the ring in line with the peers of the group, only the peers
+        that joined or left are touched.
+
+        :param peers: list of ``net.Peer`` or (host, port)
+        """
+        local_peer = net.Peer()
+        current = dict((local_peer.address(peer), peer) for peer in peers)
+
+        with self._lock:
+            left = [address for address in self._peers if address not in current]
+
+        for address in left:
+            self.remove(address)
+
+        for peer in current.values():
+            self.add(peer)
+
+    def lookup(self, key):
+        """
+        Get the peer a key belongs to.
+
+        :param key: Anything
+        :return: ``net.Peer`` or (host, port), None if the ring is empty
+        """
+        peers = self.preference(key, 1)
+        return peers[0] if peers else None
+
+    def preference(self, key, count=None):
+        """
+        Get the peers a key belongs to in order, the owner first followed by
+        the peers that take the key over if the ones before them leave.
+
+        :param key: Anything
+        :param count: most peers returned, all of them if not given
+        :return: list of ``net.Peer`` or (host, port)
+        """
+        with self._lock:
+            if not self._hashes:
+                return []
+
+            count = len(self._peers) if count is None else min(count, len(self._peers))
+            start = bisect.bisect(self._hashes, key_hash(key))
+
+            found = []
+            for index in range(len(self._hashes)):
+                address = self._owners[self._hashes[(start + index) % len(self._hashes)]]
+                if address not in found:
+                    found.append(address)
+                    if len(found) == count:
+                        break
+
+            return [self._peers[address] for address in found]
+
+
+def ring(group):
+    """
+    Get the hash ring of a group, brought up to date with the discovery cache.
+
+    :param group: name of the group or list of ``net.Peer`` or (host, port)
+    :return: ``HashRing``
+    """
+    if group is None or isinstance(group, six.string_types):
+        peers = net.peer_group(group)
+        key = group
+    else:
+        peers = list(group)
+        key = frozenset(net.Peer().address(peer) for peer in peers)
+
+    with LOCK:
+        current = RINGS.pop(key, None)
+        if current is None:
+            current = HashRing()
+        RINGS[key] = current
+
+        while len(RINGS) > RING_LIMIT:
+            RINGS.popitem(last=False)
+
+    current.update(peers)
+    return current
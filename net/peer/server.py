@@ -10,10 +10,10 @@ __all__ = ['PeerServer']
 
 # std imports
 import re
-import json
 import socket
 import traceback
 import threading
+import socketserver
 
 # compatibility
 from six import add_metaclass
@@ -22,13 +22,26 @@ from six import add_metaclass
 import net
 
 # package imports
+from net.peer import balancer, breakers, buffers, codecs, local, protocol, streams
 from net.peer.handler import PeerHandler
-from net.imports import socketserver, ConnectionRefusedError
+from net.peer.pool import ConnectionPool
+from net.peer.workers import WorkerPool, ConnectionLimit, LimitedThreadingMixIn
+from net.peer.channel import LegacyPeerError, RequestNotSent
+from net.peer.context import budget, outgoing
 
 
 # globals
 SINGLETON = None
 
+# outgoing keep-alive connections
+POOL = ConnectionPool()
+
+# server engines
+ENGINES = ('threading', 'asyncio')
+
+# peers that don't understand framed messages
+LEGACY_PEERS = set()
+
 # utilities
 ID_REGEX = re.compile(r"(?P<host>.+):(?P<port>\d+) -> (?P<group>.+)")
 
@@ -55,12 +68,15 @@ class SingletonServer(type):
 
 # noinspection PyMissingConstructor
 @add_metaclass(SingletonServer)
-class PeerServer(socketserver.ThreadingMixIn, socketserver.TCPServer, object):
+class PeerServer(LimitedThreadingMixIn, socketserver.TCPServer, object):
     # adding to inheritance object for 2.7 support
     """
     Base PeerServer class that handles all incoming and outgoing requests.
     """
 
+    # keep-alive handler threads should never hold up the application exiting
+    daemon_threads = True
+
     @staticmethod
     def ports():
         """
@@ -90,14 +106,53 @@ class PeerServer(socketserver.ThreadingMixIn, socketserver.TCPServer, object):
         except (ConnectionRefusedError, socket.error):
             return False
 
-    def __init__(self, test=False):
+    def __init__(self, test=False, engine=None):
+
+        self._engine = engine if engine else net.ENGINE
+        if self._engine not in ENGINES:
+            raise ValueError("Invalid engine {0}, expected one of {1}".format(
+                self._engine, ', '.join(ENGINES)
+            ))
 
         # descriptor
         self._host = net.HOST_IP
+        self._port = None
+        self._workers = None
+        self._connections = None
+        self._runner = None
+        self._unix = None
+
+        # worker processes of a process pool only run connections
+        if net.PROCESS_WORKER:
+            return
+
         self._port = self.scan_for_port()
 
+        # bounded pool running the incoming requests, and a thread for each of
+        # a bounded number of incoming connections
+        self._workers = WorkerPool()
+        self._connections = ConnectionLimit()
+
+        # peers on the same host connect over a unix domain socket
+        self._unix = local.serve(self)
+
+        # The asyncio engine serves the sockets bound above from an event loop
+        # instead of a thread per connection.
+        serve = self.serve_forever
+        if self._engine == 'asyncio':
+            from net.peer.aio import AsyncEngine
+            self._runner = AsyncEngine(
+                self.socket, self._workers, self._unix.socket if self._unix else None
+            )
+            serve = self._runner.serve_forever
+
+        elif self._unix:
+            unix_thread = threading.Thread(target=self._unix.serve_forever)
+            unix_thread.daemon = True
+            unix_thread.start()
+
         # handle threading
-        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread = threading.Thread(target=serve)
         self._thread.daemon = True
 
         # launch the server
@@ -121,6 +176,53 @@ class PeerServer(socketserver.ThreadingMixIn, socketserver.TCPServer, object):
         """
         return self._host
 
+    @property
+    def socket_path(self):
+        """
+        Path of the unix domain socket peers on the same host connect to.
+
+        :return: str or None if it isn't available
+        """
+        if self._unix:
+            return self._unix.server_address
+        return None
+
+    @property
+    def engine(self):
+        """
+        Name of the engine serving incoming requests.
+
+        :return: str
+        """
+        return self._engine
+
+    @property
+    def workers(self):
+        """
+        Bounded worker pool running incoming requests.
+
+        :return: ``WorkerPool``
+        """
+        return self._workers
+
+    @property
+    def connections(self):
+        """
+        Limit on the incoming connections served at the same time.
+
+        :return: ``ConnectionLimit``
+        """
+        return self._connections
+
+    @property
+    def pool(self):
+        """
+        Keep-alive connection pool used for outgoing requests.
+
+        :return: ``ConnectionPool``
+        """
+        return POOL
+
     def scan_for_port(self):
         """
         Scan for a free port to bind to. You can override the default port range
@@ -158,58 +260,178 @@ class PeerServer(socketserver.ThreadingMixIn, socketserver.TCPServer, object):
     @staticmethod
     def request(host, port, connection, args, kwargs):
         """
-        Request an action and response from a peer.
+        Request an action and response from a peer. Connections are pooled
+        per (host, port), kept alive between requests and shared by every
+        thread requesting from the same peer.
 
         :param host: target host ipv4 format
         :param port: target port int
         :param connection: the target connection id to run
-        :param args: positional arguments to pass to the target connection (must be json compatible)
-        :param kwargs: keyword arguments to pass to the target connection (must be json compatible)
-        :return: response from peer
+        :param args: positional arguments to pass to the target connection (must be compatible with the codec)
+        :param kwargs: keyword arguments to pass to the target connection (must be compatible with the codec),
+         ``time_out`` sets the deadline of the request instead
+        :return: response from peer, or an iterator over the items if the
+         connection returned a generator, or the ``UNAVAILABLE`` flag if the
+         circuit breaker of the peer is open
         """
-        # socket connection
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # The time out is sent as the deadline of the request instead of being
+        # passed on, calls made while answering a request get what is left of it.
+        time_out = budget(kwargs.get('time_out'))
+        kwargs = outgoing(kwargs)
 
-        # set the time out on the function
-        if kwargs.get('time_out'):
-            sock.settimeout(kwargs.get('time_out'))
+        # discovery pings don't get a breaker or load figures for every port swept
+        if breakers.scanned():
+            return PeerServer.send(host, port, connection, args, kwargs, time_out)
 
-        # connect
-        sock.connect((host, port))
+        # Peers that failed too many requests in a row are answered with the
+        # UNAVAILABLE flag straight away instead of waiting on them again.
+        with breakers.guard(host, port) as allowed:
+            if not allowed:
+                return net.Peer().get_flag('UNAVAILABLE')
 
-        # convert the data to json and then bytes
-        data = {'connection': connection, 'args': args, 'kwargs': kwargs}
+            # outstanding requests and round trips pick the least busy peers
+            with balancer.track(host, port):
+                return PeerServer.send(host, port, connection, args, kwargs, time_out)
 
-        try:
-            data = json.dumps(data)
-        except TypeError:
-            data = str(data)
+    @staticmethod
+    def send(host, port, connection, args, kwargs, time_out=None):
+        """
+        Send a request to a peer and wait for the response, backs ``request``.
+
+        :param host: target host ipv4 format
+        :param port: target port int
+        :param connection: the target connection id to run
+        :param args: positional arguments to pass to the target connection
+        :param kwargs: keyword arguments to pass to the target connection
+        :param time_out: seconds to wait for the response
+        :return: response from peer, or an iterator over the items if the
+         connection returned a generator
+        """
+        # peers running an older version of net don't understand framing
+        if (host, port) in LEGACY_PEERS:
+            return PeerServer.legacy_request(host, port, connection, args, kwargs, time_out)
+
+        # an iterator or file object argument is streamed after the request
+        stream_args, stream_kwargs, upload = streams.extract(args, kwargs)
+        data = {
+            'connection': connection, 'args': stream_args, 'kwargs': stream_kwargs,
+            'stream': True, 'load': balancer.wanted(host, port),
+        }
+        if time_out:
+            data['deadline'] = time_out
+
+        # encode with the fastest codec both peers support, binary data is
+        # sent out-of-band next to the encoded request.
+        codec = codecs.negotiate(host, port)
+        encoded, out_of_band = buffers.extract(data)
+        payload = codec.encode(encoded)
+
+        while True:
+            reused = False
+
+            try:
+                # share a pooled channel to the peer if there is one
+                channel, reused = POOL.acquire(host, port, time_out)
+
+                # send request and wait for the matching response
+                frame = channel.request(payload, codec.id, time_out, out_of_band, upload)
+
+            except LegacyPeerError:
+                # The peer runs an older version of net, it answered the frame
+                # with an error and closed the connection. Send it again the
+                # way it expects.
+                net.LOGGER.debug("Legacy peer detected {0}".format((host, port)))
+                LEGACY_PEERS.add((host, port))
+                if upload is not None and upload.started:
+                    raise
+                return PeerServer.legacy_request(host, port, connection, args, kwargs, time_out)
+
+            except Exception as err:
+                # The peer closed the pooled channel before the request was
+                # sent, try again on a fresh one. A request that was sent may
+                # have run already, so it is never sent twice.
+                if reused and isinstance(err, RequestNotSent):
+                    continue
+
+                # handle error logging
+                net.LOGGER.error(traceback.format_exc())
+                raise err
+
+            break
+
+        # generator connections answer with a stream of items
+        if isinstance(frame, streams.ResponseStream):
+            return PeerServer.iterate(frame, time_out, host)
+
+        # only accept a response in a codec this peer allows from the peer
+        response = codecs.accept(frame.codec, host).decode(frame.body)
 
-        payload = data.encode('ascii')
+        # The peer doesn't trust this peer with the codec and refused the request
+        # without running it, send it again in json unless the streamed arguments
+        # are already gone.
+        if codecs.refused(codec, frame, response) and (upload is None or not upload.started):
+            codecs.downgrade(host, port)
+            return PeerServer.send(host, port, connection, args, kwargs, time_out)
 
+        return buffers.restore(response, frame.buffers)
+
+    @staticmethod
+    def iterate(stream, time_out=None, host=None):
+        """
+        Hand out the items of a streamed response as they arrive. Stopping
+        early cancels the stream, which closes the generator on the remote peer.
+
+        :param stream: ``ResponseStream``
+        :param time_out: seconds to wait for each item
+        :param host: host of the remote peer
+        :return: generator
+        """
         try:
-            # send request
-            sock.sendall(payload)
+            while True:
+                frame = stream.get(time_out)
+                item = codecs.accept(frame.codec, host).decode(frame.body)
+                item = buffers.restore(item, frame.buffers)
+
+                # the last message carries the error that stopped the stream
+                if frame.type != protocol.STREAM:
+                    net.Peer().process_error(item)
+                    return
 
-            # sock
-            raw = sock.recv(1024)
+                yield item
+        finally:
+            stream.close()
+
+    @staticmethod
+    def legacy_request(host, port, connection, args, kwargs, time_out=None):
+        """
+        Request an action and response from a peer running an older version of
+        net that expects a single unframed ascii json request per connection.
 
-            # safely close the socket
-            sock.close()
+        :param host: target host ipv4 format
+        :param port: target port int
+        :param connection: the target connection id to run
+        :param args: positional arguments to pass to the target connection
+        :param kwargs: keyword arguments to pass to the target connection
+        :param time_out: socket time out in seconds
+        :return: response from peer
+        """
+        # streamed arguments are sent in full
+        args, kwargs = streams.materialize(args, kwargs)
+        data = {'connection': connection, 'args': args, 'kwargs': kwargs}
 
-        except Exception as err:
-            # safely close the socket
-            sock.close()
+        sock = POOL.connect(host, port, time_out)
 
-            # handle error logging
-            net.LOGGER.error(traceback.format_exc())
-            raise err
+        try:
+            sock.sendall(codecs.LEGACY.encode(data))
+            raw = protocol.recv_legacy(sock)
+        finally:
+            POOL.discard(sock)
 
-        response = raw.decode('ascii')
+        # flags are sent back as raw strings by older peers
         try:
-            return json.loads(response)
+            return codecs.LEGACY.decode(raw)
         except Exception:
-            return response
+            return raw.decode('ascii')
 
     def protected_request(self, host, port, connection, args, kwargs, stale):
         """
@@ -223,8 +445,8 @@ class PeerServer(socketserver.ThreadingMixIn, socketserver.TCPServer, object):
         :param host: target host ipv4 format
         :param port: target port int
         :param connection: the target connection id to run
-        :param args: positional arguments to pass to the target connection (must be json compatible)
-        :param kwargs: keyword arguments to pass to the target connection (must be json compatible)
+        :param args: positional arguments to pass to the target connection (must be compatible with the codec)
+        :param kwargs: keyword arguments to pass to the target connection (must be compatible with the codec)
         :param stale: share resource for detecting old peers
         :return: response from peer
         """
@@ -0,0 +1,463 @@
+# -*- coding: utf-8 -*-
+"""
+Shared Memory Module
+--------------------
+
+Contains the shared memory transport used between peers on the same host.
+
+A connection to a peer on the local host can be moved onto a pair of shared
+memory ring buffers, one per direction, so message bodies are copied straight
+into the other peers memory instead of going through the kernel network path.
+The socket stays open and only carries a single byte after every write to wake
+up the reading side.
+
+.. code-block:: text
+
+    +------+------+----------+--------+---------+----------------------+
+    | head | tail | capacity | closed | padding | data                 |
+    | Q    | Q    | Q        | B      |         | <capacity> bytes     |
+    +------+------+----------+--------+---------+----------------------+
+
+Each ring has exactly one writer and one reader. The writer only moves the
+head and the reader only moves the tail, so neither side takes a lock. Both
+counters only ever grow, the position in the data is the counter modulo the
+capacity.
+
+The requesting peer creates both rings and sends their names in a
+``SHARED_MEMORY`` frame. The remote peer attaches them and answers with a
+``SHARED_MEMORY`` frame, everything after that goes through the rings. Peers
+that can't attach them answer with an empty body and the connection carries on
+over the socket. Set ``NET_SHARED_MEMORY`` to the ring size in megabytes to use
+it, python 3.8 and newer only.
+"""
+
+__all__ = [
+    'Ring',
+    'RingSocket',
+    'supported',
+    'wanted',
+    'upgrade',
+    'accept',
+]
+
+# std imports
+import json
+import time
+import atexit
+import errno
+import socket
+import struct
+import weakref
+import threading
+
+# package imports
+import net
+from net.peer import local, protocol
+from net.peer.channel import LegacyPeerError
+
+# python 3.8 and newer
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+    shared_memory = None
+
+# ring header
+HEADER = struct.Struct('QQQB')
+OFFSET = 64
+
+# byte sent to wake up the reading side
+WAKE = b'\x00'
+
+# longest sleep while waiting on the reader to free up space
+MAX_BACKOFF = 0.005
+
+# peers that turned down shared memory
+DECLINED = set()
+
+# rings created by this peer, removed when the application exits
+RINGS = weakref.WeakValueDictionary()
+
+# threading
+LOCK = threading.Lock()
+
+
+class Ring(object):
+    """
+    Single producer, single consumer ring buffer in shared memory.
+    """
+
+    @classmethod
+    def create(cls, size):
+        """
+        Create a new ring.
+
+        :param size: capacity in bytes
+        :return: ``Ring``
+        """
+        memory = shared_memory.SharedMemory(create=True, size=size + OFFSET)
+        HEADER.pack_into(memory.buf, 0, 0, 0, size, 0)
+
+        ring = cls(memory, owner=True)
+        RINGS[ring.name] = ring
+        return ring
+
+    @classmethod
+    def attach(cls, name):
+        """
+        Attach a ring created by another peer.
+
+        :param name: shared memory name
+        :return: ``Ring``
+        """
+        try:
+            memory = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # The resource tracker would remove the memory when this peer exits
+            # even though it belongs to the peer that created it.
+            memory = shared_memory.SharedMemory(name=name)
+            if name not in RINGS:
+                resource_tracker.unregister(memory._name, 'shared_memory')
+
+        return cls(memory, owner=False)
+
+    def __init__(self, memory, owner):
+        self._memory = memory
+        self._owner = owner
+        self._buf = memory.buf
+        self._capacity = HEADER.unpack_from(self._buf, 0)[2]
+
+    @property
+    def name(self):
+        """
+        Name other processes attach the ring with.
+
+        :return: str
+        """
+        return self._memory.name
+
+    @property
+    def closed(self):
+        """
+        Whether either side closed the ring.
+
+        :return: bool
+        """
+        try:
+            return bool(HEADER.unpack_from(self._buf, 0)[3])
+        except (ValueError, TypeError):
+            return True
+
+    def write(self, data):
+        """
+        Copy as much of the data into the ring as there is space for.
+
+        :param data: memoryview of bytes
+        :return: number of bytes written
+        """
+        head, tail = struct.unpack_from('QQ', self._buf, 0)
+        size = min(self._capacity - (head - tail), len(data))
+        if not size:
+            return 0
+
+        start = head % self._capacity
+        first = min(size, self._capacity - start)
+        self._buf[OFFSET + start:OFFSET + start + first] = data[:first]
+        if size > first:
+            self._buf[OFFSET:OFFSET + size - first] = data[first:size]
+
+        # publish the data once it has been copied
+        struct.pack_into('Q', self._buf, 0, head + size)
+        return size
+
+    def read_into(self, view, size):
+        """
+        Copy as much of the data in the ring as fits.
+
+        :param view: memoryview of bytes to copy into
+        :param size: most bytes to copy
+        :return: number of bytes read
+        """
+        head, tail = struct.unpack_from('QQ', self._buf, 0)
+        size = min(head - tail, size, len(view))
+        if not size:
+            return 0
+
+        start = tail % self._capacity
+        first = min(size, self._capacity - start)
+        view[:first] = self._buf[OFFSET + start:OFFSET + start + first]
+        if size > first:
+            view[first:size] = self._buf[OFFSET:OFFSET + size - first]
+
+        # free up the space once it has been copied
+        struct.pack_into('Q', self._buf, 8, tail + size)
+        return size
+
+    def close(self):
+        """
+        Mark the ring closed and release it, the peer that created the ring
+        removes it.
+        """
+        try:
+            struct.pack_into('B', self._buf, 24, 1)
+        except (ValueError, TypeError):
+            return
+
+        self._buf = None
+        try:
+            self._memory.close()
+        except BufferError:
+            # a copy in another thread still holds the memory, it is released
+            # when that finishes.
+            pass
+
+        if self._owner:
+            try:
+                self._memory.unlink()
+            except OSError:
+                pass
+
+
+class RingSocket(object):
+    """
+    Socket-like wrapper that sends and receives through a pair of rings and
+    only uses the socket to wake up the reading side. Supports what the
+    channels and handlers need from a socket. Do not interact with directly.
+    """
+
+    def __init__(self, sock, send_ring, recv_ring):
+        self._sock = sock
+        self._send_ring = send_ring
+        self._recv_ring = recv_ring
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+    def _error(self):
+        return socket.error(errno.EPIPE, "Shared memory connection closed.")
+
+    def _write(self, view):
+        """
+        Write into the send ring, waiting for the reader when it is full.
+
+        :param view: memoryview of bytes
+        :return: None
+        """
+        backoff = 0.0001
+        while len(view):
+            try:
+                written = self._send_ring.write(view)
+            except (ValueError, TypeError):
+                raise self._error()
+
+            if written:
+                view = view[written:]
+                backoff = 0.0001
+                continue
+
+            # the reader needs waking up to make room
+            self._sock.sendall(WAKE)
+            if self._send_ring.closed:
+                raise self._error()
+
+            time.sleep(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF)
+
+    def sendall(self, data):
+        """
+        Send all the data.
+
+        :param data: bytes like
+        """
+        self._write(memoryview(data).cast('B'))
+        self._sock.sendall(WAKE)
+
+    def sendmsg(self, parts):
+        """
+        Send a list of buffers.
+
+        :param parts: list of bytes like
+        :return: number of bytes sent
+        """
+        sent = 0
+        for part in parts:
+            view = memoryview(part).cast('B')
+            self._write(view)
+            sent += len(view)
+
+        self._sock.sendall(WAKE)
+        return sent
+
+    def recv_into(self, view, size=0):
+        """
+        Read from the receive ring, blocking on the socket until data arrives
+        or the socket time out passes.
+
+        :param view: writable buffer
+        :param size: most bytes to read
+        :return: number of bytes read, 0 when the connection closed
+        """
+        view = memoryview(view).cast('B')
+        size = size or len(view)
+
+        while True:
+            try:
+                read = self._recv_ring.read_into(view, size)
+            except (ValueError, TypeError):
+                return 0
+
+            if read:
+                return read
+
+            if self._recv_ring.closed:
+                return 0
+
+            # wait for the writer, this honours the socket time out
+            if not self._sock.recv(protocol.CHUNK_SIZE):
+                try:
+                    return self._recv_ring.read_into(view, size)
+                except (ValueError, TypeError):
+                    return 0
+
+    def recv(self, size):
+        """
+        Read up to ``size`` bytes.
+
+        :param size: int
+        :return: bytes
+        """
+        buf = bytearray(size)
+        return bytes(buf[:self.recv_into(buf, size)])
+
+    def shutdown(self, how):
+        """
+        Close the rings and shut down the socket.
+
+        :param how: ``socket.SHUT_*``
+        """
+        self.close_rings()
+        self._sock.shutdown(how)
+
+    def close(self):
+        """
+        Close the rings and the socket.
+        """
+        self.close_rings()
+        self._sock.close()
+
+    def close_rings(self):
+        """
+        Close both rings.
+        """
+        self._send_ring.close()
+        self._recv_ring.close()
+
+
+@atexit.register
+def close_rings():
+    """
+    Remove the rings created by this peer that are still open.
+    """
+    for ring in list(RINGS.values()):
+        ring.close()
+
+
+def supported():
+    """
+    Whether shared memory is available.
+
+    :return: bool
+    """
+    return shared_memory is not None
+
+
+def wanted(host, port):
+    """
+    Whether new connections to a peer should be moved onto shared memory.
+
+    :param host: target host ipv4 format
+    :param port: target port int
+    :return: bool
+    """
+    return (
+        bool(net.SHARED_MEMORY) and supported() and local.is_local(host) and
+        (host, port) not in DECLINED
+    )
+
+
+def upgrade(sock, host, port, time_out=None):
+    """
+    Ask the peer on the other end of a new connection to move it onto shared
+    memory.
+
+    :param sock: socket
+    :param host: target host ipv4 format
+    :param port: target port int
+    :param time_out: seconds to wait for the answer
+    :return: ``RingSocket``, the socket if the peer declined or None if the
+     socket can't be used anymore
+    :raises: ``LegacyPeerError`` if the peer doesn't support framed messages
+    """
+    size = net.SHARED_MEMORY * 1024 * 1024
+    requests = Ring.create(size)
+    responses = Ring.create(size)
+
+    body = json.dumps({'requests': requests.name, 'responses': responses.name})
+
+    try:
+        sock.settimeout(time_out if time_out else net.POOL_IDLE)
+        protocol.send_message(sock, protocol.SHARED_MEMORY, body.encode('utf-8'))
+        frame = protocol.recv_message(sock)
+    except socket.error:
+        frame = None
+
+    if frame is not None and frame.type == protocol.SHARED_MEMORY and frame.body:
+        return RingSocket(sock, requests, responses)
+
+    requests.close()
+    responses.close()
+
+    if frame is not None and frame.type == protocol.LEGACY:
+        sock.close()
+        raise LegacyPeerError(
+            "Peer {0} does not support framed messages.".format((host, port))
+        )
+
+    with LOCK:
+        DECLINED.add((host, port))
+    net.LOGGER.debug("Peer {0} declined shared memory".format((host, port)))
+
+    # peers running an older version of net answer with an error or close
+    if frame is None or frame.type != protocol.SHARED_MEMORY:
+        try:
+            sock.close()
+        except socket.error:
+            pass
+        return None
+
+    return sock
+
+
+def accept(sock, frame):
+    """
+    Answer a request to move a connection onto shared memory.
+
+    :param sock: socket
+    :param frame: ``SHARED_MEMORY`` ``Frame``
+    :return: ``RingSocket`` or None if it was declined
+    """
+    ring_socket = None
+
+    if supported():
+        try:
+            names = json.loads(bytes(frame.body).decode('utf-8'))
+            requests = Ring.attach(names['requests'])
+            responses = Ring.attach(names['responses'])
+            ring_socket = RingSocket(sock, responses, requests)
+        except Exception as err:
+            net.LOGGER.debug("Could not attach shared memory: {0}".format(err))
+
+    protocol.send_message(
+        sock, protocol.SHARED_MEMORY, b'1' if ring_socket else b'', request_id=frame.id
+    )
+
+    return ring_socket
@@ -0,0 +1,503 @@
+# -*- coding: utf-8 -*-
+"""
+Streams Module
+--------------
+
+Contains the flow control used to stream responses from generator connections
+and streamed arguments to connections.
+
+A connection that returns a generator is answered with a ``STREAM`` message
+for every item it yields and a final ``RESPONSE`` once it is exhausted, or with
+the error that stopped it. The requesting peer hands the items out lazily as
+they arrive.
+
+The peer running the generator only gets ahead of the requesting peer by
+``net.STREAM_WINDOW`` items. The requesting peer hands out more credit with
+``CREDIT`` messages as it consumes items, and sends ``CANCEL`` when it stops
+iterating early, which closes the generator on the remote peer.
+
+Arguments work the same way in the other direction. An iterator or a file
+object passed to a connection is replaced by a placeholder and sent after the
+request as ``STREAM`` messages, in chunks for file objects. The remote peer
+hands it to the connection as an iterator or a binary file object and gives
+out credit as the connection reads it. Only one argument of a request can be
+streamed.
+"""
+
+__all__ = [
+    'StreamCredit',
+    'ResponseStream',
+    'Upload',
+    'ArgumentStream',
+    'ArgumentFile',
+    'ArgumentStreams',
+    'streamable',
+    'extract',
+    'attach',
+    'materialize',
+]
+
+# std imports
+import io
+import socket
+import struct
+import functools
+import threading
+from collections.abc import Iterator
+
+# compatibility
+import six
+from six.moves import queue
+
+# package imports
+import net
+from net.peer import buffers, codecs, protocol
+
+# placeholder key, dicts with this key are replaced by a streamed argument
+PLACEHOLDER = '__net_stream__'
+
+# bytes read from a file object per message
+CHUNK_SIZE = 64 * 1024
+
+
+class StreamCredit(object):
+    """
+    Number of items a streaming connection is allowed to send before it has to
+    wait for the requesting peer. Do not interact with directly, it is managed
+    by the ``PeerHandler``.
+    """
+
+    def __init__(self, window=None):
+        self._credit = window if window else net.STREAM_WINDOW
+        self._cancelled = False
+        self._condition = threading.Condition()
+
+    @property
+    def cancelled(self):
+        """
+        Whether the requesting peer stopped the stream.
+
+        :return: bool
+        """
+        return self._cancelled
+
+    def acquire(self):
+        """
+        Wait until another item can be sent.
+
+        :return: bool, False if the stream was cancelled
+        """
+        with self._condition:
+            while not self._credit and not self._cancelled:
+                self._condition.wait()
+
+            if self._cancelled:
+                return False
+
+            self._credit -= 1
+            return True
+
+    def grant(self, count):
+        """
+        Allow more items to be sent.
+
+        :param count: int
+        """
+        with self._condition:
+            self._credit += count
+            self._condition.notify()
+
+    def cancel(self):
+        """
+        Stop the stream.
+        """
+        with self._condition:
+            self._cancelled = True
+            self._condition.notify()
+
+
+class ResponseStream(object):
+    """
+    Frames of a streamed response as they arrive on a channel. Credit is handed
+    back to the peer as frames are taken. Do not interact with directly, it is
+    managed by the ``Channel``.
+    """
+
+    def __init__(self, channel, request_id, window=None):
+        self._channel = channel
+        self._id = request_id
+        self._window = window if window else net.STREAM_WINDOW
+        self._queue = queue.Queue()
+        self._taken = 0
+        self._finished = False
+
+    @property
+    def id(self):
+        """
+        Request id of the stream.
+
+        :return: int
+        """
+        return self._id
+
+    def put(self, frame):
+        """
+        Hand a frame, or the error that closed the channel, to the stream.
+
+        :param frame: ``Frame`` or exception
+        """
+        self._queue.put(frame)
+
+    def get(self, time_out=None):
+        """
+        Wait for the next frame.
+
+        :param time_out: seconds to wait
+        :return: ``Frame``, the stream is finished once a frame that isn't a
+         ``STREAM`` frame is returned
+        """
+        try:
+            frame = self._queue.get(timeout=time_out)
+        except queue.Empty:
+            raise socket.timeout("timed out")
+
+        if isinstance(frame, Exception):
+            self._finished = True
+            raise frame
+
+        if frame.type != protocol.STREAM:
+            self._finished = True
+            return frame
+
+        # hand back credit in batches to keep the number of messages down
+        self._taken += 1
+        if self._taken >= max(self._window // 2, 1):
+            self._channel.credit(self._id, self._taken)
+            self._taken = 0
+
+        return frame
+
+    def close(self):
+        """
+        Stop the stream, the remote peer closes the generator if it is still
+        running.
+        """
+        if not self._finished:
+            self._finished = True
+            self._channel.cancel(self._id)
+
+
+class Upload(object):
+    """
+    Iterator or file object being streamed to a remote peer as an argument. Do
+    not interact with directly, it is managed by the ``Channel``.
+    """
+
+    def __init__(self, source):
+        self._source = source
+        self._started = False
+
+    @property
+    def kind(self):
+        """
+        How the remote peer hands the argument to the connection.
+
+        :return: 'file' or 'iterator'
+        """
+        return 'file' if hasattr(self._source, 'read') else 'iterator'
+
+    @property
+    def started(self):
+        """
+        Whether anything was taken from the source. A started upload can't be
+        sent again.
+
+        :return: bool
+        """
+        return self._started
+
+    def chunks(self):
+        """
+        Items to send, file objects are read in chunks of ``CHUNK_SIZE``.
+
+        :return: generator
+        """
+        self._started = True
+
+        if self.kind == 'iterator':
+            for item in self._source:
+                yield item
+            return
+
+        while True:
+            chunk = self._source.read(CHUNK_SIZE)
+            if not chunk:
+                return
+
+            # text files are sent as utf-8
+            if isinstance(chunk, six.text_type):
+                chunk = chunk.encode('utf-8')
+
+            yield chunk
+
+    def materialize(self):
+        """
+        Read the whole source, for peers that can't take a streamed argument.
+
+        :return: bytes or list
+        """
+        if self.kind == 'iterator':
+            return list(self.chunks())
+        return b''.join(self.chunks())
+
+
+class ArgumentStream(object):
+    """
+    Iterator over a streamed argument as it arrives from the requesting peer.
+    Credit is handed back as items are taken. Do not interact with directly,
+    it is managed by ``ArgumentStreams``.
+    """
+
+    def __init__(self, send, window=None):
+        self._send = send
+        self._window = window if window else net.STREAM_WINDOW
+        self._queue = queue.Queue()
+        self._taken = 0
+        self._finished = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._finished:
+            raise StopIteration
+
+        frame = self._queue.get()
+
+        if isinstance(frame, Exception):
+            self._finished = True
+            raise frame
+
+        message = codecs.get_codec(frame.codec).decode(frame.body)
+        message = buffers.restore(message, frame.buffers)
+
+        if 'item' not in message:
+            self._finished = True
+
+            # the source raised on the requesting peer
+            if message.get('error'):
+                raise Exception("Streamed argument failed\n" + message['error'])
+
+            raise StopIteration
+
+        # hand back credit in batches to keep the number of messages down
+        self._taken += 1
+        if self._taken >= max(self._window // 2, 1):
+            self._send(protocol.CREDIT, struct.pack('!I', self._taken))
+            self._taken = 0
+
+        return message['item']
+
+    next = __next__
+
+    def put(self, frame):
+        """
+        Hand a frame, or the error that closed the connection, to the stream.
+
+        :param frame: ``Frame`` or exception
+        """
+        self._queue.put(frame)
+
+    def close(self):
+        """
+        Stop the stream, the requesting peer stops sending it.
+        """
+        if not self._finished:
+            self._finished = True
+            self._send(protocol.CANCEL, b'')
+
+
+class ArgumentFile(io.RawIOBase):
+    """
+    Binary file object over a streamed argument. Connections get it wrapped in
+    an ``io.BufferedReader``.
+    """
+
+    def __init__(self, stream):
+        super(ArgumentFile, self).__init__()
+        self._stream = stream
+        self._chunk = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        while not len(self._chunk):
+            try:
+                self._chunk = memoryview(next(self._stream))
+            except StopIteration:
+                return 0
+
+        size = min(len(buf), len(self._chunk))
+        buf[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+    def close(self):
+        self._stream.close()
+        super(ArgumentFile, self).close()
+
+
+class ArgumentStreams(object):
+    """
+    Streamed arguments of the requests in flight on an incoming connection.
+    Frames can arrive before the request is run, so a stream is created by
+    whichever comes first. Do not interact with directly, it is managed by
+    the server engines.
+    """
+
+    def __init__(self, send):
+        self._send = send
+        self._streams = {}
+        self._requests = set()
+        self._lock = threading.Lock()
+
+    def __contains__(self, request_id):
+        return request_id in self._streams
+
+    def start(self, request_id):
+        """
+        Accept streamed arguments for a request.
+
+        :param request_id: int
+        """
+        with self._lock:
+            self._requests.add(request_id)
+
+    def get(self, request_id):
+        """
+        Get the streamed argument of a request.
+
+        :param request_id: int
+        :return: ``ArgumentStream`` or None if the request is finished
+        """
+        with self._lock:
+            stream = self._streams.get(request_id)
+            if stream is None and request_id in self._requests:
+                stream = ArgumentStream(functools.partial(self._send, request_id))
+                self._streams[request_id] = stream
+            return stream
+
+    def finish(self, request_id):
+        """
+        Drop the streamed argument of a finished request, the requesting peer
+        is told to stop sending whatever wasn't read.
+
+        :param request_id: int
+        """
+        with self._lock:
+            self._requests.discard(request_id)
+            stream = self._streams.pop(request_id, None)
+
+        if stream is not None:
+            stream.close()
+
+    def close(self, err):
+        """
+        Fail every streamed argument, the connection closed.
+
+        :param err: exception
+        """
+        with self._lock:
+            streams = list(self._streams.values())
+            self._streams = {}
+            self._requests = set()
+
+        for stream in streams:
+            stream.put(err)
+
+
+def streamable(item):
+    """
+    Whether an argument is sent as a stream.
+
+    :param item: Anything
+    :return: bool
+    """
+    if isinstance(item, tuple(buffers.BUFFER_TYPES) + six.string_types):
+        return False
+    return hasattr(item, 'read') or isinstance(item, Iterator)
+
+
+def extract(args, kwargs):
+    """
+    Pull the streamed argument out of the arguments of a request and replace
+    it with a placeholder.
+
+    :param args: positional arguments
+    :param kwargs: keyword arguments
+    :return: (args, kwargs, ``Upload`` or None)
+    :raises: ``ValueError`` if more than one argument is streamed
+    """
+    uploads = []
+
+    def walk(item):
+        if not streamable(item):
+            return item
+
+        if uploads:
+            raise ValueError("Only one argument of a request can be streamed.")
+
+        uploads.append(Upload(item))
+        return {PLACEHOLDER: uploads[0].kind}
+
+    args = [walk(value) for value in args]
+    kwargs = dict((key, walk(value)) for key, value in kwargs.items())
+
+    return args, kwargs, uploads[0] if uploads else None
+
+
+def attach(args, kwargs, incoming):
+    """
+    Replace the placeholder of a streamed argument with the stream.
+
+    :param args: positional arguments
+    :param kwargs: keyword arguments
+    :param incoming: function returning the ``ArgumentStream`` of the request,
+     None if streamed arguments can't be received
+    :return: (args, kwargs)
+    """
+    def walk(item):
+        if not isinstance(item, dict) or PLACEHOLDER not in item:
+            return item
+
+        if incoming is None:
+            raise ValueError("Streamed arguments can't be received here.")
+
+        stream = incoming()
+        if item[PLACEHOLDER] == 'file':
+            return io.BufferedReader(ArgumentFile(stream), CHUNK_SIZE)
+        return stream
+
+    args = [walk(value) for value in args]
+    kwargs = dict((key, walk(value)) for key, value in kwargs.items())
+
+    return args, kwargs
+
+
+def materialize(args, kwargs):
+    """
+    Read every streamable argument in full, for peers that can't take a
+    streamed argument.
+
+    :param args: positional arguments
+    :param kwargs: keyword arguments
+    :return: (args, kwargs)
+    """
+    def walk(item):
+        return Upload(item).materialize() if streamable(item) else item
+
+    args = [walk(value) for value in args]
+    kwargs = dict((key, walk(value)) for key, value in kwargs.items())
+
+    return args, kwargs
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+Worker Pool Module
+------------------
+
+Contains the bounded worker pool that runs incoming requests, and the limit on
+the incoming connections served at the same time.
+"""
+
+__all__ = [
+    'WorkerPool',
+    'ConnectionLimit',
+    'LimitedThreadingMixIn',
+]
+
+# std imports
+import time
+import socket
+import threading
+import socketserver
+from concurrent import futures
+
+# compatibility
+from six.moves import queue
+
+# package imports
+import net
+from net.peer import codecs, protocol
+
+
+class WorkerPool(object):
+    """
+    A fixed number of worker threads fed from a bounded queue. When the queue is
+    full new work is rejected straight away instead of piling up, the server
+    answers those requests with the ``BUSY`` flag so the requesting peer can
+    back off. Do not interact with directly, it is managed by the
+    ``PeerServer``.
+    """
+
+    # weight of the latest sample in the recent wait time
+    SMOOTHING = 0.2
+
+    def __init__(self, size=None, queue_size=None, name="Network_Server_Worker"):
+        self._size = size if size else net.WORKER_LIMIT
+        self._queue = queue.Queue(maxsize=queue_size if queue_size else net.QUEUE_LIMIT)
+        self._lock = threading.Lock()
+
+        # metrics
+        self._busy = 0
+        self._completed = 0
+        self._rejected = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+
+        self._threads = []
+        for index in range(self._size):
+            thread = threading.Thread(target=self._work)
+            thread.name = "{0}_{1}".format(name, index)
+            thread.daemon = True
+            self._threads.append(thread)
+            thread.start()
+
+    @property
+    def size(self):
+        """
+        Number of worker threads.
+
+        :return: int
+        """
+        return self._size
+
+    @property
+    def depth(self):
+        """
+        Number of requests waiting for a worker.
+
+        :return: int
+        """
+        return self._queue.qsize()
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Queue work for the pool.
+
+        :param func: function to run
+        :param args: positional arguments
+        :param kwargs: keyword arguments
+        :return: ``concurrent.futures.Future`` or None if the queue is full
+        """
+        future = futures.Future()
+
+        try:
+            self._queue.put_nowait((time.time(), future, func, args, kwargs))
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            return None
+
+        return future
+
+    def _work(self):
+        """
+        Worker thread, runs queued work until the process exits.
+        """
+        while True:
+            queued, future, func, args, kwargs = self._queue.get()
+
+            wait = time.time() - queued
+            with self._lock:
+                self._busy += 1
+                self._wait_time += (wait - self._wait_time) * self.SMOOTHING
+                self._max_wait_time = max(self._max_wait_time, wait)
+
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(func(*args, **kwargs))
+                    except BaseException as err:
+                        future.set_exception(err)
+            finally:
+                with self._lock:
+                    self._busy -= 1
+                    self._completed += 1
+
+    def stats(self):
+        """
+        Get the pool metrics.
+
+        :return: {
+            'workers': int,
+            'busy': int,
+            'queued': int,
+            'queue_limit': int,
+            'completed': int,
+            'rejected': int,
+            'wait_time': float recent average seconds spent queued,
+            'max_wait_time': float,
+        }
+        """
+        with self._lock:
+            return {
+                'workers': self._size,
+                'busy': self._busy,
+                'queued': self._queue.qsize(),
+                'queue_limit': self._queue.maxsize,
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'wait_time': self._wait_time,
+                'max_wait_time': self._max_wait_time,
+            }
+
+
+class ConnectionLimit(object):
+    """
+    Counts the incoming connections a server keeps a thread open for. Do not
+    interact with directly, it is managed by the ``PeerServer``.
+
+    :param limit: connections served at the same time, 0 is unbounded
+    """
+
+    def __init__(self, limit=None):
+        self._limit = net.CONNECTION_LIMIT if limit is None else limit
+        self._lock = threading.Lock()
+
+        # metrics
+        self._open = 0
+        self._refused = 0
+
+    def acquire(self):
+        """
+        Ask to serve another connection.
+
+        :return: bool, False if the limit is reached
+        """
+        with self._lock:
+            if self._limit and self._open >= self._limit:
+                self._refused += 1
+                return False
+
+            self._open += 1
+            return True
+
+    def release(self):
+        """
+        A served connection closed.
+        """
+        with self._lock:
+            self._open -= 1
+
+    def stats(self):
+        """
+        Get the connection metrics.
+
+        :return: {
+            'open': int connections being served,
+            'limit': int,
+            'refused': int connections answered with the BUSY flag,
+        }
+        """
+        with self._lock:
+            return {
+                'open': self._open,
+                'limit': self._limit,
+                'refused': self._refused,
+            }
+
+
+class LimitedThreadingMixIn(socketserver.ThreadingMixIn):
+    """
+    Starts a thread per incoming connection up to the ``ConnectionLimit`` of
+    the server. Connections past the limit are answered with the ``BUSY`` flag
+    under request id 0, which the requesting peer hands to every request sent
+    over the connection, and closed without starting a thread.
+    """
+
+    def process_request(self, request, client_address):
+        if not self.connections.acquire():
+            self.turn_away(request)
+            self.shutdown_request(request)
+            return
+
+        try:
+            socketserver.ThreadingMixIn.process_request(self, request, client_address)
+        except Exception:
+            self.connections.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            socketserver.ThreadingMixIn.process_request_thread(self, request, client_address)
+        finally:
+            self.connections.release()
+
+    @staticmethod
+    def turn_away(request):
+        """
+        Answer a connection with the ``BUSY`` flag without reading from it.
+
+        :param request: socket
+        """
+        codec = codecs.get_codec(codecs.JsonCodec.id)
+
+        try:
+            request.settimeout(net.CONNECT_TIME_OUT or None)
+            protocol.send_message(
+                request, protocol.RESPONSE, codec.encode(net.Peer().get_flag('BUSY')), codec.id, 0
+            )
+        except socket.error:
+            pass
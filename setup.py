@@ -12,7 +12,7 @@ with open('README.md') as readme_file:
     readme = readme_file.read()
 
 requirements = [
-    'six'
+    'six',
 ]
 setup_requirements = [
     'pytest-runner',
@@ -33,13 +33,13 @@ setup(
         'Intended Audience :: Developers',
         'License :: OSI Approved :: MIT License',
         'Natural Language :: English',
-        "Programming Language :: Python :: 2",
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3 :: Only',
         'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
     ],
     description="Python program communication interface",
     entry_points={
@@ -54,6 +54,7 @@ setup(
     include_package_data=True,
     keywords='app-net',
     name='app-net',
+    python_requires='>=3.7',
     packages=find_packages(include=['net', 'net.connections', 'net.defaults', 'net.peer']),
     setup_requires=setup_requirements,
     test_suite='tests',
@@ -5,7 +5,12 @@ from __future__ import print_function
 """Tests for `net` package."""
 
 # std imports
+import os
+import json
+import time
+import socket
 import functools
+import threading
 import traceback
 
 # testing
@@ -115,6 +120,30 @@ def test_subscriptions(peers):
 
     my_event(test_message)
 
+    # an address nothing listens on
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind((master.host, 0))
+    dead = (master.host, sock.getsockname()[1])
+    sock.close()
+
+    # subscribers registering while the event is delivered are kept when
+    # the stale ones are pruned
+    @net.connect()
+    def late_subscriber(*args, **kwargs):
+        master.register_subscriber('late_event', slave.host, slave.port, 'late')
+
+    try:
+        master.register_subscriber('prune_event', dead[0], dead[1], 'net.defaults.handlers.pass_through')
+        master.register_subscriber('prune_event', master.host, master.port, late_subscriber.connection)
+        master.trigger_event('prune_event', 'a')
+
+        assert dead not in master.registered_subscriptions['prune_event']
+        assert (master.host, master.port) in master.registered_subscriptions['prune_event']
+        assert master.registered_subscriptions['late_event'] == {(slave.host, slave.port): ['late']}
+    finally:
+        master.registered_subscriptions.pop('prune_event', None)
+        master.registered_subscriptions.pop('late_event', None)
+
 
 def test_peer_handle(peers):
     """
@@ -148,3 +177,1674 @@ def test_api():
     net.peers(groups=['group1'], refresh=True)
     net.peers(on_host=True, refresh=True)
     net.peer_group()
+
+
+def test_connection_pool(peers):
+    """
+    Test that consecutive requests reuse a pooled connection.
+    """
+    net.LOGGER.debug("Test Header")
+
+    master, slave = peers
+
+    pool = master.server.pool
+    slave.pass_through("warm up")
+
+    hits = pool.stats()['hits']
+    for i in range(10):
+        assert slave.pass_through(i) == i
+
+    assert pool.stats()['hits'] >= hits + 10
+    assert pool.stats()['idle'] >= 1
+
+    # evicted connections are replaced transparently
+    pool.clear()
+    assert slave.pass_through("fresh") == "fresh"
+
+
+def test_pooled_retries(peers):
+    """
+    Test that a request is only sent again if the pooled channel failed before sending it.
+    """
+    net.LOGGER.debug("Test Header")
+
+    from net.peer import breakers, codecs, protocol
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind((net.HOST_IP, 0))
+    server.listen(5)
+    address = server.getsockname()
+    received = []
+
+    def serve():
+        json_codec = codecs.get_codec(codecs.JsonCodec.id)
+        while True:
+            try:
+                connection, _ = server.accept()
+            except socket.error:
+                return
+
+            while True:
+                frame = protocol.recv_message(connection)
+                if frame is None:
+                    break
+                received.append(frame.id)
+
+                # the connection drops after running the second request
+                if len(received) > 1:
+                    break
+
+                protocol.send_message(
+                    connection, protocol.RESPONSE, json_codec.encode('ok'), json_codec.id, frame.id
+                )
+            connection.close()
+
+    thread = threading.Thread(target=serve)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        assert net.pass_through('a', peer=address) == 'ok'
+
+        # the second request reused the channel and was sent, it is not sent again
+        with pytest.raises(socket.error):
+            net.pass_through('b', peer=address)
+        assert len(received) == 2
+
+        # same for awaitable calls
+        import asyncio
+        del received[:]
+
+        async def run():
+            assert await net.pass_through.async_call('c', peer=address) == 'ok'
+            with pytest.raises(socket.error):
+                await net.pass_through.async_call('d', peer=address)
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(run())
+        finally:
+            loop.close()
+        assert len(received) == 2
+
+    finally:
+        server.close()
+        breakers.reset(*address)
+
+
+def test_large_payloads(peers):
+    """
+    Test that payloads larger than a single recv make it across intact.
+    """
+    net.LOGGER.debug("Test Header")
+
+    master, slave = peers
+
+    payload = "x" * (1024 * 1024)
+    assert slave.pass_through(payload) == payload
+
+    payload = {"key{0}".format(i): list(range(10)) for i in range(2000)}
+    assert slave.pass_through(payload) == payload
+
+
+def test_legacy_peers(peers):
+    """
+    Test talking to and from peers that don't understand framing.
+    """
+    net.LOGGER.debug("Test Header")
+
+    master, slave = peers
+
+    # legacy client talking to a framed server
+    sock = socket.create_connection((master.host, master.port))
+    request = {'connection': 'net.defaults.handlers.pass_through', 'args': ['old'], 'kwargs': {}}
+    sock.sendall(json.dumps(request).encode('ascii'))
+    raw = b''
+    while True:
+        chunk = sock.recv(1024)
+        if not chunk:
+            break
+        raw += chunk
+    sock.close()
+    assert json.loads(raw.decode('ascii')) == 'old'
+
+    # legacy requests share the bounded worker pool with every other request
+    from net.peer.workers import WorkerPool
+
+    release = threading.Event()
+    workers = WorkerPool(size=1, queue_size=1)
+    workers.submit(release.wait, 5)
+    while not workers.stats()['busy']:
+        time.sleep(0.01)
+    workers.submit(release.wait, 5)
+
+    engines = [master.server] + ([master.server._runner] if master.server._runner else [])
+    original = master.server._workers
+    for engine in engines:
+        engine._workers = workers
+    try:
+        sock = socket.create_connection((master.host, master.port))
+        sock.sendall(json.dumps(request).encode('ascii'))
+        raw = b''
+        while True:
+            chunk = sock.recv(1024)
+            if not chunk:
+                break
+            raw += chunk
+        sock.close()
+        assert json.loads(raw.decode('ascii')) == 'BUSY'
+    finally:
+        for engine in engines:
+            engine._workers = original
+        release.set()
+
+    # framed client talking to a legacy server
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind((net.HOST_IP, 0))
+    server.listen(5)
+    address = server.getsockname()
+
+    def legacy_server():
+        for _ in range(2):
+            connection, _ = server.accept()
+            raw = connection.recv(1024)
+            try:
+                response = json.loads(raw.decode('ascii'))['args'][0]
+            except Exception:
+                response = {'payload': 'error', 'traceback': 'legacy'}
+            connection.sendall(json.dumps(response).encode('ascii'))
+            connection.close()
+
+    thread = threading.Thread(target=legacy_server)
+    thread.daemon = True
+    thread.start()
+
+    assert net.pass_through('new', peer=address) == 'new'
+    thread.join(5)
+    server.close()
+
+    # frames of other protocol versions are refused instead of misread
+    from net.peer import protocol
+
+    body = json.dumps(request).encode('ascii')
+    header = protocol.HEADER.pack(
+        protocol.MAGIC, protocol.VERSION - 1, protocol.REQUEST, 1, 1, 0, len(body)
+    )
+    with pytest.raises(protocol.ProtocolError):
+        protocol.unpack_header(header)
+
+    sock = socket.create_connection((master.host, master.port))
+    sock.settimeout(5)
+    sock.sendall(header + body)
+    assert sock.recv(1024) == b''
+    sock.close()
+
+
+def test_codecs(peers):
+    """
+    Test codec negotiation between peers.
+    """
+    net.LOGGER.debug("Test Header")
+
+    master, slave = peers
+
+    from net.peer import codecs
+
+    # non-ascii data is sent as is
+    assert slave.pass_through(u"héllo ☃") == u"héllo ☃"
+
+    info = net.info(peer=(slave.host, slave.port))
+    assert info['codecs'][-1] == 'json'
+
+    # pickle is only available to trusted groups
+    assert 'pickle' not in codecs.available_codecs()
+
+    net.TRUSTED_GROUPS.append(master.group)
+    try:
+        if 'pickle' not in codecs.available_codecs():
+            pytest.skip("pickle protocol 5 is not available.")
+
+        remote = net.Peer(
+            host=slave.host,
+            port=slave.port,
+            codecs=codecs.available_codecs(),
+            connections=info['connections'],
+        )
+        assert codecs.negotiate(slave.host, slave.port).name == 'pickle'
+
+        # tuples survive a pickled round trip
+        assert remote.pass_through((1, 2)) == (1, 2)
+
+    finally:
+        net.TRUSTED_GROUPS.remove(master.group)
+        codecs.register_peer_codecs(slave.host, slave.port, ['json'])
+
+
+def test_untrusted_codecs(peers):
+    """
+    Test that pickled requests are only decoded when they come from a trusted peer.
+    """
+    net.LOGGER.debug("Test Header")
+
+    import pickle
+    from net.peer import codecs, protocol
+
+    master, slave = peers
+
+    if pickle.HIGHEST_PROTOCOL < 5:
+        pytest.skip("pickle protocol 5 is not available.")
+
+    class Exploit(object):
+        def __reduce__(self):
+            return exec, ("import net; net.EXPLOITED = True",)
+
+    def send(payload):
+        sock = socket.create_connection((slave.host, slave.port))
+        try:
+            protocol.send_message(
+                sock, protocol.REQUEST, pickle.dumps(payload, protocol=5),
+                codecs.PickleCodec.id, 1
+            )
+            frame = protocol.recv_message(sock)
+        finally:
+            sock.close()
+        return codecs.get_codec(frame.codec).decode(frame.body)
+
+    saved = dict(codecs.PEER_CODECS)
+    codecs.PEER_CODECS.clear()
+    net.TRUSTED_GROUPS.append(master.group)
+    try:
+        # pickle is enabled locally but no trusted peer negotiated it
+        assert send(Exploit()) == 'REFUSED'
+        assert not getattr(net, 'EXPLOITED', False)
+
+        # a trusted peer that negotiated pickle is answered in pickle
+        codecs.register_peer_codecs(slave.host, slave.port, ['pickle', 'json'], master.group)
+        request = {
+            'connection': 'net.defaults.handlers.pass_through', 'args': [(1, 2)], 'kwargs': {}
+        }
+        assert send(request) == (1, 2)
+
+    finally:
+        net.TRUSTED_GROUPS.remove(master.group)
+        codecs.PEER_CODECS.clear()
+        codecs.PEER_CODECS.update(saved)
+        codecs.register_peer_codecs(slave.host, slave.port, ['json'])
+
+
+def test_multiplexing(peers):
+    """
+    Test that concurrent requests share a channel and are answered out of order.
+    """
+    net.LOGGER.debug("Test Header")
+
+    master, slave = peers
+
+    @net.connect()
+    def slow_echo(value, delay, **kwargs):
+        time.sleep(delay)
+        return value
+
+    pool = master.server.pool
+    pool.clear()
+
+    finished = []
+
+    def call(value, delay):
+        slow_echo(value, delay, peer=(slave.host, slave.port))
+        finished.append(value)
+
+    slow = threading.Thread(target=call, args=('slow', 0.5))
+    slow.start()
+    time.sleep(0.1)
+
+    # the fast request is not held up behind the slow one
+    call('fast', 0)
+    assert finished == ['fast']
+
+    slow.join()
+    assert finished == ['fast', 'slow']
+
+    # many threads share a small number of connections
+    threads = [threading.Thread(target=call, args=(i, 0.05)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(finished) == 22
+    assert pool.stats()['open'] <= pool.size
+
+
+def test_out_of_band_buffers(peers):
+    """
+    Test that binary data is sent out-of-band and received as a memoryview.
+    """
+    net.LOGGER.debug("Test Header")
+
+    master, slave = peers
+
+    @net.connect()
+    def describe_buffer(data, **kwargs):
+        return {'type': type(data).__name__, 'size': data.nbytes, 'data': data}
+
+    remote = (slave.host, slave.port)
+
+    payload = b"\x00\x01binary\xff" * 1024
+    response = describe_buffer(payload, peer=remote)
+    assert response['type'] == 'memoryview'
+    assert response['size'] == len(payload)
+    assert isinstance(response['data'], memoryview)
+    assert response['data'].tobytes() == payload
+
+    # buffers nested in containers
+    response = net.pass_through({'a': [bytearray(b"abc"), b"def"]}, peer=remote)
+    assert bytes(response['a'][0]) == b"abc"
+    assert bytes(response['a'][1]) == b"def"
+
+    # typed buffers keep their format
+    import array
+    values = array.array('d', [1.5, 2.5, 3.5])
+    response = net.pass_through(values, peer=remote)
+    assert response.format == 'd'
+    assert response.tolist() == [1.5, 2.5, 3.5]
+
+
+def test_asyncio_engine(peers):
+    """
+    Test serving requests from the asyncio engine.
+    """
+    net.LOGGER.debug("Test Header")
+
+    master, slave = peers
+
+    server = net.PeerServer(test=True, engine='asyncio')
+    assert server.engine == 'asyncio'
+    remote = (server.host, server.port)
+
+    @net.connect()
+    async def async_echo(value, **kwargs):
+        import asyncio
+        await asyncio.sleep(0.01)
+        return value
+
+    assert net.pass_through("sync", peer=remote) == "sync"
+    assert net.pass_through(b"bytes", peer=remote).tobytes() == b"bytes"
+    assert async_echo("async", peer=remote) == "async"
+
+    # async connections also run on the threading engine
+    assert async_echo("async", peer=(slave.host, slave.port)) == "async"
+
+    try:
+        master.execute(remote, 'missing_connection', (), {})
+        pytest.fail('Invalid connection is not being handled correctly.')
+    except Exception:
+        assert "Peer does not have the connection you are requesting" in traceback.format_exc()
+
+    with pytest.raises(ValueError):
+        net.PeerServer(test=True, engine='invalid')
+
+
+def test_async_client(peers):
+    """
+    Test awaitable remote calls.
+    """
+    net.LOGGER.debug("Test Header")
+
+    import asyncio
+
+    master, slave = peers
+    remote = (slave.host, slave.port)
+
+    @net.connect()
+    def async_failure(*args, **kwargs):
+        raise ValueError("remote failure")
+
+    async def run():
+        # fan out many concurrent calls over a single channel
+        results = await asyncio.gather(*[
+            net.pass_through.async_call(i, peer=remote) for i in range(100)
+        ])
+        assert results == list(range(100))
+
+        # flags are processed the same way as blocking calls
+        assert await net.null.async_call(peer=remote) == "NULL"
+        assert await master.execute_async(remote, net.pass_through.connection, ("value",), {}) == "value"
+
+        # local calls
+        assert await net.pass_through.async_call("local") == "local"
+
+        # remote errors are raised locally
+        try:
+            await async_failure.async_call(peer=remote)
+            pytest.fail("Remote error was not raised.")
+        except Exception:
+            assert "remote failure" in traceback.format_exc()
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+
+def test_worker_backpressure(peers):
+    """
+    Test that a server with a full queue answers with the BUSY flag.
+    """
+    net.LOGGER.debug("Test Header")
+
+    from net.peer.workers import WorkerPool
+
+    master, slave = peers
+
+    @net.connect()
+    def blocking_echo(value, **kwargs):
+        release.wait(5)
+        return value
+
+    release = threading.Event()
+
+    server = net.PeerServer(test=True)
+    server._workers = WorkerPool(size=1, queue_size=1)
+    remote = (server.host, server.port)
+
+    results = []
+
+    def call(value):
+        try:
+            results.append(blocking_echo(value, peer=remote))
+        except net.PeerBusy:
+            results.append('busy')
+
+    # one request running, one queued
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.1)
+
+    # the queue is full, this one is rejected straight away
+    call(2)
+    assert results == ['busy']
+
+    stats = server.workers.stats()
+    assert stats['busy'] == 1
+    assert stats['queued'] == 1
+    assert stats['rejected'] == 1
+
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(results[1:]) == [0, 1]
+
+    # the workers count the request as completed after the response is sent
+    for _ in range(50):
+        if server.workers.stats()['completed'] == 2:
+            break
+        time.sleep(0.01)
+    assert server.workers.stats()['completed'] == 2
+
+
+def test_connection_limit(peers):
+    """
+    Test that connections past the limit are answered with the BUSY flag.
+    """
+    net.LOGGER.debug("Test Header")
+
+    from net.peer import breakers, protocol
+
+    master, slave = peers
+
+    if slave.server.engine != 'threading':
+        pytest.skip("Only the threading engine starts a thread per connection.")
+
+    remote = (slave.host, slave.port)
+    limit = slave.server.connections
+    saved = limit.stats()['limit']
+
+    def settle(check):
+        for _ in range(100):
+            if check(limit.stats()):
+                return
+            time.sleep(0.01)
+
+    # start from the connections still open to the slave
+    master.server.pool.clear()
+    time.sleep(0.1)
+    opened = limit.stats()['open']
+    refused = limit.stats()['refused']
+
+    sockets = []
+    try:
+        # two more connections than the limit allows
+        limit._limit = opened + 2
+        for _ in range(4):
+            sockets.append(socket.create_connection(remote))
+        settle(lambda stats: stats['refused'] == refused + 2)
+
+        stats = limit.stats()
+        assert stats['open'] == opened + 2
+        assert stats['refused'] == refused + 2
+
+        # the connections past the limit are answered and closed right away
+        for sock in sockets[2:]:
+            frame = protocol.recv_message(sock)
+            assert frame.id == 0
+            assert json.loads(bytes(frame.body).decode('utf-8')) == 'BUSY'
+            assert protocol.recv_message(sock) is None
+
+        # requesting peers back off without tripping the breaker
+        with pytest.raises(net.PeerBusy):
+            net.pass_through('a', peer=remote)
+        assert breakers.breaker(*remote).state == breakers.CLOSED
+
+    finally:
+        for sock in sockets:
+            sock.close()
+        limit._limit = saved
+
+    # closed connections free their thread
+    settle(lambda stats: stats['open'] <= opened)
+    assert limit.stats()['open'] <= opened
+    assert net.pass_through('a', peer=remote) == 'a'
+
+
+def worker_flag():
+    return (
+        net.PROCESS_WORKER and net.PeerServer().port is None and
+        'NET_PROCESS_WORKER' not in os.environ
+    )
+
+
+# spawned worker processes import the connections they run
+@net.connect(executor='test_pool')
+def worker_pid(value, **kwargs):
+    return os.getpid(), bytes(value)
+
+
+def test_one_sided_trust(peers):
+    """
+    Test that a request refused in a restricted codec is sent again in json when
+    only the requesting peer has found the other.
+    """
+    net.LOGGER.debug("Test Header")
+
+    import sys
+    import pickle
+    import subprocess
+    from net.peer import codecs
+
+    master, slave = peers
+
+    if pickle.HIGHEST_PROTOCOL < 5:
+        pytest.skip("pickle protocol 5 is not available.")
+
+    # a peer of the same trusted group in another process that never looks
+    # for this one
+    environment = dict(os.environ, NET_PORT='3040', NET_TRUSTED_GROUPS=master.group)
+    process = subprocess.Popen(
+        [
+            sys.executable, '-c',
+            'import sys, net; print(net.Peer().port); sys.stdout.flush(); sys.stdin.read()'
+        ],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env=environment, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+    )
+
+    net.TRUSTED_GROUPS.append(master.group)
+    try:
+        port = int(process.stdout.readline())
+        info = net.info(peer=(net.HOST_IP, port))
+        remote = net.Peer(
+            host=net.HOST_IP,
+            port=port,
+            group=info['group'],
+            codecs=info['codecs'],
+            connections=info['connections'],
+        )
+        assert codecs.negotiate(remote.host, remote.port).name == 'pickle'
+
+        # the other process refuses pickle, the call is answered in json
+        assert remote.pass_through((1, 2)) == [1, 2]
+        assert codecs.negotiate(remote.host, remote.port).name == 'json'
+        assert remote.pass_through((1, 2)) == [1, 2]
+
+        # finding the peer again tries the fastest codec again
+        codecs.register_peer_codecs(remote.host, remote.port, info['codecs'], info['group'])
+        assert codecs.negotiate(remote.host, remote.port).name == 'pickle'
+
+    finally:
+        net.TRUSTED_GROUPS.remove(master.group)
+        process.stdin.close()
+        process.wait()
+
+
+def test_process_executor(peers):
+    """
+    Test that connections can be run in a warm process pool.
+    """
+    net.LOGGER.debug("Test Header")
+
+    from net.peer import executors
+
+    master, slave = peers
+
+    pool = net.process_pool('test_pool', size=2)
+    try:
+        # every worker is started up front
+        assert len(pool._processes) == 2
+
+        remote = (slave.host, slave.port)
+        pid, value = worker_pid(memoryview(b'data'), peer=remote)
+        assert pid != os.getpid()
+        assert value == b'data'
+
+        # running locally doesn't go through the pool
+        assert worker_pid(b'data')[0] == os.getpid()
+
+        # the workers know they are workers without starting a server
+        assert pool.submit(worker_flag).result() is True
+    finally:
+        executors.POOLS.pop('test_pool').shutdown()
+
+
+def test_unix_sockets(peers):
+    """
+    Test that peers on the same host talk over unix domain sockets.
+    """
+    net.LOGGER.debug("Test Header")
+
+    from net.peer import local
+
+    master, slave = peers
+
+    @net.connect()
+    def echo(value, **kwargs):
+        return value
+
+    server = net.PeerServer(test=True)
+    remote = (server.host, server.port)
+
+    assert server.socket_path == local.socket_path(server.port)
+    assert os.path.exists(server.socket_path)
+    assert net.info(peer=remote)['socket'] == net.Peer().server.socket_path
+
+    assert echo('unix', peer=remote) == 'unix'
+    channel, reused = net.Peer().server.pool.acquire(*remote)
+    assert reused
+    assert channel._sock.family == socket.AF_UNIX
+
+    # peers on other hosts are reached over tcp
+    assert local.connect('10.255.255.1', server.port) is None
+
+
+def test_shared_memory(peers):
+    """
+    Test moving connections to peers on the same host onto shared memory.
+    """
+    net.LOGGER.debug("Test Header")
+
+    from net.peer import shared
+
+    master, slave = peers
+
+    server = net.PeerServer(test=True)
+    remote = (server.host, server.port)
+
+    size = net.SHARED_MEMORY
+    net.SHARED_MEMORY = 1
+    try:
+        # larger than the ring so it wraps around while the reader catches up
+        payload = os.urandom(3 * 1024 * 1024 + 7)
+        for _ in range(3):
+            assert net.pass_through(payload, peer=remote) == payload
+        assert net.pass_through('small', peer=remote) == 'small'
+
+        channel, reused = net.Peer().server.pool.acquire(*remote)
+        assert isinstance(channel._sock, shared.RingSocket)
+    finally:
+        net.SHARED_MEMORY = size
+        net.Peer().server.pool.clear()
+
+
+def test_batch(peers):
+    """
+    Test sending many calls to a peer in a single request.
+    """
+    net.LOGGER.debug("Test Header")
+
+    master, slave = peers
+
+    @net.connect()
+    def slow_double(value, **kwargs):
+        time.sleep(0.2)
+        return value * 2
+
+    @net.connect()
+    def broken(**kwargs):
+        raise ValueError("broken")
+
+    remote = (slave.host, slave.port)
+
+    with net.batch(remote) as calls:
+        double = calls.call(slow_double, 2)
+        error = calls.call(broken)
+        flag = calls.call(net.null)
+        missing = calls.call('not.a.connection')
+        data = calls.call(net.pass_through, b'binary')
+
+    assert double.result() == 4
+    with pytest.raises(Exception) as err:
+        error.result()
+    assert 'broken' in str(err.value)
+    assert flag.result() == 'NULL'
+    with pytest.raises(Exception):
+        missing.result()
+    assert data.result() == b'binary'
+
+    # parallel calls overlap on the peer but keep their order
+    start = time.time()
+    with net.batch(remote, parallel=True) as calls:
+        results = [calls.call(slow_double, value) for value in range(4)]
+    assert time.time() - start < 0.6
+    assert [result.result() for result in results] == [0, 2, 4, 6]
+
+    # batched calls are answered from the memo like single requests
+    runs = []
+
+    @net.connect(memoize=net.ResponseCache(ttl=10, size=8))
+    def cached(value, **kwargs):
+        runs.append(value)
+        return value
+
+    with net.batch(remote) as calls:
+        results = [calls.call(cached, 'a') for _ in range(2)]
+    assert [result.result() for result in results] == ['a', 'a']
+    assert runs == ['a']
+
+    # parallel calls share the bounded worker pool of the server
+    from net.peer.workers import WorkerPool
+
+    release = threading.Event()
+    workers = WorkerPool(size=1, queue_size=1)
+    workers.submit(release.wait, 5)
+    master.server._workers, original = workers, master.server._workers
+    try:
+        # the only worker is taken, the first call is run by the batch itself
+        # and the pool has no room for the rest
+        with net.batch((master.server.host, master.server.port), parallel=True) as calls:
+            results = [calls.call(slow_double, value) for value in range(3)]
+        assert results[0].result() == 0
+        for result in results[1:]:
+            with pytest.raises(net.PeerBusy):
+                result.result()
+    finally:
+        master.server._workers = original
+        release.set()
+
+
+def test_map(peers):
+    """
+    Test calling a connection on many peers at the same time.
+    """
+    net.LOGGER.debug("Test Header")
+
+    master, slave = peers
+
+    @net.connect()
+    def sleepy(delay, **kwargs):
+        time.sleep(delay)
+        return delay
+
+    # a port nothing is listening on
+    closed = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    closed.bind((net.HOST_IP, 0))
+    unreachable = closed.getsockname()
+    closed.close()
+
+    remote = [(master.host, master.port), (slave.host, slave.port)]
+
+    results = dict(net.map(sleepy, remote + [unreachable], 0.1))
+    assert results[remote[0]] == 0.1
+    assert results[remote[1]] == 0.1
+    assert isinstance(results[unreachable], Exception)
+
+    # slow peers are handed back as timeouts once the deadline passes
+    start = time.time()
+    results = list(net.map(sleepy, remote, 1, deadline=0.2))
+    assert time.time() - start < 0.8
+    assert len(results) == 2
+    assert all(isinstance(result, socket.timeout) for _, result in results)
+
+    # more background calls running a map than client threads don't starve the
+    # calls of the map, every client thread is held until all of them are queued.
+    from net.api import client_executor
+
+    @net.connect()
+    def fan_out(value, **kwargs):
+        return [response for _, response in net.map(net.pass_through, remote, value, deadline=5)]
+
+    release = threading.Event()
+    held = [client_executor().submit(release.wait, 10) for _ in range(net.CLIENT_LIMIT)]
+    calls = [fan_out(value, wait=False) for value in range(net.CLIENT_LIMIT + 8)]
+    release.set()
+    for future in held:
+        future.result(timeout=10)
+    assert [call.result(timeout=10) for call in calls] == [
+        [value, value] for value in range(net.CLIENT_LIMIT + 8)
+    ]
+
+    # star imports leave the builtin alone
+    namespace = {}
+    exec('from net import *', namespace)
+    exec('from net.api import *', namespace)
+    assert 'map' not in namespace
+
+
+def test_future_calls(peers):
+    """
+    Test that calls with wait=False return futures.
+    """
+    net.LOGGER.debug("Test Header")
+
+    from concurrent import futures
+
+    master, slave = peers
+
+    @net.connect()
+    def slow_echo(value, **kwargs):
+        assert 'wait' not in kwargs
+        time.sleep(0.2)
+        if value == 'fail':
+            raise ValueError("remote failure")
+        return value
+
+    remote = (slave.host, slave.port)
+
+    start = time.time()
+    calls = [slow_echo(value, peer=remote, wait=False) for value in range(3)]
+    assert time.time() - start < 0.1
+    assert all(isinstance(call, futures.Future) for call in calls)
+    assert [call.result() for call in calls] == [0, 1, 2]
+
+    failing = slow_echo('fail', peer=remote, wait=False)
+    with pytest.raises(Exception) as err:
+        failing.result()
+    assert 'RemoteError' in str(err.value)
+    assert 'remote failure' in str(err.value)
+
+    # local calls work the same way
+    assert slow_echo('local', wait=False).result() == 'local'
+
+
+def test_streaming(peers):
+    """
+    Test that generator connections stream their items.
+    """
+    net.LOGGER.debug("Test Header")
+
+    master, slave = peers
+
+    closed = threading.Event()
+
+    @net.connect()
+    def count(limit, fail=False, **kwargs):
+        try:
+            for value in range(limit):
+                if fail and value == 5:
+                    raise ValueError("stream failure")
+                yield {'value': value, 'data': b'\x00' * value}
+        finally:
+            closed.set()
+
+    remote = (slave.host, slave.port)
+
+    # many more items than the window, consumed lazily
+    items = count(200, peer=remote)
+    assert not isinstance(items, list)
+    assert [item['value'] for item in items] == list(range(200))
+    assert bytes(list(count(10, peer=remote))[-1]['data']) == b'\x00' * 9
+
+    # stopping early closes the generator on the remote peer
+    closed.clear()
+    for item in count(10 ** 6, peer=remote):
+        if item['value'] == 3:
+            break
+    assert closed.wait(5)
+
+    # errors are raised where they happened in the stream
+    received = []
+    with pytest.raises(Exception) as err:
+        for item in count(10, fail=True, peer=remote):
+            received.append(item['value'])
+    assert received == [0, 1, 2, 3, 4]
+    assert 'stream failure' in str(err.value)
+
+    # the channel is still usable afterwards
+    assert net.pass_through('after', peer=remote) == 'after'
+
+
+def test_streamed_arguments(peers):
+    """
+    Test that iterator and file object arguments are streamed.
+    """
+    net.LOGGER.debug("Test Header")
+
+    import io
+    import hashlib
+
+    master, slave = peers
+
+    produced = []
+
+    def numbers(limit):
+        for value in range(limit):
+            produced.append(value)
+            yield value
+
+    @net.connect()
+    def total(values, **kwargs):
+        assert not isinstance(values, list)
+        return sum(values)
+
+    @net.connect()
+    def first(values, count, **kwargs):
+        return [next(values) for _ in range(count)]
+
+    @net.connect()
+    def digest(handle, **kwargs):
+        checksum = hashlib.md5()
+        for chunk in iter(lambda: handle.read(10000), b''):
+            checksum.update(chunk)
+        return checksum.hexdigest()
+
+    remote = (slave.host, slave.port)
+
+    # many more items than the window
+    assert total(numbers(500), peer=remote) == sum(range(500))
+
+    # the remote peer stops the argument once the connection returns
+    del produced[:]
+    assert first(numbers(10 ** 6), 3, peer=remote) == [0, 1, 2]
+    assert len(produced) < 100
+
+    # file objects arrive as binary files
+    data = os.urandom(1024 * 1024 + 7)
+    assert digest(io.BytesIO(data), peer=remote) == hashlib.md5(data).hexdigest()
+
+    # errors in the source are raised locally
+    def broken():
+        yield 1
+        raise ValueError("source failure")
+
+    with pytest.raises(ValueError):
+        total(broken(), peer=remote)
+
+    # the channel is still usable afterwards
+    assert net.pass_through('after', peer=remote) == 'after'
+
+
+def test_response_cache(peers):
+    """
+    Test that cached connections skip repeated remote calls.
+    """
+    net.LOGGER.debug("Test Header")
+
+    master, slave = peers
+
+    calls = []
+
+    @net.connect(cache=net.ResponseCache(ttl=0.5, size=2))
+    def lookup(name, **kwargs):
+        calls.append(name)
+        return {'name': name, 'count': len(calls)}
+
+    remote = (slave.host, slave.port)
+
+    first = lookup('a', peer=remote)
+    assert lookup('a', peer=remote) == first
+    assert len(calls) == 1
+    assert lookup.cache.stats()['hits'] == 1
+
+    # keyword order doesn't matter, different arguments do
+    lookup(name='b', peer=remote)
+    assert lookup(peer=remote, name='b')['count'] == 2
+    assert len(calls) == 2
+
+    # least recently used entries are evicted
+    lookup('c', peer=remote)
+    lookup('a', peer=remote)
+    assert len(calls) == 4
+    assert lookup.cache.stats()['evictions'] >= 1
+
+    # explicit invalidation
+    assert lookup.invalidate('a', peer=remote) == 1
+    lookup('a', peer=remote)
+    assert len(calls) == 5
+    assert lookup.invalidate(peer=remote) == 2
+
+    # entries expire
+    lookup('d', peer=remote)
+    time.sleep(0.6)
+    lookup('d', peer=remote)
+    assert len(calls) == 7
+    assert lookup.cache.stats()['expirations'] == 1
+
+    # values larger than the memory bound are not cached
+    memory = net.ResponseCache(memory=100)
+    memory.put('small', 1)
+    memory.put('large', b'\x00' * 1000)
+    assert memory.get('small') == (True, 1)
+    assert memory.get('large') == (False, None)
+
+    # keys keep the types of the arguments
+    from net.peer import caches
+
+    assert caches.call_key(({1: 'x'},), {}) != caches.call_key(({'1': 'x'},), {})
+    assert caches.call_key(((1, 2),), {}) != caches.call_key(([1, 2],), {})
+    assert caches.call_key(('1',), {}) != caches.call_key((1,), {})
+    assert caches.call_key(({'b': 1, 'a': {2, 1}},), {}) == caches.call_key(({'a': {1, 2}, 'b': 1},), {})
+
+    # arguments without a canonical form are never cached
+    assert caches.call_key((object(),), {}) is None
+
+
+def test_memoize(peers):
+    """
+    Test that memoized connections answer repeated requests from the memo.
+    """
+    net.LOGGER.debug("Test Header")
+
+    master, slave = peers
+
+    calls = []
+
+    @net.connect(memoize=net.ResponseCache(ttl=10, size=8))
+    def expensive(name, **kwargs):
+        calls.append(name)
+        return {'name': name, 'data': b'\x01' * 1000}
+
+    @net.connect()
+    def update(name, **kwargs):
+        return expensive.forget(name)
+
+    remote = (slave.host, slave.port)
+
+    first = expensive('a', peer=remote)
+    second = expensive('a', peer=remote)
+    assert bytes(first['data']) == bytes(second['data']) == b'\x01' * 1000
+    assert calls == ['a']
+    assert expensive.memo.stats()['hits'] == 1
+
+    expensive('b', peer=remote)
+    assert calls == ['a', 'b']
+
+    # connections drop stale responses
+    assert update('a', peer=remote) == 1
+    expensive('a', peer=remote)
+    expensive('b', peer=remote)
+    assert calls == ['a', 'b', 'a']
+
+    assert expensive.forget() == 2
+    expensive('b', peer=remote)
+    assert calls == ['a', 'b', 'a', 'b']
+
+    # the memo keeps its own copy of the binary data in a response
+    data = bytearray(b'\x01' * 100)
+
+    @net.connect(memoize=True)
+    def shared_buffer(**kwargs):
+        return data
+
+    assert bytes(shared_buffer(peer=remote)) == b'\x01' * 100
+    data[:] = b'\x02' * 100
+    assert bytes(shared_buffer(peer=remote)) == b'\x01' * 100
+
+
+def test_single_flight(peers):
+    """
+    Test that identical requests running at the same time share one run.
+    """
+    net.LOGGER.debug("Test Header")
+
+    from concurrent import futures
+
+    master, slave = peers
+
+    runs = []
+
+    @net.connect(single_flight=True)
+    def slow_state(name, **kwargs):
+        runs.append(name)
+        time.sleep(0.3)
+        return {'name': name, 'runs': len(runs)}
+
+    remote = (slave.host, slave.port)
+
+    # the serving peer runs overlapping requests once
+    def request(_):
+        return master.execute(remote, slow_state.connection, ['a'], {})
+
+    with futures.ThreadPoolExecutor(max_workers=6) as pool:
+        results = list(pool.map(request, range(6)))
+    assert runs == ['a']
+    assert all(result == results[0] for result in results)
+
+    # overlapping calls from threads of the calling peer share a round trip
+    with futures.ThreadPoolExecutor(max_workers=6) as pool:
+        results = list(pool.map(lambda _: slow_state('b', peer=remote), range(6)))
+    assert runs == ['a', 'b']
+    assert slow_state.flight.stats()['shared'] == 5
+
+    # calls that don't overlap run again
+    slow_state('b', peer=remote)
+    assert runs == ['a', 'b', 'b']
+
+    # a waiting call gives up at its own time out, not the running call's
+    with futures.ThreadPoolExecutor(max_workers=1) as pool:
+        leader = pool.submit(slow_state, 'c', peer=remote)
+        time.sleep(0.05)
+        start = time.time()
+        with pytest.raises(socket.timeout):
+            slow_state('c', peer=remote, time_out=0.05)
+        assert time.time() - start < 0.2
+        assert leader.result()['name'] == 'c'
+
+
+def test_deadlines(peers):
+    """
+    Test that time outs travel as deadlines instead of keyword arguments.
+    """
+    net.LOGGER.debug("Test Header")
+
+    from net.peer.handler import PeerHandler
+    from net.peer import codecs
+    from net.peer.context import scope
+
+    master, slave = peers
+
+    seen = {}
+
+    @net.connect()
+    def strict(value, peer=None):
+        seen['strict'] = net.context().remaining()
+        return value
+
+    @net.connect()
+    def relay(value, peer=None):
+        seen['relay'] = net.context().remaining()
+        time.sleep(0.2)
+        return strict(value, peer=(slave.host, slave.port))
+
+    remote = (slave.host, slave.port)
+
+    # time_out is no longer passed on to the connection
+    assert strict('a', peer=remote) == 'a'
+    assert seen['strict'] is None
+    assert strict('b', peer=remote, time_out=5) == 'b'
+    assert 0 < seen['strict'] <= 5
+    assert strict('c', time_out=5) == 'c'
+
+    # neither are peer and time_out on a local async call
+    @net.connect()
+    def local(value):
+        return value
+
+    import asyncio
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(local.async_call('c', peer=None, time_out=5)) == 'c'
+    finally:
+        loop.close()
+
+    # nested calls get what is left of the deadline
+    assert relay('d', peer=remote, time_out=2) == 'd'
+    assert seen['relay'] <= 2
+    assert 0 < seen['strict'] <= seen['relay'] - 0.2
+
+    # expired requests are dropped before they run
+    seen.clear()
+    json_codec = codecs.get_codec(codecs.JsonCodec.id)
+    codec, response, _ = PeerHandler.execute(json_codec, strict, ['e'], {}, deadline=time.time() - 1)
+    assert 'DeadlineExceeded' in codec.decode(response)['traceback']
+    assert 'strict' not in seen
+
+    # there is nothing left to give a nested call
+    with scope(time.time() - 1):
+        with pytest.raises(net.DeadlineExceeded):
+            strict('f', peer=remote)
+
+    # outside of a request there is no deadline
+    assert net.context().remaining() is None
+
+
+def test_circuit_breaker(peers):
+    """
+    Test that peers failing too many requests in a row are skipped.
+    """
+    net.LOGGER.debug("Test Header")
+
+    from net.peer import breakers
+    from net.peer.channel import ConnectTimeout
+
+    master, slave = peers
+
+    # closed -> open -> half open -> open -> half open -> closed
+    breaker = breakers.CircuitBreaker(threshold=2, reset=0.2)
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.state == breakers.CLOSED
+    breaker.failure()
+    assert breaker.state == breakers.OPEN
+    assert not breaker.allow()
+
+    time.sleep(0.25)
+    assert breaker.state == breakers.HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.failure()
+    assert breaker.state == breakers.OPEN
+
+    time.sleep(0.25)
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.state == breakers.CLOSED
+    assert breaker.stats()['trips'] == 2
+    assert breaker.stats()['rejected'] == 2
+
+    # only connection level errors count as failures
+    probe = ('probe', 1)
+    breakers.BREAKERS[probe] = breaker = breakers.CircuitBreaker(threshold=1, reset=0.01)
+    try:
+        for err in (socket.timeout(), net.DeadlineExceeded(), ValueError()):
+            with pytest.raises(type(err)):
+                with breakers.guard(*probe):
+                    raise err
+        assert breaker.state == breakers.CLOSED
+
+        with pytest.raises(socket.timeout):
+            with breakers.guard(*probe):
+                raise ConnectTimeout()
+        assert breaker.state == breakers.OPEN
+
+        # a probe that is interrupted lets the next request probe
+        time.sleep(0.02)
+        with pytest.raises(KeyboardInterrupt):
+            with breakers.guard(*probe) as allowed:
+                assert allowed
+                raise KeyboardInterrupt
+        assert breaker.ready()
+    finally:
+        breakers.reset(*probe)
+
+    # a slow peer is not a dead one
+    @net.connect()
+    def sluggish(value, **kwargs):
+        time.sleep(0.2)
+        return value
+
+    for _ in range(net.BREAKER_THRESHOLD + 1):
+        with pytest.raises(socket.timeout):
+            sluggish('a', peer=(slave.host, slave.port), time_out=0.01)
+    assert breakers.breaker(slave.host, slave.port).state == breakers.CLOSED
+
+    # an address nothing listens on
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind((master.host, 0))
+    dead = (master.host, sock.getsockname()[1])
+    sock.close()
+
+    try:
+        for _ in range(net.BREAKER_THRESHOLD):
+            with pytest.raises(socket.error) as err:
+                net.pass_through('a', peer=dead)
+            assert not isinstance(err.value, net.PeerUnavailable)
+
+        assert breakers.breaker(*dead).state == breakers.OPEN
+
+        # open breakers fail straight away through the UNAVAILABLE flag
+        response = master.server.request(dead[0], dead[1], 'net.defaults.handlers.pass_through', (), {})
+        assert response == 'UNAVAILABLE'
+        with pytest.raises(net.PeerUnavailable):
+            net.pass_through('a', peer=dead)
+
+        # events skip the subscription instead of pruning it
+        master.register_subscriber('breaker_event', dead[0], dead[1], 'net.defaults.handlers.pass_through')
+        master.trigger_event('breaker_event', 'a')
+        assert dead in master.registered_subscriptions['breaker_event']
+
+        # healthy peers are unaffected
+        assert breakers.breaker(slave.host, slave.port).state == breakers.CLOSED
+        assert net.pass_through('b', peer=slave) == 'b'
+        assert breakers.stats()[dead]['rejected'] >= 2
+
+    finally:
+        master.registered_subscriptions.pop('breaker_event', None)
+        breakers.reset(*dead)
+
+
+def test_discovery_breakers(peers):
+    """
+    Test that sweeping empty ports doesn't open breakers on them.
+    """
+    net.LOGGER.debug("Test Header")
+
+    import sys
+    import subprocess
+    from net.peer import balancer, breakers
+
+    master, slave = peers
+
+    # sweep a few more ports than the peers use, nothing listens on the last
+    saved = net.PORT_RANGE
+    net.PORT_RANGE += 5
+    empty = net.PORT_START + net.PORT_RANGE - 1
+    process = None
+
+    try:
+        for _ in range(net.BREAKER_THRESHOLD + 1):
+            net.peers(on_host=True, refresh=True)
+
+        # scanned addresses get neither a breaker nor load figures
+        assert (net.HOST_IP, empty) not in breakers.BREAKERS
+        assert (net.HOST_IP, empty) not in balancer.LOADS
+
+        # a peer started on a swept port is found on the next sweep
+        process = subprocess.Popen(
+            [
+                sys.executable, '-c',
+                'import sys, net; print(net.Peer().port); sys.stdout.flush(); sys.stdin.read()'
+            ],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            env=dict(os.environ, NET_PORT=str(empty), NET_PORT_RANGE='1'),
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        )
+        assert int(process.stdout.readline()) == empty
+
+        found = net.peers(on_host=True, refresh=True)
+        assert empty in [peer.port for peer in found['peers'].values()]
+
+    finally:
+        net.PORT_RANGE = saved
+        if process is not None:
+            process.stdin.close()
+            process.wait()
+
+
+def test_hedged_requests(peers):
+    """
+    Test hedging and retrying calls across the peers of a group.
+    """
+    net.LOGGER.debug("Test Header")
+
+    from concurrent import futures
+    from net.api import client_executor
+    from net.peer import breakers, replicas
+
+    master, slave = peers
+
+    def call(peer):
+        if peer == 'slow':
+            time.sleep(0.5)
+        elif peer == 'dead':
+            raise socket.error("unreachable")
+        elif peer == 'broken':
+            raise ValueError("remote failure")
+        return peer
+
+    executor = futures.ThreadPoolExecutor(max_workers=4)
+
+    try:
+        # the backup request answers first
+        start = time.time()
+        assert replicas.hedge(executor, call, ['slow', 'fast'], hedge_after=0.05) == 'fast'
+        assert time.time() - start < 0.4
+
+        # peers that can't be reached are retried on the next one
+        assert replicas.hedge(executor, call, ['dead', 'fast']) == 'fast'
+        with pytest.raises(socket.error):
+            replicas.hedge(executor, call, ['dead', 'fast'], retries=0)
+
+        # errors raised by the connection itself are not retried
+        with pytest.raises(ValueError):
+            replicas.hedge(executor, call, ['broken', 'fast'])
+
+        # nobody answered in time
+        with pytest.raises(net.DeadlineExceeded):
+            replicas.hedge(executor, call, ['slow', 'slow'], hedge_after=0.01, time_out=0.1)
+
+        # a spent budget stops hedging, the call waits on the first request
+        budget = replicas.RetryBudget(ratio=0, minimum=1)
+        assert replicas.hedge(executor, call, ['slow', 'fast'], hedge_after=0.05, budget=budget) == 'fast'
+        assert replicas.hedge(executor, call, ['slow', 'fast'], hedge_after=0.05, budget=budget) == 'slow'
+        assert budget.stats() == {'calls': 2, 'extra': 1, 'denied': 1}
+
+    finally:
+        executor.shutdown()
+
+    # an address nothing listens on
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind((master.host, 0))
+    dead = (master.host, sock.getsockname()[1])
+    sock.close()
+
+    try:
+        group = [dead, (slave.host, slave.port)]
+        for value in range(3):
+            assert net.pass_through(value, group=group, hedge_after=0.5, time_out=5) == value
+
+        assert replicas.retry_budget(group).stats()['calls'] == 3
+
+    finally:
+        breakers.reset(*dead)
+
+    # more background group calls than client threads don't starve their requests,
+    # every client thread is held until all the calls are queued.
+    group = [(slave.host, slave.port)]
+    release = threading.Event()
+    held = [client_executor().submit(release.wait, 10) for _ in range(net.CLIENT_LIMIT)]
+    calls = [
+        net.pass_through(value, group=group, wait=False)
+        for value in range(net.CLIENT_LIMIT + 8)
+    ]
+    release.set()
+    futures.wait(held)
+    assert [call.result(timeout=10) for call in calls] == list(range(net.CLIENT_LIMIT + 8))
+
+
+def test_load_balancing(peers):
+    """
+    Test that peers report their load and calls are routed to the least busy.
+    """
+    net.LOGGER.debug("Test Header")
+
+    from net.peer import balancer
+
+    master, slave = peers
+    remote = (slave.host, slave.port)
+
+    # calls to a peer picked with net.route ask for its load while it is missing
+    balancer.LOADS.pop(remote, None)
+    assert net.pass_through('a', peer=net.route([remote])) == 'a'
+    reported = balancer.load(*remote).stats()['reported']
+    assert reported is not None
+
+    # and not again until the report goes stale
+    assert net.pass_through('a', peer=remote) == 'a'
+    assert balancer.load(*remote).stats()['reported'] == reported
+
+    balancer.load(*remote)._reported -= balancer.STALE
+    assert net.pass_through('a', peer=net.route([remote])) == 'a'
+    assert balancer.load(*remote).stats()['reported'] > reported
+
+    # calls routed by the balancer always ask
+    reported = balancer.load(*remote).stats()['reported']
+    assert net.pass_through('a', group=[remote]) == 'a'
+    stats = balancer.load(*remote).stats()
+    assert stats['reported'] > reported
+    assert stats['reported'] is not None
+    assert stats['latency'] is not None
+    assert stats['outstanding'] == 0
+
+    busy, idle = ('busy', 1), ('idle', 2)
+    try:
+        # the same round trip but a deep queue
+        for address in (busy, idle):
+            balancer.load(*address).start()
+            balancer.load(*address).finish(0.1)
+        balancer.load(*busy).update(10, 5, 0.5)
+        assert balancer.load(*busy).cost() > balancer.load(*idle).cost()
+
+        assert all(balancer.pick([busy, idle]) == idle for _ in range(10))
+        assert balancer.rank([busy, idle]) == [idle, busy]
+        assert net.route([busy, idle]) == idle
+
+        # peers that were never called are tried
+        assert balancer.pick([busy, remote, ('new', 3)]) in (remote, ('new', 3))
+
+        # outstanding requests count against a peer
+        for _ in range(20):
+            balancer.load(*idle).start()
+        assert net.route([busy, idle]) == busy
+
+    finally:
+        for address in (busy, idle, ('new', 3)):
+            balancer.LOADS.pop(address, None)
+
+    assert balancer.pick([]) is None
+    assert net.route([]) is None
+
+
+def test_hash_ring(peers):
+    """
+    Test routing calls by key over a consistent hash ring.
+    """
+    net.LOGGER.debug("Test Header")
+
+    from net.peer import rings
+
+    master, slave = peers
+
+    shards = [('shard', port) for port in range(5)]
+    keys = ['entity_{0}'.format(index) for index in range(1000)]
+
+    ring = rings.HashRing(shards)
+    owners = dict((key, ring.lookup(key)) for key in keys)
+
+    # keys spread over every peer and always land on the same one
+    assert set(owners.values()) == set(shards)
+    assert all(rings.HashRing(reversed(shards)).lookup(key) == owners[key] for key in keys)
+    assert ring.preference('entity_0', 3)[0] == owners['entity_0']
+    assert len(set(ring.preference('entity_0'))) == 5
+
+    # a new peer only takes keys, about a sixth of them
+    ring.add(('shard', 5))
+    moved = [key for key in keys if ring.lookup(key) != owners[key]]
+    assert all(ring.lookup(key) == ('shard', 5) for key in moved)
+    assert 50 < len(moved) < 350
+
+    # a peer leaving only hands off its own keys
+    ring.update(shards[1:])
+    assert ('shard', 0) not in ring and len(ring) == 4
+    for key in keys:
+        if owners[key] != ('shard', 0):
+            assert ring.lookup(key) == owners[key]
+
+    # calls for a key always go to the peer owning it
+    group = [(master.host, master.port), (slave.host, slave.port)]
+    owner = rings.ring(group).lookup(42)
+    assert net.route(group, key=42) == owner
+    assert net.pass_through('value', group=group, route_key=42) == 'value'
+    assert rings.HashRing().lookup('key') is None
+
+    # rings and retry budgets of explicit peer lists don't pile up
+    from net.peer import replicas
+
+    for port in range(rings.RING_LIMIT + 10):
+        rings.ring([('shard', port)])
+        replicas.retry_budget([('shard', port)])
+    assert len(rings.RINGS) == rings.RING_LIMIT
+    assert len(replicas.BUDGETS) == replicas.BUDGET_LIMIT
+    assert frozenset([('shard', 0)]) not in rings.RINGS
+
+
+def test_event_queue(peers):
+    """
+    Test that events are delivered in the background.
+    """
+    net.LOGGER.debug("Test Header")
+
+    from net.peer.events import EventQueue
+
+    master, slave = peers
+
+    def fill(policy):
+        gate = threading.Event()
+        delivered = []
+
+        def deliver(event, args, kwargs):
+            gate.wait()
+            delivered.append(args[0])
+
+        queue = EventQueue(deliver, size=2, policy=policy, workers=1)
+
+        # the first event is being delivered, the next two fill the queue
+        assert queue.put('event', (0,), {})
+        while not queue.stats()['dispatching']:
+            time.sleep(0.001)
+        assert queue.put('event', (1,), {})
+        assert queue.put('event', (2,), {})
+
+        return queue, gate, delivered
+
+    queue, gate, delivered = fill('drop_newest')
+    assert not queue.put('event', (3,), {})
+    assert not queue.flush(0.05)
+    gate.set()
+    assert queue.flush(5)
+    assert delivered == [0, 1, 2]
+    assert queue.stats()['dropped'] == 1
+    assert queue.stats()['max_depth'] == 2
+    assert queue.stats()['delivered'] == 3
+
+    queue, gate, delivered = fill('drop_oldest')
+    assert queue.put('event', (3,), {})
+    gate.set()
+    assert queue.flush(5)
+    assert delivered == [0, 2, 3]
+
+    queue, gate, delivered = fill('block')
+    blocked = threading.Thread(target=queue.put, args=('event', (3,), {}))
+    blocked.start()
+    blocked.join(0.1)
+    assert blocked.is_alive()
+    gate.set()
+    blocked.join(5)
+    assert queue.flush(5)
+    assert delivered == [0, 1, 2, 3]
+
+    with pytest.raises(ValueError):
+        EventQueue(lambda *args: None, policy='drop_everything')
+
+    # triggering returns straight away, flushing waits for the subscribers
+    received = []
+
+    @net.subscribe('queued_event', peers=slave)
+    def handle_queued_event(value):
+        time.sleep(0.05)
+        received.append(value)
+
+    @net.event('queued_event')
+    def queued_event(*args, **kwargs):
+        return args, kwargs
+
+    start = time.time()
+    for value in range(5):
+        queued_event(value)
+    if net.EVENT_WORKERS > 0:
+        assert time.time() - start < 0.2
+
+    assert net.flush(10)
+    assert received == list(range(5))
+    assert net.Peer().events.stats()['queued'] == 0